@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+用于基准测试的本地Canvas接口
+实现下载器用到的几个Files API端点(课程信息、分页的文件和文件夹列表、文件下载重定向)，
+和真实的Canvas一样，文件内容由另一个端口上的文件服务器提供(支持Range，不限流)。可以配置文件数量和大小、每页条数上限、每个请求的延迟、X-Rate-Limit-Remaining限流和随机错误率。
+"""
+
+import re
+import json
+import hashlib
+import time
+import random
+import threading
+import socketserver
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+# Canvas的限流桶容量
+RATE_LIMIT_CAPACITY = 700.0
+# 返回文件内容时每次写入的块大小
+BLOCK_SIZE = 64 * 1024
+_BLOCK = bytes(range(256)) * (BLOCK_SIZE // 256)
+
+
+class FakeCanvasConfig:
+    """模拟的课程内容和服务器行为"""
+
+    def __init__(self, courses=1, files=100, size=100 * 1024, page_size=100, latency=0.0,
+                 rate_limit=None, error_rate=0.0, seed=0):
+        self.courses = courses
+        self.files = files
+        self.size = size
+        # Canvas忽略超过上限的per_page
+        self.page_size = page_size
+        # 每个请求在返回前等待的秒数
+        self.latency = latency
+        # 限流桶每秒恢复的额度，None表示不限流也不返回X-Rate-Limit-Remaining
+        self.rate_limit = rate_limit
+        # 接口和下载请求返回502的概率
+        self.error_rate = error_rate
+        self.seed = seed
+
+    def to_dict(self):
+        return dict(self.__dict__)
+
+
+class FakeCanvasStats:
+    """服务器端统计，线程安全"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.throttled = 0
+        self.injected_errors = 0
+        self.not_modified = 0
+        self.bytes_sent = 0
+        self.first_byte_at = None
+
+    def add(self, name, value=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + value)
+
+    def sent(self, nbytes):
+        with self._lock:
+            if self.first_byte_at is None:
+                self.first_byte_at = time.time()
+            self.bytes_sent += nbytes
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "throttled": self.throttled,
+                "injected_errors": self.injected_errors,
+                "not_modified": self.not_modified,
+                "bytes_sent": self.bytes_sent,
+                "first_byte_at": self.first_byte_at,
+            }
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # 响应头和正文分两次写出，开启Nagle算法时与客户端的延迟确认叠加，每个响应多等约40毫秒
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        server.stats.add("requests")
+        if server.config.latency:
+            time.sleep(server.config.latency)
+        url = urlparse(self.path)
+
+        remaining = server.take_quota()
+        if remaining is not None and remaining < 0:
+            server.stats.add("throttled")
+            return self.send_body(403, b"403 Forbidden (Rate Limit Exceeded)", remaining=0)
+        if server.config.error_rate and server.random() < server.config.error_rate:
+            server.stats.add("injected_errors")
+            return self.send_body(502, b'{"errors":[{"message":"Bad Gateway"}]}', remaining=remaining)
+
+        m = re.match(r"/api/v1/courses/(\d+)$", url.path)
+        if m and server.has_course(int(m.group(1))):
+            course_id = int(m.group(1))
+            return self.send_json({"id": course_id, "course_code": f"BENCH{course_id}",
+                                   "name": f"Benchmark {course_id}"}, remaining=remaining)
+        m = re.match(r"/api/v1/courses/(\d+)/(files|folders)$", url.path)
+        if m and server.has_course(int(m.group(1))):
+            return self.send_page(int(m.group(1)), m.group(2), parse_qs(url.query), remaining)
+        m = re.match(r"/files/(\d+)/download$", url.path)
+        if m:
+            self.send_response(302)
+            self.send_header("Location", f"{server.files_server.base_url}/blob/{m.group(1)}")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_body(404, b'{"errors":[{"message":"The specified resource does not exist."}]}',
+                       remaining=remaining)
+
+    def send_body(self, status, body, content_type="application/json", headers=None, remaining=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        if remaining is not None:
+            self.send_header("X-Rate-Limit-Remaining", f"{max(remaining, 0):.1f}")
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, data, headers=None, remaining=None):
+        body = json.dumps(data).encode("utf-8")
+        # 和Canvas一样为JSON响应生成ETag，条件请求的内容没有变化时返回304
+        etag = 'W/"%s"' % hashlib.md5(body).hexdigest()
+        if self.headers.get("If-None-Match") == etag:
+            self.server.stats.add("not_modified")
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            if remaining is not None:
+                self.send_header("X-Rate-Limit-Remaining", f"{max(remaining, 0):.1f}")
+            self.end_headers()
+            return
+        self.send_body(200, body, headers=dict(headers or {}, ETag=etag), remaining=remaining)
+
+    def send_page(self, course_id, kind, query, remaining):
+        items = self.server.folders(course_id) if kind == "folders" else self.server.list_files(course_id)
+        per_page = min(int(query.get("per_page", ["10"])[0]), self.server.config.page_size)
+        page = int(query.get("page", ["1"])[0])
+        last = max(1, (len(items) + per_page - 1) // per_page)
+        chunk = items[(page - 1) * per_page: page * per_page]
+        base = f"http://{self.headers['Host']}/api/v1/courses/{course_id}/{kind}"
+        links = []
+        if page < last:
+            links.append(f'<{base}?page={page + 1}&per_page={per_page}>; rel="next"')
+        links.append(f'<{base}?page=1&per_page={per_page}>; rel="first"')
+        links.append(f'<{base}?page={last}&per_page={per_page}>; rel="last"')
+        self.send_json(chunk, {"Link": ",".join(links)}, remaining)
+
+    def send_blob(self):
+        size = self.server.config.size
+        start, end, status = 0, size - 1, 200
+        match = re.match(r"bytes=(\d+)-(\d*)$", self.headers.get("Range") or "")
+        if match and int(match.group(1)) < size:
+            start = int(match.group(1))
+            end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+            status = 206
+        self.send_response(status)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("Accept-Ranges", "bytes")
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.end_headers()
+        position = start
+        while position <= end:
+            offset = position % BLOCK_SIZE
+            chunk = _BLOCK[offset:offset + min(BLOCK_SIZE - offset, end - position + 1)]
+            self.wfile.write(chunk)
+            self.server.stats.sent(len(chunk))
+            position += len(chunk)
+
+
+class _FileHandler(_Handler):
+    """文件服务器只提供文件内容"""
+
+    def do_GET(self):
+        server = self.server
+        server.stats.add("requests")
+        if server.config.latency:
+            time.sleep(server.config.latency)
+        if server.config.error_rate and server.api.random() < server.config.error_rate:
+            server.stats.add("injected_errors")
+            return self.send_body(502, b"Bad Gateway", "text/plain")
+        if re.match(r"/blob/(\d+)$", urlparse(self.path).path):
+            return self.send_blob()
+        self.send_body(404, b"Not Found", "text/plain")
+
+
+class _FileServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, api, host):
+        super().__init__((host, 0), _FileHandler)
+        self.api = api
+        self.config = api.config
+        self.stats = api.stats
+
+    @property
+    def base_url(self):
+        return f"http://{self.server_address[0]}:{self.server_address[1]}"
+
+
+class FakeCanvasServer(socketserver.ThreadingMixIn, HTTPServer):
+    """在后台线程中运行的模拟Canvas服务器"""
+
+    daemon_threads = True
+
+    def __init__(self, config=None, host="127.0.0.1", port=0):
+        super().__init__((host, port), _Handler)
+        self.config = config or FakeCanvasConfig()
+        self.stats = FakeCanvasStats()
+        self._random = random.Random(self.config.seed)
+        self._lock = threading.Lock()
+        self._quota = RATE_LIMIT_CAPACITY
+        self._quota_at = time.monotonic()
+        self._files = {}
+        self.files_server = _FileServer(self, host)
+
+    @property
+    def base_url(self):
+        return f"http://{self.server_address[0]}:{self.server_address[1]}"
+
+    def course_ids(self):
+        return list(range(1, self.config.courses + 1))
+
+    def has_course(self, course_id):
+        return 1 <= course_id <= self.config.courses
+
+    def random(self):
+        with self._lock:
+            return self._random.random()
+
+    def take_quota(self):
+        """消耗一次限流额度，返回剩余额度；未启用限流时返回None"""
+        if self.config.rate_limit is None:
+            return None
+        with self._lock:
+            now = time.monotonic()
+            self._quota = min(RATE_LIMIT_CAPACITY, self._quota + (now - self._quota_at) * self.config.rate_limit)
+            self._quota_at = now
+            self._quota -= 1
+            return self._quota
+
+    def folders(self, course_id):
+        return [{"id": course_id * 10, "full_name": "course files"},
+                {"id": course_id * 10 + 1, "full_name": "course files/Lectures"}]
+
+    def list_files(self, course_id):
+        files = self._files.get(course_id)
+        if files is None:
+            files = []
+            for index in range(self.config.files):
+                file_id = course_id * 1000000 + index
+                files.append({
+                    "id": file_id,
+                    "display_name": f"file{index}.bin",
+                    "filename": f"file{index}.bin",
+                    "folder_id": course_id * 10 + index % 2,
+                    "size": self.config.size,
+                    "content-type": "application/octet-stream",
+                    "url": f"{self.base_url}/files/{file_id}/download",
+                    "created_at": "2024-01-01T00:00:00Z",
+                    "updated_at": "2024-01-01T00:00:00Z",
+                    "modified_at": "2024-01-01T00:00:00Z",
+                })
+            self._files[course_id] = files
+        return files
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name="fake-canvas", daemon=True).start()
+        threading.Thread(target=self.files_server.serve_forever, name="fake-canvas-files", daemon=True).start()
+        return self
+
+    def stop(self):
+        for server in (self, self.files_server):
+            server.shutdown()
+            server.server_close()
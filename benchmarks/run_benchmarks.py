@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+下载器基准测试
+每个场景启动一个本地的模拟Canvas服务器(见fake_canvas)，在独立的子进程中运行命令行的
+canvas_downloader.main 或图形界面的 DownloadThread，记录文件数/秒、MB/秒、首字节时间、
+峰值内存和CPU时间，结果写入JSON文件，便于比较不同版本。
+
+    python benchmarks/run_benchmarks.py                       # 运行所有场景
+    python benchmarks/run_benchmarks.py --quick -s small-files  # 缩小规模，只运行一个场景
+    python benchmarks/run_benchmarks.py --compare 上次的结果.json
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import logging
+import platform
+import tempfile
+import subprocess
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from fake_canvas import FakeCanvasConfig, FakeCanvasServer
+
+CHILD_TIMEOUT = 1800
+# 比较结果时变化小于该百分比视为测量误差
+NOISE_PERCENT = 5.0
+
+# server 是FakeCanvasConfig的参数；driver为cli(canvas_downloader.main)或gui(DownloadThread)
+SCENARIOS = {
+    "small-files": {
+        "description": "大量小文件，逐个传输",
+        "server": {"courses": 2, "files": 500, "size": 16 * 1024, "latency": 0.005},
+        "driver": "cli", "engine": "native", "jobs": 2,
+    },
+    "small-files-async": {
+        "description": "大量小文件，课程内并发传输",
+        "server": {"courses": 2, "files": 500, "size": 16 * 1024, "latency": 0.005},
+        "driver": "cli", "engine": "async", "jobs": 2,
+    },
+    "large-files": {
+        "description": "少量大文件，受带宽和磁盘写入限制",
+        "server": {"courses": 1, "files": 10, "size": 16 * 1024 * 1024},
+        "driver": "cli", "engine": "native", "jobs": 1,
+    },
+    "high-latency": {
+        "description": "每个请求50毫秒延迟",
+        "server": {"courses": 1, "files": 200, "size": 64 * 1024, "latency": 0.05},
+        "driver": "cli", "engine": "async", "jobs": 1,
+    },
+    "small-pages": {
+        "description": "每页最多10条，列表需要大量分页请求",
+        "server": {"courses": 1, "files": 1000, "size": 4 * 1024, "page_size": 10, "latency": 0.005},
+        "driver": "cli", "engine": "native", "jobs": 1,
+    },
+    "rate-limited": {
+        "description": "限流额度每秒恢复50，需要根据X-Rate-Limit-Remaining减速",
+        "server": {"courses": 2, "files": 400, "size": 8 * 1024, "rate_limit": 50.0},
+        "driver": "cli", "engine": "native", "jobs": 2,
+    },
+    "flaky": {
+        "description": "3%的请求返回502，需要重试",
+        "server": {"courses": 2, "files": 200, "size": 32 * 1024, "error_rate": 0.03},
+        "driver": "cli", "engine": "native", "jobs": 2, "args": ["--retry-delay", "1"],
+    },
+    "gui": {
+        "description": "图形界面的下载线程",
+        "server": {"courses": 2, "files": 200, "size": 32 * 1024, "latency": 0.005},
+        "driver": "gui", "engine": "native", "jobs": 2,
+    },
+}
+
+# 比较结果时显示的指标: (字段, 名称, 数值越大越好)
+COMPARED_METRICS = [
+    ("files_per_second", "文件/秒", True),
+    ("mb_per_second", "MB/秒", True),
+    ("time_to_first_byte", "首字节(秒)", False),
+    ("peak_rss_mb", "峰值内存(MB)", False),
+    ("cpu_seconds", "CPU(秒)", False),
+]
+
+
+def scaled(server, quick):
+    """--quick 时减少文件数量和大小"""
+    server = dict(server)
+    if quick:
+        server["files"] = max(10, server["files"] // 10)
+        server["size"] = max(1024, server["size"] // 4)
+    return server
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux上单位为KB，macOS上为字节
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def count_downloads(directory):
+    """统计下载目录中已完成的文件数量和字节数"""
+    files = nbytes = 0
+    for root, _, names in os.walk(directory):
+        for name in names:
+            if name.endswith(".bin"):
+                files += 1
+                nbytes += os.path.getsize(os.path.join(root, name))
+    return files, nbytes
+
+
+def run_cli(spec, config_dir):
+    import canvas_downloader
+    sys.argv = ["canvas-downloader", "-d", config_dir, "--engine", spec["engine"],
+                "-j", str(spec["jobs"]), "--no-http-cache"] + spec.get("args", [])
+    return canvas_downloader.main() == 0
+
+
+def run_gui(spec, config_file, work_dir):
+    from PyQt5.QtCore import QCoreApplication
+    from canvas_downloader_gui import DownloadThread
+    from canvas_jobs import JobQueue
+
+    app = QCoreApplication.instance() or QCoreApplication([])
+    queue = JobQueue(os.path.join(work_dir, "jobs.db"))
+    outcome = {}
+
+    def finished(success, message):
+        outcome["success"] = success
+        app.quit()
+
+    thread = DownloadThread(config_file, 300, spec["jobs"], spec["engine"], queue)
+    thread.finished_signal.connect(finished)
+    thread.start()
+    app.exec_()
+    thread.wait()
+    queue.close()
+    return outcome.get("success", False)
+
+
+def run_child(spec):
+    """在子进程中运行一个场景，结果以一行JSON输出到标准输出"""
+    sys.path.insert(0, REPO_DIR)
+    work_dir = tempfile.mkdtemp(prefix="canvas-bench-")
+    # ~/.cache 下的HTTP缓存、下载速度记录、去重存储和任务队列都写到临时目录，不影响真实的记录；
+    # 必须在导入之前设置，各模块在导入时确定默认路径
+    for name in ("HOME", "USERPROFILE"):
+        os.environ[name] = work_dir
+    os.environ["XDG_CACHE_HOME"] = os.path.join(work_dir, ".cache")
+    # 导入放在计时之前，只测量同步本身
+    try:
+        if spec["driver"] == "gui":
+            import PyQt5.QtCore  # noqa: F401
+            import canvas_downloader_gui  # noqa: F401
+        else:
+            import canvas_downloader  # noqa: F401
+    except ImportError as e:
+        print(json.dumps({"skipped": f"无法导入: {e}"}))
+        shutil.rmtree(work_dir, ignore_errors=True)
+        return 0
+    logging.disable(logging.CRITICAL)
+
+    download_dir = os.path.join(work_dir, "downloads")
+    config_dir = os.path.join(work_dir, "configs")
+    os.makedirs(config_dir)
+    config = {"token": "benchmark", "canvasURL": spec["base_url"], "courseIDs": spec["course_ids"],
+              "downloadDir": download_dir}
+    if spec["driver"] == "cli":
+        # 命令行每个课程一个配置文件，才能按 -j 并发
+        for course_id in spec["course_ids"]:
+            with open(os.path.join(config_dir, f"{course_id}.json"), 'w', encoding='utf-8') as f:
+                json.dump(dict(config, courseIDs=[course_id]), f)
+    config_file = os.path.join(config_dir, "all.json")
+    if spec["driver"] == "gui":
+        with open(config_file, 'w', encoding='utf-8') as f:
+            json.dump(config, f)
+
+    try:
+        cpu_before = os.times()
+        started_at = time.time()
+        started = time.perf_counter()
+        if spec["driver"] == "gui":
+            success = run_gui(spec, config_file, work_dir)
+        else:
+            success = run_cli(spec, config_dir)
+        elapsed = time.perf_counter() - started
+        cpu_after = os.times()
+        files, nbytes = count_downloads(download_dir)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print(json.dumps({
+        "success": success,
+        "started_at": started_at,
+        "elapsed": elapsed,
+        "files": files,
+        "bytes": nbytes,
+        "cpu_seconds": round((cpu_after.user - cpu_before.user) + (cpu_after.system - cpu_before.system), 3),
+        "peak_rss_mb": peak_rss_mb(),
+    }))
+    return 0
+
+
+def run_scenario(name, scenario, quick):
+    """启动模拟服务器，在子进程中运行场景，返回结果"""
+    server_options = scaled(scenario["server"], quick)
+    server = FakeCanvasServer(FakeCanvasConfig(**server_options)).start()
+    spec = dict(scenario, base_url=server.base_url, course_ids=server.course_ids())
+    try:
+        process = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", json.dumps(spec)],
+                                 stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                 universal_newlines=True, timeout=CHILD_TIMEOUT)
+    finally:
+        server.stop()
+    stats = server.stats.to_dict()
+
+    result = {
+        "name": name,
+        "description": scenario["description"],
+        "driver": scenario["driver"],
+        "engine": scenario["engine"],
+        "jobs": scenario["jobs"],
+        "server": server.config.to_dict(),
+    }
+    lines = process.stdout.strip().splitlines()
+    try:
+        child = json.loads(lines[-1])
+    except (IndexError, ValueError):
+        result["error"] = (process.stderr.strip().splitlines() or [f"子进程退出码 {process.returncode}"])[-1]
+        return result
+    if "skipped" in child:
+        result["skipped"] = child["skipped"]
+        return result
+
+    elapsed = child["elapsed"]
+    first_byte = stats.pop("first_byte_at")
+    result.update({
+        "success": child["success"],
+        "files_expected": server.config.courses * server.config.files,
+        "files": child["files"],
+        "bytes": child["bytes"],
+        "elapsed": round(elapsed, 3),
+        "files_per_second": round(child["files"] / elapsed, 1) if elapsed else None,
+        "mb_per_second": round(child["bytes"] / elapsed / (1024 * 1024), 2) if elapsed else None,
+        "time_to_first_byte": round(first_byte - child["started_at"], 3) if first_byte else None,
+        "peak_rss_mb": child["peak_rss_mb"],
+        "cpu_seconds": child["cpu_seconds"],
+        "server_stats": stats,
+    })
+    return result
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR,
+                                       stderr=subprocess.DEVNULL, universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def format_result(result):
+    if "skipped" in result:
+        return f"{result['name']}: 跳过 ({result['skipped']})"
+    if "error" in result:
+        return f"{result['name']}: 运行失败 ({result['error']})"
+    status = "" if result["success"] and result["files"] == result["files_expected"] else " [未全部成功]"
+    ttfb = result["time_to_first_byte"]
+    return (f"{result['name']}: {result['files']}/{result['files_expected']} 个文件 {result['elapsed']:.2f}秒, "
+            f"{result['files_per_second']} 文件/秒, {result['mb_per_second']} MB/秒, "
+            f"首字节 {'-' if ttfb is None else f'{ttfb:.3f}秒'}, 峰值内存 {result['peak_rss_mb']} MB, "
+            f"CPU {result['cpu_seconds']}秒, 请求 {result['server_stats']['requests']} 次{status}")
+
+
+def compare(report, baseline):
+    """打印与基准结果相比各指标的变化"""
+    previous = {result["name"]: result for result in baseline.get("results", [])}
+    print(f"\n与 {baseline.get('revision') or baseline.get('created')} 比较:")
+    for result in report["results"]:
+        old = previous.get(result["name"])
+        if not old or "elapsed" not in old or "elapsed" not in result:
+            continue
+        changes = []
+        for key, label, higher_is_better in COMPARED_METRICS:
+            before, after = old.get(key), result.get(key)
+            if not before or after is None:
+                continue
+            change = (after - before) / before * 100
+            worse = change < -NOISE_PERCENT if higher_is_better else change > NOISE_PERCENT
+            changes.append(f"{label} {before} -> {after} ({change:+.1f}%{' 变差' if worse else ''})")
+        print(f"  {result['name']}: " + "; ".join(changes))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Canvas下载器基准测试")
+    parser.add_argument("-s", "--scenario", action="append", choices=sorted(SCENARIOS),
+                        help="只运行指定的场景，可以重复指定")
+    parser.add_argument("--quick", action="store_true", help="缩小文件数量和大小，快速检查")
+    parser.add_argument("-o", "--output", help="结果JSON文件路径(默认 benchmark-时间.json)")
+    parser.add_argument("--compare", metavar="JSON", help="与之前的结果文件比较")
+    parser.add_argument("--list", action="store_true", help="列出所有场景")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.child:
+        return run_child(json.loads(args.child))
+    if args.list:
+        for name, scenario in SCENARIOS.items():
+            print(f"{name}: {scenario['description']}")
+        return 0
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+
+    report = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "quick": args.quick,
+        "results": [],
+    }
+    for name in args.scenario or list(SCENARIOS):
+        result = run_scenario(name, SCENARIOS[name], args.quick)
+        report["results"].append(result)
+        print(format_result(result), flush=True)
+
+    output = args.output or f"benchmark-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"结果已写入 {output}")
+
+    if baseline:
+        compare(report, baseline)
+    failed = [r for r in report["results"] if "error" in r or ("success" in r and not r["success"])]
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
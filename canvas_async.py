@@ -0,0 +1,497 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+基于asyncio的并发下载引擎
+同一课程内的多个文件同时传输，每个主机维护一组HTTP/1.1长连接，数据块直接写入磁盘。
+适合有大量小文件、受延迟而不是带宽限制的课程。
+"""
+
+import os
+import ssl
+import asyncio
+import logging
+from urllib.parse import urlparse, urljoin
+
+from canvas_engine import (CanvasAPIError, CourseTimeout, USER_AGENT, CHUNK_SIZE,
+                           MAX_REDIRECTS, _error_message, finish_download)
+from canvas_partial import PartialDownload, IncompleteDownloadError, parse_content_range
+from canvas_segments import SegmentPolicy
+from canvas_stall import StallError, StallPolicy
+from canvas_store import get_store
+from canvas_ratelimit import get_throttle, is_rate_limited, MAX_THROTTLE_RETRIES
+from canvas_events import ByteProgress, FILE_STARTED, FILE_DONE, ERROR
+from canvas_retry import RetryPolicy, is_transient
+
+logger = logging.getLogger("canvas-downloader-async")
+
+DEFAULT_CONCURRENCY = 8
+
+
+class AsyncConnectionPool:
+    """按主机划分的长连接池，限制每个主机同时打开的连接数"""
+
+    def __init__(self, limit_per_host=DEFAULT_CONCURRENCY, timeout=30):
+        self.limit_per_host = limit_per_host
+        self.timeout = timeout
+        self._idle = {}
+        self._semaphores = {}
+        self._ssl_context = None
+
+    def _semaphore(self, key):
+        semaphore = self._semaphores.get(key)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.limit_per_host)
+            self._semaphores[key] = semaphore
+        return semaphore
+
+    async def _connect(self, key):
+        scheme, host, port = key
+        if scheme == "https":
+            if self._ssl_context is None:
+                self._ssl_context = ssl.create_default_context()
+            return await asyncio.wait_for(
+                asyncio.open_connection(host, port, ssl=self._ssl_context, server_hostname=host),
+                self.timeout)
+        return await asyncio.wait_for(asyncio.open_connection(host, port), self.timeout)
+
+    async def acquire(self, key):
+        """取得一个连接，返回(reader, writer, 是否为复用连接)"""
+        await self._semaphore(key).acquire()
+        idle = self._idle.get(key)
+        while idle:
+            reader, writer = idle.pop()
+            if not writer.is_closing() and not reader.at_eof():
+                return reader, writer, True
+            writer.close()
+        try:
+            reader, writer = await self._connect(key)
+        except BaseException:
+            self._semaphore(key).release()
+            raise
+        return reader, writer, False
+
+    def release(self, key, reader, writer, reusable):
+        if reusable and not writer.is_closing():
+            self._idle.setdefault(key, []).append((reader, writer))
+        else:
+            writer.close()
+        self._semaphore(key).release()
+
+    async def close(self):
+        idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for _, writer in conns:
+                writer.close()
+                try:
+                    await writer.wait_closed()
+                except (OSError, ssl.SSLError):
+                    pass
+
+
+class AsyncResponse:
+    """一个HTTP/1.1响应，按块读取响应体，读完后把连接归还连接池"""
+
+    def __init__(self, pool, key, reader, writer, status, headers, timeout, method="GET"):
+        self.pool = pool
+        self.key = key
+        self.reader = reader
+        self.writer = writer
+        self.status = status
+        self.headers = headers
+        self.timeout = timeout
+        # 跟随重定向后的地址，由open_url设置
+        self.url = None
+        self._released = False
+        self._complete = False
+        # 检查限流时已经读出的响应体
+        self.body = None
+
+        if method == "HEAD" or status in (204, 304):
+            self._remaining = 0
+        elif headers.get("transfer-encoding", "").lower() == "chunked":
+            self._remaining = None
+        elif "content-length" in headers:
+            self._remaining = int(headers["content-length"])
+        else:
+            # 没有长度信息，只能读到连接关闭
+            self._remaining = -1
+        self._keep_alive = headers.get("connection", "").lower() != "close" and self._remaining != -1
+
+    async def _read(self, coro):
+        return await asyncio.wait_for(coro, self.timeout)
+
+    async def iter_chunks(self, chunk_size=CHUNK_SIZE):
+        if self._remaining is None:
+            while True:
+                line = await self._read(self.reader.readline())
+                size = int(line.split(b";")[0].strip() or b"0", 16)
+                if size == 0:
+                    # 跳过trailer
+                    while (await self._read(self.reader.readline())) not in (b"\r\n", b"\n", b""):
+                        pass
+                    break
+                while size > 0:
+                    data = await self._read(self.reader.read(min(size, chunk_size)))
+                    if not data:
+                        raise ConnectionResetError("连接在传输中断开")
+                    size -= len(data)
+                    yield data
+                await self._read(self.reader.readexactly(2))
+        elif self._remaining == -1:
+            while True:
+                data = await self._read(self.reader.read(chunk_size))
+                if not data:
+                    break
+                yield data
+        else:
+            while self._remaining > 0:
+                data = await self._read(self.reader.read(min(self._remaining, chunk_size)))
+                if not data:
+                    raise ConnectionResetError("连接在传输中断开")
+                self._remaining -= len(data)
+                yield data
+        self._complete = True
+
+    async def read(self):
+        if self.body is not None:
+            return self.body
+        return b"".join([chunk async for chunk in self.iter_chunks()])
+
+    def release(self):
+        if self._released:
+            return
+        self._released = True
+        self.pool.release(self.key, self.reader, self.writer, self._keep_alive and self._complete)
+
+
+async def _send(pool, method, url, headers, timeout):
+    parsed = urlparse(url)
+    scheme = parsed.scheme or "https"
+    port = parsed.port or (443 if scheme == "https" else 80)
+    key = (scheme, parsed.hostname, port)
+    path = parsed.path or "/"
+    if parsed.query:
+        path += "?" + parsed.query
+
+    host_header = parsed.hostname if parsed.port is None else f"{parsed.hostname}:{parsed.port}"
+    lines = [f"{method} {path} HTTP/1.1", f"Host: {host_header}"]
+    lines += [f"{name}: {value}" for name, value in headers.items()]
+    request = ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+    for attempt in range(2):
+        reader, writer, reused = await pool.acquire(key)
+        try:
+            writer.write(request)
+            await writer.drain()
+            status_line = await asyncio.wait_for(reader.readline(), timeout)
+            if not status_line:
+                raise ConnectionResetError("服务器关闭了连接")
+            status = int(status_line.split()[1])
+            response_headers = {}
+            while True:
+                line = await asyncio.wait_for(reader.readline(), timeout)
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                response_headers[name.strip().lower()] = value.strip()
+            return AsyncResponse(pool, key, reader, writer, status, response_headers, timeout, method)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pool.release(key, reader, writer, False)
+            # 复用的连接可能已被服务器关闭，换新连接重试一次
+            if not reused or attempt:
+                raise
+        except BaseException:
+            pool.release(key, reader, writer, False)
+            raise
+
+
+async def open_url(pool, method, url, token=None, timeout=30, extra_headers=None):
+    """发送请求并跟随重定向，令牌只发送给Canvas站点本身"""
+    origin = urlparse(url).netloc
+    redirects = 0
+    attempt = 0
+    while redirects <= MAX_REDIRECTS:
+        headers = {"User-Agent": USER_AGENT, "Accept-Encoding": "identity", "Connection": "keep-alive"}
+        to_canvas = bool(token) and urlparse(url).netloc == origin
+        if to_canvas:
+            headers["Authorization"] = f"Bearer {token}"
+        if extra_headers:
+            headers.update(extra_headers)
+
+        # 与同步引擎共享同一站点的限流状态
+        throttle = get_throttle(origin) if to_canvas else None
+        if throttle:
+            await throttle.acquire_async()
+        try:
+            response = await _send(pool, method, url, headers, timeout)
+        except BaseException:
+            if throttle:
+                throttle.release()
+            raise
+        if throttle and response.status in (403, 429):
+            response.body = await response.read()
+            if is_rate_limited(response.status, response.body) and attempt < MAX_THROTTLE_RETRIES:
+                response.release()
+                delay = throttle.release(response.headers, limited=True, attempt=attempt)
+                attempt += 1
+                logger.info(f"Canvas限流，{delay:.1f}秒后重试 ({attempt}/{MAX_THROTTLE_RETRIES}): {url}")
+                continue
+        if throttle:
+            throttle.release(response.headers)
+
+        if response.status in (301, 302, 303, 307, 308) and response.headers.get("location"):
+            await response.read()
+            response.release()
+            url = urljoin(url, response.headers["location"])
+            redirects += 1
+            continue
+        response.url = url
+        return response
+    raise CanvasAPIError(310, "重定向次数过多", url)
+
+
+async def download_file_async(pool, token, file_info, path, deadline=None, monitor=None, store=None,
+                              progress=None, segments=None):
+    """异步下载单个文件，数据块直接写入磁盘，支持断点续传，返回(字节数, ETag)
+
+    segments 是SegmentPolicy，超过其阈值的文件用多个连接分段下载。
+    """
+    url = file_info.get("url")
+    if not url:
+        raise CanvasAPIError(0, "文件没有下载地址")
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    partial = PartialDownload(path, file_info).load()
+    if partial.is_complete():
+        finish_download(partial.finish(), path, file_info, store)
+        return 0, partial.etag
+    if segments and segments.should_split(partial.size):
+        written = await download_segments_async(pool, token, url, partial, segments, deadline, monitor, progress)
+        if written is not None:
+            finish_download(partial.finish(), path, file_info, store)
+            return written, partial.etag
+        # 服务器不支持Range请求，改为单个连接下载
+        partial = PartialDownload(path, file_info).load()
+    written = 0
+    response = await open_url(pool, "GET", url, token, pool.timeout, partial.range_headers())
+    if response.status == 416 and partial.ranges:
+        # 断点超出了服务器上的文件，丢弃已下载的部分从头下载
+        await response.read()
+        response.release()
+        partial.discard()
+        response = await open_url(pool, "GET", url, token, pool.timeout)
+    try:
+        if response.status >= 400:
+            raise CanvasAPIError(response.status, _error_message(await response.read()), url)
+        partial.etag = response.headers.get("etag")
+        f = partial.begin(response.status, response.headers)
+        try:
+            async for chunk in response.iter_chunks():
+                partial.write(f, chunk)
+                written += len(chunk)
+                if monitor:
+                    monitor.update(len(chunk))
+                if progress:
+                    progress.update(len(chunk))
+                if deadline and deadline.expired():
+                    raise CourseTimeout()
+        except BaseException:
+            # 中断时保留已下载的部分，下次从断点继续
+            partial.checkpoint(f)
+            raise
+        finally:
+            f.close()
+    finally:
+        response.release()
+
+    finish_download(partial.finish(), path, file_info, store)
+    return written, partial.etag
+
+
+async def _range_response(response, start, size, url):
+    """检查分段请求的响应是否正好从start开始，返回响应中的ETag"""
+    if response.status >= 400:
+        raise CanvasAPIError(response.status, _error_message(await response.read()), url)
+    content_range = parse_content_range(response.headers.get("content-range"))
+    if not content_range or content_range[0] != start or content_range[2] not in (None, size):
+        raise IncompleteDownloadError(f"服务器返回的范围与请求不符: {response.headers.get('content-range')}")
+    return response.headers.get("etag")
+
+
+async def download_segments_async(pool, token, url, partial, policy, deadline=None, monitor=None, progress=None):
+    """download_segments的异步版本：各段在同一事件循环中用连接池的不同连接并行获取
+
+    返回本次下载的字节数；服务器不支持Range请求时返回None。
+    只有正在读取的分段占用连接，等待连接的分段不占用，多个大文件同时分段也不会互相卡住。
+    """
+    pieces = policy.ranges(partial)
+    if not pieces:
+        return 0
+    # 第一段的请求同时用来确认服务器支持Range，并得到重定向后的文件存储地址
+    start, end = pieces[0]
+    first = await open_url(pool, "GET", url, token, pool.timeout, {"Range": f"bytes={start}-{end - 1}"})
+    if first.status in (200, 416):
+        first.release()
+        if first.status == 416:
+            # 日志与服务器上的文件不符，丢弃后用单个连接从头下载
+            partial.discard()
+        return None
+    try:
+        etag = await _range_response(first, start, partial.size, url)
+    except BaseException:
+        first.release()
+        raise
+    if partial.ranges and partial.etag and etag and etag != partial.etag:
+        # 已下载的部分与现在的文件内容不是同一个版本
+        first.release()
+        partial.discard()
+        raise IncompleteDownloadError("文件在下载过程中发生了变化")
+    partial.etag = etag or partial.etag
+    # 令牌只发送给Canvas站点本身
+    final_url = first.url
+    final_token = token if urlparse(final_url).netloc == urlparse(url).netloc else None
+
+    # 预先分配文件大小，各段写入自己的偏移
+    mode = "r+b" if os.path.exists(partial.part_path) else "wb"
+    with open(partial.part_path, mode) as f:
+        f.truncate(partial.size)
+    written = [0]
+
+    async def fetch(start, end, response):
+        try:
+            if response is None:
+                response = await open_url(pool, "GET", final_url, final_token, pool.timeout,
+                                          {"Range": f"bytes={start}-{end - 1}"})
+                etag = await _range_response(response, start, partial.size, final_url)
+                if partial.etag and etag and etag != partial.etag:
+                    raise IncompleteDownloadError("文件在下载过程中发生了变化")
+            position = start
+            with open(partial.part_path, "r+b", buffering=0) as f:
+                f.seek(start)
+                # 读完整个响应，连接才能归还连接池复用
+                async for chunk in response.iter_chunks():
+                    chunk = memoryview(chunk)[:end - position]
+                    offset = position
+                    while chunk:
+                        count = f.write(chunk)
+                        chunk = chunk[count:]
+                        position += count
+                    if position == offset:
+                        continue
+                    partial.record(f, offset, position - offset)
+                    written[0] += position - offset
+                    if monitor:
+                        monitor.update(position - offset)
+                    if progress:
+                        progress.update(position - offset)
+                    if deadline and deadline.expired():
+                        raise CourseTimeout()
+            if position < end:
+                raise IncompleteDownloadError(f"分段 {start}-{end - 1} 只收到 {position - start} 字节")
+        finally:
+            if response:
+                response.release()
+
+    tasks = [asyncio.ensure_future(fetch(start, end, first))]
+    tasks += [asyncio.ensure_future(fetch(start, end, None)) for start, end in pieces[1:]]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        # 还没开始运行就被取消的任务不会释放第一段的连接
+        first.release()
+        # 保留已下载的范围，下次只获取缺少的部分
+        try:
+            partial.save()
+        except OSError as e:
+            logger.warning(f"保存续传日志失败: {e}")
+        raise
+    return written[0]
+
+
+async def _transfer_all(settings, pending, manifest, result, emit, deadline, concurrency, stall, retry):
+    pool = AsyncConnectionPool(concurrency, timeout=stall.window)
+    loop = asyncio.get_event_loop()
+    store = get_store(settings["dedup_store"])
+    segments = SegmentPolicy.from_settings(settings)
+
+    async def download(file_info, path):
+        name = file_info.get('display_name')
+        file_id = file_info.get("id")
+        stalls = failures = 0
+        while True:
+            if deadline and deadline.expired():
+                raise CourseTimeout()
+            try:
+                return await download_file_async(pool, settings["token"], file_info, path,
+                                                 deadline, stall.monitor(), store,
+                                                 ByteProgress(emit, file_id, file_info.get("size")), segments)
+            except (StallError, asyncio.TimeoutError) as e:
+                # 停滞的传输从断点重试
+                if stalls >= stall.retries:
+                    raise StallError(str(e) or "读取超时")
+                stalls += 1
+                emit(ERROR, file_id=file_id, name=name, message=f"传输停滞: {e}",
+                     retry=f"{stalls}/{stall.retries}")
+            except (CanvasAPIError, IncompleteDownloadError, ConnectionError, asyncio.IncompleteReadError) as e:
+                # 暂时性错误退避后重试，不占用其他文件的连接
+                if not retry.should_retry(e, failures):
+                    raise
+                delay = retry.delay(failures)
+                failures += 1
+                emit(ERROR, file_id=file_id, name=name, message=f"{e}，{delay:.1f}秒后重试",
+                     retry=f"{failures}/{retry.retries}")
+                await asyncio.sleep(delay)
+
+    async def worker():
+        while True:
+            # 列表在另一个线程中进行，阻塞的get放到线程池里等待
+            item = await loop.run_in_executor(None, pending.get)
+            if item is None:
+                return
+            file_info, path = item
+            name = file_info.get('display_name')
+            relpath = os.path.relpath(path, settings['download_dir'])
+            emit(FILE_STARTED, file_id=file_info.get("id"), name=name, path=relpath, size=file_info.get("size"),
+                 queued=pending.waited(file_info))
+            try:
+                written, etag = await download(file_info, path)
+            except (CanvasAPIError, IncompleteDownloadError, StallError, ConnectionError,
+                    asyncio.IncompleteReadError) as e:
+                result.add_error(f"{name}: {e.__class__.__name__}: {e}", is_transient(e))
+                emit(ERROR, file_id=file_info.get("id"), name=name, message=str(e))
+                continue
+            manifest.record(file_info, path, etag)
+            result.bytes_downloaded += written
+            result.files_downloaded += 1
+            emit(FILE_DONE, file_id=file_info.get("id"), name=name, path=relpath, bytes=written, linked=False)
+
+    workers = [asyncio.ensure_future(worker()) for _ in range(concurrency)]
+    try:
+        await asyncio.gather(*workers)
+    finally:
+        for task in workers:
+            task.cancel()
+        # 取消协程不会唤醒线程池中阻塞在get上的线程，放入结束标记让它们退出
+        pending.close()
+        await asyncio.gather(*workers, return_exceptions=True)
+        await pool.close()
+
+
+class AsyncTransfer:
+    """可传给sync_course的传输阶段，在独立事件循环中并发下载一个课程的文件"""
+
+    def __init__(self, concurrency=DEFAULT_CONCURRENCY):
+        self.concurrency = max(1, concurrency)
+
+    def __call__(self, session, settings, pending, manifest, result, emit, deadline=None, stall=None, retry=None):
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(
+                _transfer_all(settings, pending, manifest, result, emit, deadline,
+                              self.concurrency, stall or StallPolicy(), retry or RetryPolicy()))
+        finally:
+            loop.close()
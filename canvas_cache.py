@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+HTTP响应缓存
+把Canvas接口的JSON响应(课程信息、文件和文件夹列表的每一页)连同ETag和Last-Modified保存在SQLite中。
+再次请求同一URL时发送 If-None-Match/If-Modified-Since，内容没有变化时Canvas返回304，直接使用缓存的响应。
+超过TTL未被使用的响应会被删除；缓存总大小超过上限时按最近使用时间淘汰。
+缓存按令牌区分，不同账号不会读到彼此的响应；数据库中不保存令牌本身。
+"""
+
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import logging
+import threading
+
+logger = logging.getLogger("canvas-downloader-cache")
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "canvas-downloader", "http-cache.db")
+# 超过这么久(秒)没有使用的响应被删除
+DEFAULT_TTL = 7 * 24 * 3600
+DEFAULT_MAX_BYTES = 200 * 1024 * 1024
+# 淘汰到上限的这个比例，避免每次写入都触发淘汰
+EVICT_TO = 0.9
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    etag TEXT,
+    last_modified TEXT,
+    headers TEXT NOT NULL,
+    body BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    validated REAL NOT NULL,
+    accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed);
+"""
+
+
+class CachedResponse:
+    """缓存中的一条响应"""
+
+    def __init__(self, key, etag, last_modified, headers, body, validated):
+        self.key = key
+        self.etag = etag
+        self.last_modified = last_modified
+        self.headers = headers
+        self.body = body
+        self.validated = validated
+
+    def age(self):
+        """距上次从Canvas确认内容的秒数"""
+        return time.time() - self.validated
+
+    def conditional_headers(self):
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+class ResponseCache:
+    """SQLite中的响应缓存，可在多个线程中共用"""
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttl=DEFAULT_TTL, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        # 响应中包含带签名的文件下载地址
+        try:
+            os.chmod(path, 0o600)
+        except OSError:
+            pass
+        with self._db:
+            self._db.executescript(_SCHEMA)
+            self._db.execute("DELETE FROM responses WHERE accessed < ?", (time.time() - ttl,))
+        self._size = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        # 本次运行的统计
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    @staticmethod
+    def key(url, token):
+        """同一URL在不同令牌下是不同的缓存项"""
+        token_hash = hashlib.sha256((token or "").encode("utf-8")).hexdigest()[:16]
+        return f"{token_hash} {url}"
+
+    def get(self, url, token):
+        """返回CachedResponse，不存在或已过期时返回None"""
+        key = self.key(url, token)
+        now = time.time()
+        with self._lock, self._db:
+            row = self._db.execute(
+                "SELECT etag, last_modified, headers, body, validated, accessed FROM responses WHERE key = ?",
+                (key,)).fetchone()
+            if row is None:
+                return None
+            if row[5] < now - self.ttl:
+                self._delete(key)
+                return None
+            self._db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+        return CachedResponse(key, row[0], row[1], json.loads(row[2]), bytes(row[3]), row[4])
+
+    def put(self, url, token, headers, body):
+        """保存一条200响应"""
+        key = self.key(url, token)
+        headers_text = json.dumps(headers, ensure_ascii=False)
+        size = len(body) + len(headers_text) + len(key)
+        now = time.time()
+        with self._lock, self._db:
+            self._delete(key)
+            self._db.execute("INSERT INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                             (key, headers.get("etag"), headers.get("last-modified"), headers_text,
+                              sqlite3.Binary(body), size, now, now))
+            self._size += size
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def touch(self, cached):
+        """Canvas确认缓存的内容没有变化(304)"""
+        with self._lock, self._db:
+            self._db.execute("UPDATE responses SET validated = ? WHERE key = ?", (time.time(), cached.key))
+
+    def _delete(self, key):
+        row = self._db.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+        if row:
+            self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._size -= row[0]
+
+    def _evict(self):
+        """在持有锁时调用：按最近使用时间淘汰，直到总大小低于上限的EVICT_TO"""
+        target = self.max_bytes * EVICT_TO
+        removed = 0
+        for key, size in self._db.execute("SELECT key, size FROM responses ORDER BY accessed").fetchall():
+            if self._size <= target:
+                break
+            self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._size -= size
+            removed += 1
+        logger.debug(f"HTTP缓存超过 {self.max_bytes / (1024 * 1024):.0f} MB，淘汰了 {removed} 条响应")
+
+    def count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def summary(self):
+        """本次运行的缓存使用情况"""
+        total = self.hits + self.revalidated + self.misses
+        return (f"HTTP缓存: {total} 次接口请求中 {self.revalidated} 次内容未变化(304)，"
+                f"{self.hits} 次直接使用缓存，{self.misses} 次重新获取")
+
+
+def open_cache(path=DEFAULT_CACHE_PATH, **kwargs):
+    """打开响应缓存，无法打开时返回None(不使用缓存)"""
+    try:
+        return ResponseCache(path, **kwargs)
+    except (OSError, sqlite3.Error) as e:
+        logger.warning(f"无法打开HTTP缓存 {path}，本次不使用缓存: {e}")
+        return None
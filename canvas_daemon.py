@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+后台同步服务
+常驻进程保持HTTP连接池、同步清单、去重存储和限流状态，命令行和图形界面作为客户端提交同步任务。
+在支持Unix socket的系统上监听 ~/.cache/canvas-downloader/daemon.sock (仅当前用户可访问)；
+其他系统(Windows)监听 127.0.0.1 的随机端口，端口和访问令牌写入 daemon.json。
+
+协议为JSON lines，每个连接处理一个请求：
+    客户端发送一行请求: {"op": "sync", "config": {...}, "options": {...}}
+    服务端逐行返回进度事件(见canvas_events)，最后一行是 {"event": "done", "success": true}
+其他请求: {"op": "ping"} 返回 {"event": "pong"}；{"op": "shutdown"} 停止服务。
+客户端在同步完成前断开连接时，服务端取消这次同步(已下载的部分保留，下次从断点继续)。
+"""
+
+import os
+import sys
+import json
+import socket
+import secrets
+import logging
+import argparse
+import threading
+import socketserver
+from urllib.parse import urlparse
+
+from canvas_engine import CanvasSession, normalize_config, sync_course
+from canvas_async import AsyncTransfer, DEFAULT_CONCURRENCY
+from canvas_stall import StallPolicy, DEFAULT_MIN_RATE, DEFAULT_STALL_SECONDS, DEFAULT_STALL_RETRIES
+from canvas_events import make_event, encode, decode, ERROR
+from canvas_retry import RetryPolicy, DEFAULT_FILE_RETRIES
+from canvas_metrics import Counters, start_metrics_server
+from canvas_cache import open_cache
+
+logger = logging.getLogger("canvas-downloader-daemon")
+
+DAEMON_DIR = os.path.join(os.path.expanduser("~"), ".cache", "canvas-downloader")
+USE_UNIX_SOCKET = hasattr(socket, "AF_UNIX") and os.name != "nt"
+DEFAULT_ADDRESS = os.path.join(DAEMON_DIR, "daemon.sock" if USE_UNIX_SOCKET else "daemon.json")
+CONNECT_TIMEOUT = 2
+
+DONE = "done"
+PONG = "pong"
+
+
+class DaemonError(Exception):
+    """无法连接后台服务或请求被拒绝"""
+
+
+class ClientDisconnected(Exception):
+    """客户端在同步完成前断开了连接(例如图形界面停止了任务)，从进度回调中抛出以取消同步"""
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    """处理一个客户端连接"""
+
+    def setup(self):
+        super().setup()
+        # 列出文件的线程和传输线程同时发送事件，每行必须完整写出
+        self._send_lock = threading.Lock()
+        self._disconnected = False
+
+    def handle(self):
+        try:
+            self.handle_request()
+        except ClientDisconnected:
+            logger.info("客户端已断开连接，取消正在进行的同步")
+
+    def handle_request(self):
+        line = self.rfile.readline()
+        request = decode_request(line)
+        if request is None:
+            self.send(make_event(ERROR, message="无效的请求"))
+            return
+        service = self.server.service
+        if service.token and request.get("token") != service.token:
+            self.send(make_event(ERROR, message="访问令牌错误"))
+            return
+
+        op = request.get("op")
+        if op == "ping":
+            self.send(make_event(PONG, pid=os.getpid()))
+        elif op == "shutdown":
+            self.send(make_event(DONE, success=True))
+            threading.Thread(target=self.server.shutdown, daemon=True).start()
+        elif op == "sync":
+            watcher = threading.Thread(target=self.watch_disconnect, name="daemon-client", daemon=True)
+            watcher.start()
+            try:
+                success = service.sync(request.get("config") or {}, request.get("options") or {}, self.send)
+                self.send(make_event(DONE, success=success))
+            finally:
+                # 唤醒等待EOF的线程
+                try:
+                    self.request.shutdown(socket.SHUT_RD)
+                except OSError:
+                    pass
+        else:
+            self.send(make_event(ERROR, message=f"未知的请求: {op}"))
+
+    def watch_disconnect(self):
+        """同步期间客户端不再发送数据，读到EOF说明客户端已断开"""
+        try:
+            while self.rfile.read(1):
+                pass
+        except (OSError, ValueError):
+            pass
+        with self._send_lock:
+            self._disconnected = True
+
+    def send(self, event):
+        data = (encode(event) + "\n").encode("utf-8")
+        with self._send_lock:
+            # 客户端断开后取消同步：停止的任务可能已重新排队，继续同步会与新的同步同时写入同一课程
+            if self._disconnected:
+                raise ClientDisconnected()
+            try:
+                self.wfile.write(data)
+                self.wfile.flush()
+            except OSError:
+                self._disconnected = True
+                raise ClientDisconnected()
+
+
+if USE_UNIX_SOCKET:
+    class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+else:
+    class _Server(socketserver.ThreadingMixIn, socketserver.TCPServer):
+        daemon_threads = True
+        allow_reuse_address = True
+
+
+def decode_request(line):
+    try:
+        request = json.loads(line.decode("utf-8"))
+    except (UnicodeDecodeError, ValueError):
+        return None
+    return request if isinstance(request, dict) else None
+
+
+class SyncService:
+    """后台服务本身：所有任务共享一个HTTP会话"""
+
+    def __init__(self, address=DEFAULT_ADDRESS, stall_timeout=DEFAULT_STALL_SECONDS, counters=None, cache=None):
+        self.address = address
+        self.counters = counters
+        self.session = CanvasSession(timeout=stall_timeout, cache=cache)
+        self.token = None
+        self.server = None
+
+    def sync(self, config, options, emit):
+        """同步配置中的课程，进度事件交给emit，返回是否全部成功"""
+        try:
+            settings = normalize_config(config)
+        except (KeyError, TypeError, ValueError) as e:
+            emit(make_event(ERROR, message=f"配置无效: {e}"))
+            return False
+        if self.counters:
+            emit = self.counters.wrap(emit, urlparse(settings["base_url"]).netloc.lower())
+        if options.get("store"):
+            settings["dedup_store"] = options["store"]
+        if options.get("segments") is not None:
+            settings["segments"] = options["segments"]
+        # 配置中的相对路径相对于客户端的工作目录
+        cwd = options.get("cwd")
+        if cwd:
+            settings["download_dir"] = os.path.join(cwd, os.path.expanduser(settings["download_dir"]))
+            if isinstance(settings["dedup_store"], str):
+                settings["dedup_store"] = os.path.join(cwd, os.path.expanduser(settings["dedup_store"]))
+        transfer = None
+        if options.get("engine") == "async":
+            transfer = AsyncTransfer(options.get("concurrency") or DEFAULT_CONCURRENCY)
+        stall = StallPolicy(min_rate=options.get("min_rate", DEFAULT_MIN_RATE),
+                            window=options.get("stall_timeout", DEFAULT_STALL_SECONDS),
+                            retries=options.get("stall_retries", DEFAULT_STALL_RETRIES))
+        retry = RetryPolicy(options.get("retries", DEFAULT_FILE_RETRIES))
+
+        success = True
+        for course_id in options.get("course_ids") or settings["course_ids"]:
+            result = sync_course(self.session, settings, course_id, events=emit,
+                                 timeout=options.get("timeout"), transfer=transfer, stall=stall, retry=retry)
+            success = success and result.success
+        return success
+
+    def serve_forever(self):
+        os.makedirs(os.path.dirname(self.address), exist_ok=True)
+        if USE_UNIX_SOCKET:
+            # 上一次没有正常退出时会留下socket文件
+            if os.path.exists(self.address):
+                if daemon_running(self.address):
+                    raise DaemonError(f"后台服务已在运行: {self.address}")
+                os.remove(self.address)
+            # socket文件在创建时就只有当前用户可以访问，不留下chmod之前的空隙
+            old_umask = os.umask(0o077)
+            try:
+                self.server = _Server(self.address, _Handler)
+            finally:
+                os.umask(old_umask)
+        else:
+            self.server = _Server(("127.0.0.1", 0), _Handler)
+            self.token = secrets.token_hex(16)
+            # 端口对本机所有用户可见，只有能读取该文件的用户才能提交任务
+            fd = os.open(self.address, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump({"port": self.server.server_address[1], "token": self.token}, f)
+        self.server.service = self
+        logger.info(f"后台服务已启动: {self.address}")
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            self.session.close()
+            try:
+                os.remove(self.address)
+            except OSError:
+                pass
+            logger.info("后台服务已停止")
+
+
+class DaemonClient:
+    """连接后台服务的客户端"""
+
+    def __init__(self, address=DEFAULT_ADDRESS):
+        self.address = address
+
+    def _connect(self):
+        token = None
+        try:
+            if USE_UNIX_SOCKET:
+                sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                sock.settimeout(CONNECT_TIMEOUT)
+                try:
+                    sock.connect(self.address)
+                except OSError:
+                    sock.close()
+                    raise
+            else:
+                with open(self.address, 'r', encoding='utf-8') as f:
+                    info = json.load(f)
+                token = info.get("token")
+                sock = socket.create_connection(("127.0.0.1", info["port"]), CONNECT_TIMEOUT)
+        except (OSError, ValueError, KeyError) as e:
+            raise DaemonError(f"无法连接后台服务 {self.address}: {e}")
+        # 同步可能持续很久，连接建立后不再超时
+        sock.settimeout(None)
+        return sock, token
+
+    def request(self, request):
+        """发送请求并逐个产出服务端返回的事件"""
+        sock, token = self._connect()
+        if token:
+            request = dict(request, token=token)
+        try:
+            sock.sendall((json.dumps(request, ensure_ascii=False) + "\n").encode("utf-8"))
+            with sock.makefile("r", encoding="utf-8") as stream:
+                for line in stream:
+                    event = decode(line)
+                    if event is not None:
+                        yield event
+        finally:
+            sock.close()
+
+    def ping(self):
+        for event in self.request({"op": "ping"}):
+            return event.get("event") == PONG
+        return False
+
+    def sync(self, config, events=None, **options):
+        """提交同步任务，进度事件交给events，返回是否全部成功"""
+        options.setdefault("cwd", os.getcwd())
+        for event in self.request({"op": "sync", "config": config, "options": options}):
+            if event.get("event") == DONE:
+                return bool(event.get("success"))
+            if events:
+                events(event)
+        raise DaemonError("后台服务在同步完成前断开了连接")
+
+    def shutdown(self):
+        for _ in self.request({"op": "shutdown"}):
+            pass
+
+
+def daemon_running(address=DEFAULT_ADDRESS):
+    """后台服务是否可用"""
+    try:
+        return DaemonClient(address).ping()
+    except (DaemonError, OSError):
+        return False
+
+
+def main():
+    """启动或停止后台服务"""
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    parser = argparse.ArgumentParser(description="Canvas下载器后台同步服务")
+    parser.add_argument("--address", default=DEFAULT_ADDRESS,
+                        help="监听的Unix socket路径(Windows上为记录端口的文件)")
+    parser.add_argument("--stall-timeout", type=int, default=DEFAULT_STALL_SECONDS,
+                        help="连接和读取超时时间(秒)")
+    parser.add_argument("--metrics-port", type=int, metavar="PORT",
+                        help="在 127.0.0.1:PORT/metrics 提供Prometheus格式的累计指标")
+    parser.add_argument("--no-http-cache", action="store_true", help="不使用HTTP响应缓存")
+    parser.add_argument("--stop", action="store_true", help="停止正在运行的后台服务")
+    args = parser.parse_args()
+
+    if args.stop:
+        try:
+            DaemonClient(args.address).shutdown()
+        except DaemonError as e:
+            logger.error(str(e))
+            return 1
+        return 0
+
+    counters = metrics_server = None
+    if args.metrics_port is not None:
+        counters = Counters()
+        metrics_server = start_metrics_server(counters, args.metrics_port)
+    try:
+        cache = None if args.no_http_cache else open_cache()
+        SyncService(args.address, args.stall_timeout, counters, cache).serve_forever()
+    except DaemonError as e:
+        logger.error(str(e))
+        return 1
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if metrics_server:
+            metrics_server.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,12 +2,28 @@
 # -*- coding: utf-8 -*-
 
 import os
+import re
 import sys
 import json
+import time
 import argparse
 import subprocess
 import logging
+import http.client
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from pathlib import Path
+from urllib.parse import urlparse
+
+from canvas_engine import CanvasSession, CanvasAPIError, normalize_config, sync_course
+from canvas_async import AsyncTransfer, DEFAULT_CONCURRENCY
+from canvas_stall import StallPolicy, DEFAULT_MIN_RATE, DEFAULT_STALL_SECONDS, DEFAULT_STALL_RETRIES
+from canvas_events import EventWriter, format_event, ERROR, SUMMARY
+from canvas_daemon import DaemonClient, DaemonError, DEFAULT_ADDRESS
+from canvas_watch import CourseWatcher, course_fingerprint, DEFAULT_INTERVAL
+from canvas_retry import RetryPolicy, DEFAULT_FILE_RETRIES, DEFAULT_COURSE_RETRIES, DEFAULT_COURSE_DELAY
+from canvas_metrics import RunMetrics, Counters, ThroughputHistory, record_throughput, start_metrics_server
+from canvas_cache import open_cache
+from canvas_plan import plan_courses, format_plan, DEFAULT_PLAN_MAX_AGE
 
 # 设置日志
 logging.basicConfig(
@@ -16,15 +32,86 @@ logging.basicConfig(
 )
 logger = logging.getLogger("canvas-downloader")
 
+# canvassyncer输出中表示永久性错误(令牌无效、课程不存在)的内容，其他失败视为暂时性的
+PERMANENT_SYNCER_ERROR = re.compile(r"\b(401|403|404)\b|Unauthorized|Not Found|Invalid access token", re.IGNORECASE)
+
 def parse_args():
     """解析命令行参数"""
     parser = argparse.ArgumentParser(description="Canvas课程文件下载工具")
     group = parser.add_mutually_exclusive_group(required=True)
     group.add_argument("-p", "--config", help="指定单个配置文件路径")
     group.add_argument("-d", "--dir", help="指定配置文件目录路径")
-    parser.add_argument("-t", "--timeout", type=int, default=300, help="设置每个课程下载的超时时间(秒)")
+    parser.add_argument("-t", "--timeout", type=int, default=300,
+                        help="每个课程的基础超时时间(秒)，内置引擎会按待下载的文件大小自动延长")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="同时下载的课程数量(默认1，即逐个下载)")
+    parser.add_argument("--per-host", type=int, default=2, help="同一Canvas站点允许同时下载的课程数量上限，避免触发限流")
+    parser.add_argument("--engine", choices=["native", "async", "canvassyncer"], default="native",
+                        help="下载引擎: native为内置引擎(默认)，async为课程内并发传输的asyncio引擎，"
+                             "canvassyncer为调用外部命令")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY,
+                        help="async引擎中每个课程同时传输的文件数量")
+    parser.add_argument("--stall-timeout", type=int, default=DEFAULT_STALL_SECONDS,
+                        help="单个文件传输速度低于--min-rate持续多少秒视为停滞并重试")
+    parser.add_argument("--min-rate", type=float, default=DEFAULT_MIN_RATE / 1024,
+                        help="停滞检测的最低传输速度(KB/s)")
+    parser.add_argument("--stall-retries", type=int, default=DEFAULT_STALL_RETRIES,
+                        help="单个文件停滞后的重试次数")
+    parser.add_argument("--retries", type=int, default=DEFAULT_FILE_RETRIES,
+                        help="单个文件遇到暂时性错误(5xx、连接中断)时的重试次数，401、404等永久性错误不重试")
+    parser.add_argument("--course-retries", type=int, default=DEFAULT_COURSE_RETRIES,
+                        help="暂时性失败的课程在所有课程处理完后重新排队的轮数")
+    parser.add_argument("--retry-delay", type=float, default=DEFAULT_COURSE_DELAY,
+                        help="重新排队前等待的基础时间(秒)，每轮加倍并随机浮动")
+    parser.add_argument("--store", nargs="?", const=True, default=None, metavar="DIR",
+                        help="启用去重存储：相同的Canvas文件只下载和保存一次，各课程目录中使用硬链接"
+                             "(不指定目录时使用 ~/.cache/canvas-downloader/store)")
+    parser.add_argument("--segments", type=int, default=None, metavar="N",
+                        help="超过配置中segmentThreshold(默认64MB)的文件用N个连接分段下载，1表示不分段；"
+                             "默认使用配置文件中的segments，未配置时为4")
+    parser.add_argument("--daemon", nargs="?", const=DEFAULT_ADDRESS, default=None, metavar="ADDRESS",
+                        help="把同步任务交给正在运行的后台服务(canvas-downloader-daemon)执行，"
+                             "复用其中的连接和同步清单；服务未运行时在本进程中同步")
+    parser.add_argument("--watch", action="store_true",
+                        help="持续运行，定期检查课程文件是否有变化，只同步有变化的课程")
+    parser.add_argument("--interval", type=int, default=DEFAULT_INTERVAL,
+                        help="监视模式下每个课程的检查间隔(秒，默认600，实际间隔会随机浮动±20%%)")
+    parser.add_argument("--events", action="store_true",
+                        help="把同步进度以JSON lines事件逐行输出到标准输出(日志仍输出到标准错误)，供其他程序读取")
+    parser.add_argument("--report", metavar="PATH",
+                        help="把每个课程和文件的耗时、字节数、重试次数写入运行报告(.json，或.csv)")
+    parser.add_argument("--metrics-port", type=int, metavar="PORT",
+                        help="监视模式下在 127.0.0.1:PORT/metrics 提供Prometheus格式的累计指标")
+    parser.add_argument("--plan", action="store_true",
+                        help="只预览不下载：列出每个课程新增、有变化和无需下载的文件数量、需要下载的字节数和预计用时")
+    parser.add_argument("--plan-max-age", type=int, default=DEFAULT_PLAN_MAX_AGE, metavar="SECONDS",
+                        help="预览时直接使用这段时间内获取过的列表缓存，不再请求Canvas(默认3600秒，0表示总是确认)")
+    parser.add_argument("--no-http-cache", action="store_true",
+                        help="不使用HTTP响应缓存(默认缓存课程和文件列表，下次同步时发送条件请求，未变化的页面不再重新传输)")
     parser.add_argument("-v", "--verbose", action="store_true", help="显示详细输出")
-    return parser.parse_args()
+    args = parser.parse_args()
+    if args.jobs < 1 or args.per_host < 1 or args.concurrency < 1 or (args.segments is not None and args.segments < 1):
+        parser.error("--jobs、--per-host、--concurrency 和 --segments 必须大于等于1")
+    if args.stall_timeout < 1 or args.min_rate < 0 or args.stall_retries < 0:
+        parser.error("--stall-timeout 必须大于等于1，--min-rate 和 --stall-retries 不能为负数")
+    if args.retries < 0 or args.course_retries < 0 or args.retry_delay < 0:
+        parser.error("--retries、--course-retries 和 --retry-delay 不能为负数")
+    if args.events and args.engine == "canvassyncer":
+        parser.error("--events 只支持内置引擎(native或async)")
+    if args.daemon and args.engine == "canvassyncer":
+        parser.error("--daemon 只支持内置引擎(native或async)")
+    if args.watch and args.engine == "canvassyncer":
+        parser.error("--watch 只支持内置引擎(native或async)")
+    if args.interval < 1:
+        parser.error("--interval 必须大于等于1")
+    if args.report and (args.engine == "canvassyncer" or args.watch):
+        parser.error("--report 只支持内置引擎，且不能与 --watch 同时使用(监视模式请使用 --metrics-port)")
+    if args.metrics_port is not None and not args.watch:
+        parser.error("--metrics-port 只能在 --watch 监视模式下使用")
+    if args.plan and (args.watch or args.daemon or args.events or args.report):
+        parser.error("--plan 不能与 --watch、--daemon、--events 或 --report 同时使用")
+    if args.plan_max_age < 0:
+        parser.error("--plan-max-age 不能为负数")
+    return args
 
 def get_config_files(args):
     """获取所有配置文件的路径"""
@@ -60,13 +147,23 @@ def validate_config(config_file):
         with open(config_file, 'r', encoding='utf-8') as f:
             config = json.load(f)
         
-        # 检查必要的字段
-        required_fields = ['token', 'base_url', 'course_id']
+        # 检查必要的字段 - 兼容两种格式
+        if 'base_url' in config or 'course_id' in config:
+            required_fields = ['token', 'base_url', 'course_id']
+        else:
+            required_fields = ['token', 'canvasURL', 'courseIDs']
         for field in required_fields:
             if field not in config:
                 logger.error(f"配置文件 {config_file} 缺少必要字段: {field}")
                 return False
         
+        # 提前编译筛选规则、检查分段下载设置，有误时不开始下载
+        try:
+            normalize_config(config)
+        except ValueError as e:
+            logger.error(f"配置文件 {config_file} 无效: {e}")
+            return False
+        
         return True
     except json.JSONDecodeError:
         logger.error(f"配置文件格式错误: {config_file}")
@@ -75,14 +172,231 @@ def validate_config(config_file):
         logger.error(f"验证配置文件时出错: {e}")
         return False
 
-def download_course(config_file, timeout):
-    """使用canvassyncer下载课程文件"""
+def get_canvas_host(config_file):
+    """读取配置文件中的Canvas站点主机名，用于按站点限制并发"""
+    try:
+        with open(config_file, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+    except Exception:
+        return ""
+    # 兼容两种格式
+    base_url = config.get('base_url') or config.get('canvasURL') or ""
+    return urlparse(base_url).netloc.lower()
+
+class HostLimiter:
+    """按Canvas站点限制同时进行的下载数量，只在提交任务的线程中使用，不会阻塞"""
+    
+    def __init__(self, per_host):
+        self.per_host = per_host
+        self._running = {}
+        
+    def try_acquire(self, host):
+        """站点还有空闲名额时占用一个并返回True"""
+        if self._running.get(host, 0) >= self.per_host:
+            return False
+        self._running[host] = self._running.get(host, 0) + 1
+        return True
+    
+    def release(self, host):
+        self._running[host] -= 1
+
+def download_courses_parallel(tasks, timeout, jobs, per_host, **options):
+    """使用有界线程池并发处理 (配置文件, 课程ID列表) 任务，返回每个任务的失败记录；options原样传给download_course
+    
+    任务在提交前取得站点名额：某个站点已满时先提交其他站点的任务，工作线程不会阻塞在已满的站点上。
+    """
+    limiter = HostLimiter(per_host)
+    results = [None] * len(tasks)
+    waiting = [(index, task, get_canvas_host(task[0])) for index, task in enumerate(tasks)]
+    running = {}
+    
+    def worker(task):
+        config_file, course_ids = task
+        failures = {}
+        download_course(config_file, timeout, course_ids=course_ids, failures=failures, **options)
+        return failures
+    
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        while waiting or running:
+            # 按原顺序提交站点还有空闲名额的任务
+            for item in list(waiting):
+                if len(running) >= jobs:
+                    break
+                index, task, host = item
+                if limiter.try_acquire(host):
+                    waiting.remove(item)
+                    running[executor.submit(worker, task)] = (index, host)
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                index, host = running.pop(future)
+                limiter.release(host)
+                results[index] = future.result()
+    return results
+
+def download_courses(config_files, timeout, jobs=1, per_host=2, course_retry=None, **options):
+    """下载所有配置文件中的课程，返回完全成功的配置文件数量
+    
+    暂时性失败(5xx、超时、连接中断)的课程在本轮所有课程处理完后按退避时间重新排队，
+    永久性失败(401、404、配置无效)不再重试。
+    """
+    tasks = [(config_file, None) for config_file in config_files]
+    failed = sync_course_tasks(tasks, timeout, jobs, per_host, course_retry, **options)
+    return sum(1 for config_file in config_files if not failed.get(config_file))
+
+def sync_course_tasks(tasks, timeout, jobs=1, per_host=2, course_retry=None, **options):
+    """同步 (配置文件, 课程ID列表) 任务，课程ID列表为None时同步配置中的所有课程
+    
+    jobs>1 时并发执行，暂时失败的课程按course_retry重新排队；
+    返回每个配置文件中仍然失败的课程: {配置文件: {课程ID: 是否可以重试}}，canvassyncer引擎整个配置文件记为None。
+    """
+    course_retry = course_retry or RetryPolicy(0)
+    failed = {}
+    for attempt in range(course_retry.retries + 1):
+        if attempt:
+            delay = course_retry.delay(attempt - 1)
+            logger.info(f"{len(tasks)} 个任务中有暂时失败的课程，{delay:.1f}秒后重新同步 "
+                        f"(第 {attempt}/{course_retry.retries} 轮)")
+            time.sleep(delay)
+        
+        # 还有重试机会时，暂时失败的课程的summary标记为requeued，指标不把它计为最终结果
+        requeue = attempt < course_retry.retries
+        if jobs > 1 and len(tasks) > 1:
+            logger.info(f"并发下载: 最多 {jobs} 个课程，每个站点最多 {per_host} 个")
+            results = download_courses_parallel(tasks, timeout, jobs, per_host, requeue=requeue, **options)
+        else:
+            results = []
+            for config_file, course_ids in tasks:
+                failures = {}
+                download_course(config_file, timeout, course_ids=course_ids, failures=failures,
+                                requeue=requeue, **options)
+                results.append(failures)
+        
+        retry_tasks = []
+        for (config_file, course_ids), failures in zip(tasks, results):
+            remaining = failed.setdefault(config_file, {})
+            if course_ids is None:
+                remaining.clear()
+            else:
+                for course_id in course_ids:
+                    remaining.pop(course_id, None)
+            remaining.update(failures)
+            retry_ids = [course_id for course_id, retryable in failures.items() if retryable]
+            if retry_ids:
+                retry_tasks.append((config_file, None if None in retry_ids else retry_ids))
+        tasks = retry_tasks
+        if not tasks:
+            break
+    
+    return failed
+
+def track_failures(events, failures, requeue=False):
+    """包装事件回调，把失败课程的summary记入failures: {课程ID: 是否可以重试}
+
+    requeue 为True时暂时失败的课程还会重新同步，其summary加上 "requeued": true。
+    """
+    def on_event(event):
+        if event.get("event") == SUMMARY and not event.get("success"):
+            retryable = bool(event.get("retryable"))
+            failures[event.get("course_id")] = retryable
+            if requeue and retryable:
+                event = dict(event, requeued=True)
+        events(event)
+    return on_event
+
+def download_course(config_file, timeout, engine="native", session=None, concurrency=DEFAULT_CONCURRENCY,
+                    stall=None, store=None, events=None, daemon=None, course_ids=None, retry=None, failures=None,
+                    metrics=None, segments=None, requeue=False):
+    """下载一个配置文件中的课程文件，course_ids可以只同步其中的部分课程
+    
+    failures 不为None时记录失败的课程及其是否可以重试，requeue 表示暂时失败的课程会重新排队，见download_courses；
+    metrics (RunMetrics或Counters) 从进度事件中记录耗时。
+    """
     logger.info(f"正在处理配置文件: {config_file}")
     
     # 确保配置有效
     if not validate_config(config_file):
+        if failures is not None:
+            failures[None] = False
+        return False
+    
+    if metrics and engine != "canvassyncer":
+        events = metrics.wrap(events or log_event, get_canvas_host(config_file))
+    if failures is not None and engine != "canvassyncer":
+        events = track_failures(events or log_event, failures, requeue)
+    if daemon:
+        stall = stall or StallPolicy()
+        success = download_course_daemon(config_file, daemon, events, timeout=timeout, engine=engine,
+                                         concurrency=concurrency, store=store, min_rate=stall.min_rate,
+                                         stall_timeout=stall.window, stall_retries=stall.retries,
+                                         retries=(retry or RetryPolicy()).retries, course_ids=course_ids,
+                                         segments=segments)
+    elif engine == "native":
+        success = download_course_native(config_file, timeout, session, stall=stall, store=store, events=events,
+                                         course_ids=course_ids, retry=retry, segments=segments)
+    elif engine == "async":
+        success = download_course_native(config_file, timeout, session, AsyncTransfer(concurrency), stall, store,
+                                         events, course_ids, retry, segments)
+    else:
+        return download_course_canvassyncer(config_file, timeout, failures)
+    # 没有产生课程结果的失败(例如后台服务断开)无法判断原因，不再重试
+    if not success and failures is not None and not failures:
+        failures[None] = False
+    return success
+
+def log_event(event):
+    """把同步事件写入日志"""
+    text = format_event(event)
+    if text is None:
+        return
+    if event["event"] == SUMMARY:
+        if event.get("success"):
+            logger.info(text)
+        else:
+            logger.error(text)
+    elif event["event"] == ERROR:
+        logger.warning(text)
+    else:
+        logger.debug(text)
+
+def download_course_daemon(config_file, client, events=None, **options):
+    """把课程交给后台服务同步"""
+    with open(config_file, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    try:
+        return client.sync(config, events or log_event, **options)
+    except DaemonError as e:
+        logger.error(f"后台服务出错: {e}")
         return False
+
+def download_course_native(config_file, timeout, session=None, transfer=None, stall=None, store=None,
+                           events=None, course_ids=None, retry=None, segments=None):
+    """使用内置引擎下载课程文件，events接收进度事件，默认写入日志"""
+    with open(config_file, 'r', encoding='utf-8') as f:
+        settings = normalize_config(json.load(f))
+    # 命令行指定的去重存储优先于配置文件
+    if store:
+        settings["dedup_store"] = store
+    if segments is not None:
+        settings["segments"] = segments
     
+    own_session = session is None
+    if own_session:
+        session = CanvasSession()
+    
+    try:
+        success = True
+        for course_id in course_ids or settings["course_ids"]:
+            result = sync_course(session, settings, course_id, events=events or log_event,
+                                 timeout=timeout, transfer=transfer, stall=stall, retry=retry)
+            if not result.success:
+                success = False
+        return success
+    finally:
+        if own_session:
+            session.close()
+
+def download_course_canvassyncer(config_file, timeout, failures=None):
+    """使用canvassyncer下载课程文件，failures 不为None时记录失败是否可以重试"""
     # 查找canvassyncer可执行文件路径
     canvassyncer_path = "canvassyncer"  # 默认从PATH中查找
     
@@ -109,16 +423,104 @@ def download_course(config_file, timeout):
             logger.debug(f"标准输出: {e.stdout}")
         if e.stderr:
             logger.debug(f"错误输出: {e.stderr}")
+        if failures is not None:
+            failures[None] = not PERMANENT_SYNCER_ERROR.search(f"{e.stdout or ''}\n{e.stderr or ''}")
+        return False
     except subprocess.TimeoutExpired:
         logger.error(f"命令超时 (>{timeout}秒)")
+        if failures is not None:
+            failures[None] = True
+        return False
     except FileNotFoundError:
         logger.error(f"找不到命令: {canvassyncer_path}")
         logger.info("请确保已安装canvassyncer，可以使用 'pip install canvassyncer' 安装")
     except Exception as e:
         logger.error(f"执行命令时发生错误: {e}")
     
+    if failures is not None:
+        failures[None] = False
     return False
 
+def watch_courses(config_files, timeout, interval, poll_session, jobs=1, per_host=2, course_retry=None, **options):
+    """监视模式：定期检查每个课程的文件指纹，只同步有变化的课程，直到被中断
+    
+    每一轮检查所有已到期的课程，有变化的课程与普通同步一样按jobs和per_host并发同步、暂时失败时重新排队。
+    """
+    watcher = CourseWatcher(interval)
+    settings_by_file = {}
+    for config_file in config_files:
+        if not validate_config(config_file):
+            continue
+        with open(config_file, 'r', encoding='utf-8') as f:
+            settings_by_file[config_file] = normalize_config(json.load(f))
+        for course_id in settings_by_file[config_file]["course_ids"]:
+            watcher.add((config_file, course_id))
+    if not settings_by_file:
+        logger.error("没有可以监视的课程")
+        return 1
+    
+    logger.info(f"监视模式: 每个课程约每 {interval} 秒检查一次，按 Ctrl+C 退出")
+    while True:
+        # 上一轮同步期间到期的课程在这一轮一起检查
+        keys = [watcher.wait()] + watcher.pop_due()
+        changed = []
+        for key in keys:
+            config_file, course_id = key
+            try:
+                fingerprint = course_fingerprint(poll_session, settings_by_file[config_file], course_id)
+            except (CanvasAPIError, OSError, http.client.HTTPException, ValueError) as e:
+                # 检查失败时直接同步，由同步过程报告具体错误
+                logger.warning(f"检查课程 {course_id} 是否有变化失败: {e}")
+                fingerprint = None
+            if fingerprint is None or watcher.changed(key, fingerprint):
+                logger.info(f"课程 {course_id} 有变化，开始同步")
+                changed.append(key)
+            else:
+                logger.debug(f"课程 {course_id} 没有变化")
+        
+        if changed:
+            # 每个课程单独作为一个任务，同一配置文件中的课程也可以并发同步
+            tasks = [(config_file, [course_id]) for config_file, course_id in changed]
+            failed = sync_course_tasks(tasks, timeout, jobs, per_host, course_retry, **options)
+            for key in changed:
+                config_file, course_id = key
+                remaining = failed.get(config_file, {})
+                if course_id in remaining or None in remaining:
+                    watcher.forget(key)
+        for key in keys:
+            watcher.schedule(key)
+
+def plan_downloads(config_files, args):
+    """预览模式：不下载文件，输出每个课程需要同步的内容和预计用时"""
+    tasks = []
+    for config_file in config_files:
+        if not validate_config(config_file):
+            continue
+        with open(config_file, 'r', encoding='utf-8') as f:
+            settings = normalize_config(json.load(f))
+        if args.store:
+            settings["dedup_store"] = args.store
+        tasks.extend((settings, course_id) for course_id in settings["course_ids"])
+    if not tasks:
+        logger.error("没有可以预览的课程")
+        return 1
+    
+    session = CanvasSession(timeout=args.stall_timeout, cache=None if args.no_http_cache else open_cache())
+    started = time.monotonic()
+    try:
+        plans = plan_courses(session, tasks, args.plan_max_age)
+    finally:
+        session.close()
+        if session.cache:
+            session.cache.close()
+    
+    for line in format_plan(plans, ThroughputHistory().load(), args.jobs):
+        print(line)
+    logger.info(f"预览用时 {time.monotonic() - started:.1f}秒")
+    if session.cache:
+        logger.info(session.cache.summary())
+    return 0 if all(not plan.error for plan in plans) else 1
+
 def main():
     """主函数"""
     args = parse_args()
@@ -133,14 +535,92 @@ def main():
     config_files = get_config_files(args)
     logger.info(f"找到 {len(config_files)} 个配置文件")
     
+    if args.plan:
+        return plan_downloads(config_files, args)
+    
+    # 优先使用后台服务，服务未运行时退回到本进程
+    daemon = None
+    if args.daemon:
+        daemon = DaemonClient(args.daemon)
+        try:
+            if not daemon.ping():
+                raise DaemonError(f"后台服务 {args.daemon} 拒绝了请求(访问令牌错误或版本不兼容)")
+            logger.info(f"使用后台服务: {args.daemon}")
+        except DaemonError as e:
+            logger.warning(f"{e}，改为在本进程中同步")
+            daemon = None
+    
+    # 所有课程共享一个HTTP连接池和响应缓存
+    session = None
+    if args.engine != "canvassyncer" and not daemon:
+        session = CanvasSession(timeout=args.stall_timeout, cache=None if args.no_http_cache else open_cache())
+    stall = StallPolicy(min_rate=args.min_rate * 1024, window=args.stall_timeout,
+                        retries=args.stall_retries)
+    
+    options = {
+        "engine": args.engine,
+        "session": session,
+        "concurrency": args.concurrency,
+        "stall": stall,
+        "store": args.store,
+        "events": EventWriter(sys.stdout) if args.events else None,
+        "daemon": daemon,
+        "retry": RetryPolicy(args.retries),
+        "segments": args.segments,
+    }
+    
+    # 暂时失败的课程在最后重新排队
+    course_retry = RetryPolicy(args.course_retries, base_delay=args.retry_delay)
+    
+    if args.watch:
+        # 轮询请求量很小，即使同步交给后台服务也在本进程中检查
+        poll_session = session or CanvasSession(timeout=args.stall_timeout,
+                                                cache=None if args.no_http_cache else open_cache())
+        metrics_server = None
+        if args.metrics_port is not None:
+            options["metrics"] = Counters()
+            metrics_server = start_metrics_server(options["metrics"], args.metrics_port)
+        try:
+            return watch_courses(config_files, args.timeout, args.interval, poll_session, args.jobs,
+                                 args.per_host, course_retry, **options)
+        except KeyboardInterrupt:
+            logger.info("监视模式已退出")
+            return 0
+        finally:
+            poll_session.close()
+            if poll_session.cache:
+                poll_session.cache.close()
+            if metrics_server:
+                metrics_server.stop()
+    
+    metrics = RunMetrics() if args.engine != "canvassyncer" else None
+    options["metrics"] = metrics
+    
     # 处理每个配置文件
-    success_count = 0
-    for config_file in config_files:
-        if download_course(config_file, args.timeout):
-            success_count += 1
+    try:
+        success_count = download_courses(config_files, args.timeout, args.jobs, args.per_host,
+                                         course_retry, **options)
+    finally:
+        if session:
+            session.close()
+            if session.cache:
+                session.cache.close()
     
     # 汇总结果
     logger.info(f"处理完成: {success_count}/{len(config_files)} 个课程成功同步")
+    if session and session.cache:
+        logger.info(session.cache.summary())
+    if metrics:
+        metrics.finish()
+        for line in metrics.summary_lines():
+            logger.info(line)
+        record_throughput(metrics)
+        if args.report:
+            try:
+                metrics.write_report(args.report)
+                logger.info(f"运行报告已写入: {args.report}")
+            except OSError as e:
+                logger.error(f"写入运行报告失败: {e}")
     return 0 if success_count == len(config_files) else 1
 
 if __name__ == "__main__":
@@ -7,14 +7,31 @@ import json
 import logging
 import subprocess
 import re
+import time
+import queue
+import tempfile
+import threading
+import itertools
+import collections
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from urllib.parse import urlparse
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, 
                             QLabel, QLineEdit, QPushButton, QFileDialog, QCheckBox, 
                             QListWidget, QGroupBox, QFormLayout, QSpinBox, QMessageBox,
-                            QTabWidget, QTextEdit, QScrollArea, QFrame, QListWidgetItem)
-from PyQt5.QtCore import Qt, QThread, pyqtSignal, QSettings
+                            QTabWidget, QTextEdit, QPlainTextEdit, QScrollArea, QFrame, QListWidgetItem)
+from PyQt5.QtCore import Qt, QThread, QTimer, pyqtSignal, QSettings
 from PyQt5.QtGui import QIcon, QFont
 
+from canvas_engine import CanvasSession, normalize_config, sync_course
+from canvas_events import format_event, SUMMARY, FILE_STARTED, FILE_DONE, BYTES, ERROR
+from canvas_daemon import DaemonClient, DaemonError, daemon_running
+from canvas_jobs import JobQueue, JobInterrupted, STATE_NAMES, RUNNING, DONE, FAILED, MIN_PRIORITY, MAX_PRIORITY
+from canvas_metrics import RunMetrics, ThroughputHistory, record_throughput
+from canvas_filters import FileFilter, parse_size
+from canvas_cache import open_cache
+from canvas_plan import plan_courses, format_plan
+
 # 设置日志
 logging.basicConfig(
     level=logging.INFO,
@@ -22,6 +39,14 @@ logging.basicConfig(
 )
 logger = logging.getLogger("canvas-downloader-gui")
 
+# 日志发送到界面的间隔(秒)和日志窗口保留的最大行数
+LOG_FLUSH_INTERVAL = 0.1
+LOG_MAX_LINES = 5000
+# 下载失败时显示的canvassyncer最近输出行数
+RECENT_OUTPUT_LINES = 20
+# 关闭窗口时等待下载线程停下的最长时间(毫秒)
+STOP_WAIT_MS = 10000
+
 def find_canvassyncer_path():
     """查找canvassyncer可执行文件路径"""
     # 优先使用Python模块方式运行
@@ -59,20 +84,274 @@ def find_canvassyncer_path():
     # 如果找不到，尝试作为Python模块运行
     return "python3 -m canvassyncer"
 
+def read_process_output(process, timeout=None):
+    """同时读取子进程的stdout和stderr，按到达顺序产出(流名称, 行)
+    
+    每个管道由一个线程读取，任何一个管道写满都不会让子进程阻塞；
+    超过timeout秒抛出subprocess.TimeoutExpired。
+    """
+    lines = queue.Queue()
+    
+    def pump(name, stream):
+        try:
+            for line in stream:
+                lines.put((name, line))
+        except (OSError, ValueError):
+            pass
+        finally:
+            lines.put((name, None))
+    
+    for name, stream in (("stdout", process.stdout), ("stderr", process.stderr)):
+        threading.Thread(target=pump, args=(name, stream), daemon=True).start()
+    
+    deadline = time.monotonic() + timeout if timeout else None
+    open_streams = 2
+    while open_streams:
+        wait = None
+        if deadline is not None:
+            wait = deadline - time.monotonic()
+            if wait <= 0:
+                raise subprocess.TimeoutExpired(process.args, timeout)
+        try:
+            name, line = lines.get(timeout=wait)
+        except queue.Empty:
+            continue
+        if line is None:
+            open_streams -= 1
+            continue
+        yield name, line
+
+class SyncerOutput:
+    """逐行分析canvassyncer的输出，只保留结论和最近几行，内存占用固定"""
+    
+    def __init__(self, recent=RECENT_OUTPUT_LINES):
+        self.recent = collections.deque(maxlen=recent)
+        self.stdout_error = None
+        self.stderr_error = None
+        self.rate_limited = False
+        self.key_error = False
+        self.files_found = 0
+        self.files_downloaded = 0
+        
+    def feed_stdout(self, line):
+        if not line:
+            return
+        self.recent.append(line)
+        lower = line.lower()
+        if self.stdout_error is None and ("error:" in lower or "exception:" in lower or "traceback" in lower):
+            self.stdout_error = line
+        if "KeyError" in line:
+            self.key_error = True
+        if "Rate Limit Exceeded" in line:
+            self.rate_limited = True
+        match = re.search(r"Get (\d+) files!", line)
+        if match:
+            self.files_found = int(match.group(1))
+        match = re.search(r"Start to download (\d+) file\(s\)!", line)
+        if match:
+            self.files_downloaded = int(match.group(1))
+            
+    def feed_stderr(self, line, noise=False):
+        """noise为True表示进度条或无害警告，不算作错误"""
+        if "Rate Limit Exceeded" in line:
+            self.rate_limited = True
+        if noise or not line:
+            return
+        self.recent.append(line)
+        if self.stderr_error is None:
+            self.stderr_error = line
+            
+    def has_error(self):
+        return self.stdout_error is not None or self.stderr_error is not None
+    
+    def error_message(self):
+        # 标准输出中的错误信息通常更具体，优先显示
+        return self.stdout_error or self.stderr_error or ""
+
+class LogBuffer:
+    """在工作线程中收集日志，按固定间隔一次性发送给界面
+
+    同一个key的进度条行在一批中只保留最新的一行，
+    避免tqdm每秒刷新多次时每一行都触发一次界面更新。
+    """
+    
+    def __init__(self, signal, interval=LOG_FLUSH_INTERVAL):
+        self.signal = signal
+        self.interval = interval
+        self._lines = []
+        self._progress = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        
+    def add(self, message, progress_key=None):
+        with self._lock:
+            if progress_key is not None and progress_key in self._progress:
+                self._lines[self._progress[progress_key]] = message
+                return
+            if progress_key is not None:
+                self._progress[progress_key] = len(self._lines)
+            self._lines.append(message)
+            
+    def flush(self):
+        with self._lock:
+            lines = self._lines
+            self._lines = []
+            self._progress = {}
+        if lines:
+            self.signal.emit("\n".join(lines))
+            
+    def start(self):
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="log-flush", daemon=True)
+        self._thread.start()
+        
+    def stop(self):
+        """停止定时发送并发送剩余的日志"""
+        self._stopped.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+        
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.flush()
+
 class DownloadThread(QThread):
     """下载线程，防止UI卡顿"""
     progress_signal = pyqtSignal(str)
     finished_signal = pyqtSignal(bool, str)
     
-    def __init__(self, config_file, timeout):
+    def __init__(self, config_file, timeout, jobs=1, engine="native", queue=None, priority=0):
+        """config_file为None时只处理任务队列中已有的任务"""
         super().__init__()
         self.config_file = config_file
         self.timeout = timeout
+        self.jobs = jobs
+        self.engine = engine
+        self.session = None
+        self.daemon = None
+        self.metrics = RunMetrics()
         self.current_course = None
         self.total_files_downloaded = 0
+        self._count_lock = threading.Lock()
+        self.log = LogBuffer(self.progress_signal)
+        self.queue = queue or JobQueue()
+        self.priority = priority
+        self._stop = threading.Event()
+        
+    def stop(self):
+        """请求停止：正在下载的课程在下一次进度回调时中断，并放回任务队列"""
+        self._stop.set()
+        
+    def check_stopped(self):
+        if self._stop.is_set():
+            raise JobInterrupted()
+        
+    def finish(self, success, message):
+        """发送剩余日志后通知界面下载结束"""
+        self.log.stop()
+        self.finished_signal.emit(success, message)
         
     def run(self):
-        self.progress_signal.emit(f"开始下载: {os.path.basename(self.config_file)}")
+        self.log.start()
+        if self.config_file and not self.enqueue_config():
+            return
+        
+        # 执行下载
+        try:
+            # 查找canvassyncer可执行文件路径
+            canvassyncer_path = find_canvassyncer_path()
+            
+            total_courses = len(self.queue.unfinished())
+            self.log.add(f"准备下载 {total_courses} 个课程的文件")
+            if self.jobs > 1 and total_courses > 1:
+                self.log.add(f"同时下载 {min(self.jobs, total_courses)} 个课程")
+            
+            # 后台服务已启动时由它同步；否则内置引擎的所有课程共享一个HTTP连接池
+            if self.engine == "native" and daemon_running():
+                self.daemon = DaemonClient()
+                self.log.add("使用后台同步服务")
+            elif self.engine == "native":
+                self.session = CanvasSession(cache=open_cache())
+            cache = self.session.cache if self.session else None
+            
+            # 多个工作线程按优先级从队列中取课程任务
+            counter = itertools.count()
+            counter_lock = threading.Lock()
+            
+            def worker():
+                results = []
+                while not self._stop.is_set():
+                    job = self.queue.claim()
+                    if job is None:
+                        break
+                    with counter_lock:
+                        index = next(counter)
+                    try:
+                        ok = self.download_single_course(job.config, job.course_id, index,
+                                                         max(total_courses, index + 1), canvassyncer_path, job.id)
+                    except JobInterrupted:
+                        self.queue.release(job.id)
+                        break
+                    except Exception as e:
+                        self.queue.finish(job.id, False, str(e))
+                        raise
+                    self.queue.finish(job.id, ok)
+                    results.append(ok)
+                return results
+            
+            try:
+                with ThreadPoolExecutor(max_workers=max(1, self.jobs)) as executor:
+                    futures = [executor.submit(worker) for _ in range(max(1, self.jobs))]
+                    results = [ok for future in futures for ok in future.result()]
+            finally:
+                if self.session:
+                    self.session.close()
+                    self.session = None
+                if cache:
+                    cache.close()
+            
+            # 成功计数
+            total_courses = len(results)
+            successful_courses = sum(1 for ok in results if ok)
+            failed_courses = total_courses - successful_courses
+            
+            # 总结结果
+            self.log.add("\n=== 下载完成 ===" if not self._stop.is_set() else "\n=== 下载已停止 ===")
+            self.log.add(f"总课程数: {total_courses}")
+            self.log.add(f"成功下载: {successful_courses} 个课程")
+            if failed_courses > 0:
+                self.log.add(f"下载失败: {failed_courses} 个课程")
+            self.log.add(f"总共下载了 {self.total_files_downloaded} 个文件")
+            if self.metrics.courses:
+                self.metrics.finish()
+                for line in self.metrics.summary_lines():
+                    self.log.add(line)
+                record_throughput(self.metrics)
+            if cache:
+                self.log.add(cache.summary())
+            
+            if self._stop.is_set():
+                self.log.add("未完成的课程已保存在下载队列中，下次启动时继续")
+                self.finish(False, "下载已停止")
+            elif successful_courses == total_courses:
+                self.finish(True, f"所有 {total_courses} 个课程下载成功")
+            else:
+                self.finish(False, f"部分课程下载失败 ({failed_courses}/{total_courses})")
+                
+        except FileNotFoundError:
+            self.log.add("错误: 找不到canvassyncer命令")
+            self.log.add("请确保已安装canvassyncer，可以使用 'pip install canvassyncer' 安装")
+            self.finish(False, "找不到canvassyncer命令")
+        except Exception as e:
+            self.log.add(f"错误: {str(e)}")
+            self.finish(False, str(e))
+            
+    def enqueue_config(self):
+        """验证配置文件并把其中的课程加入任务队列，失败时报告错误并返回False"""
+        self.log.add(f"开始下载: {os.path.basename(self.config_file)}")
         
         # 验证配置文件
         try:
@@ -91,193 +370,201 @@ class DownloadThread(QThread):
                 
             for field in required_fields:
                 if field not in config:
-                    self.progress_signal.emit(f"错误: 配置缺少必要字段 '{field}'")
-                    self.finished_signal.emit(False, f"配置缺少必要字段: {field}")
-                    return
+                    self.log.add(f"错误: 配置缺少必要字段 '{field}'")
+                    self.finish(False, f"配置缺少必要字段: {field}")
+                    return False
             
             # 检查是否有课程ID
             if "courseIDs" in config and not config["courseIDs"]:
-                self.progress_signal.emit("错误: 没有指定任何课程ID")
-                self.finished_signal.emit(False, "没有指定任何课程ID")
-                return
+                self.log.add("错误: 没有指定任何课程ID")
+                self.finish(False, "没有指定任何课程ID")
+                return False
                 
         except Exception as e:
-            self.progress_signal.emit(f"错误: 无法解析配置文件: {e}")
-            self.finished_signal.emit(False, f"无法解析配置文件: {e}")
-            return
+            self.log.add(f"错误: 无法解析配置文件: {e}")
+            self.finish(False, f"无法解析配置文件: {e}")
+            return False
+        
+        # 每个课程单独成为一个任务，已在队列中的课程只更新优先级
+        for course_id in config.get("courseIDs", []):
+            single_course_config = dict(config, courseIDs=[course_id])
+            self.queue.add_course(single_course_config, course_id, self.priority)
+        return True
+            
+    def download_course_native(self, config, course_id, emit, job_id=None):
+        """使用内置引擎下载单个课程，根据引擎的进度事件显示日志并记录文件任务，返回是否成功"""
+        summary = {}
+        host = urlparse(config.get("canvasURL") or config.get("base_url") or "").netloc.lower()
+        
+        def on_event(event):
+            kind = event["event"]
+            self.metrics.record(event, host)
+            if job_id is not None and event.get("file_id") is not None:
+                self.record_file_event(job_id, event)
+            # 引擎每个文件和每0.5秒的进度都会回调，在这里响应停止请求；先记录事件，已完成的文件不会丢失状态
+            self.check_stopped()
+            if kind == SUMMARY:
+                summary.update(event)
+            elif kind not in (FILE_STARTED, BYTES):
+                emit(format_event(event))
+        
+        if self.daemon:
+            try:
+                self.daemon.sync(config, on_event, course_ids=[course_id], timeout=self.timeout)
+            except DaemonError as e:
+                emit(f"课程 {course_id} 下载失败: 后台服务出错: {e}")
+                return False
+        else:
+            sync_course(self.session, normalize_config(config), course_id,
+                        events=on_event, timeout=self.timeout)
+        if summary.get("success"):
+            emit(f"课程 {course_id} 下载成功！共下载了 {summary['files_downloaded']} 个文件。")
+            with self._count_lock:
+                self.total_files_downloaded += summary["files_downloaded"]
+            return True
+        
+        errors = summary.get("errors") or []
+        emit(f"课程 {course_id} 下载失败: {errors[0] if errors else '未知错误'}")
+        return False
+        
+    def build_command(self, canvassyncer_path, temp_course_config):
+        """构建单个课程的canvassyncer命令"""
+        if canvassyncer_path == "python3 -m canvassyncer":
+            return ["python3", "-m", "canvassyncer", "-p", temp_course_config]
+        return [canvassyncer_path, "-p", temp_course_config]
+        
+    def record_file_event(self, job_id, event):
+        """把文件相关的进度事件记录为文件任务"""
+        kind = event["event"]
+        if kind == FILE_STARTED:
+            self.queue.record_file(job_id, event["file_id"], RUNNING, event.get("name"), event.get("path"))
+        elif kind == FILE_DONE:
+            self.queue.record_file(job_id, event["file_id"], DONE, event.get("name"), event.get("path"))
+        elif kind == ERROR and not event.get("retry"):
+            self.queue.record_file(job_id, event["file_id"], FAILED, event.get("name"),
+                                   error=event.get("message"))
+        
+    def download_single_course(self, config, course_id, index, total_courses, canvassyncer_path, job_id=None):
+        """下载单个课程，返回是否成功；收到停止请求时抛出JobInterrupted"""
+        # 并发时给每行输出加上课程前缀，便于区分
+        if self.jobs > 1 and total_courses > 1:
+            prefix = f"[课程 {course_id}] "
+        else:
+            prefix = ""
+        
+        def emit(message, progress=False):
+            # 同一课程的进度条行在一批日志中合并为一行
+            self.log.add(f"{prefix}{message}", course_id if progress else None)
+        
+        self.current_course = course_id
+        self.log.add(f"\n=== 课程 {index+1}/{total_courses}: ID {course_id} ===")
+        
+        if self.engine == "native":
+            return self.download_course_native(config, course_id, emit, job_id)
+        
+        # 创建单课程的临时配置
+        fd, temp_course_config = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
         
-        # 执行下载
         try:
-            # 查找canvassyncer可执行文件路径
-            canvassyncer_path = find_canvassyncer_path()
+            # 复制原始配置并更新单课程ID
+            single_course_config = config.copy()
+            single_course_config["courseIDs"] = [course_id]
             
-            # 成功计数
-            successful_courses = 0
-            failed_courses = 0
+            with open(temp_course_config, 'w', encoding='utf-8') as f:
+                json.dump(single_course_config, f, indent=2, ensure_ascii=False)
             
-            # 读取课程ID列表
-            course_ids = config.get("courseIDs", [])
-            total_courses = len(course_ids)
+            # 构建命令
+            command = self.build_command(canvassyncer_path, temp_course_config)
+                
+            emit(f"使用路径: {canvassyncer_path}")
+            emit(f"执行命令: {' '.join(command)}")
             
-            self.progress_signal.emit(f"准备下载 {total_courses} 个课程的文件")
+            # 创建进程
+            process = subprocess.Popen(
+                command,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                text=True,
+                universal_newlines=True
+            )
             
-            for i, course_id in enumerate(course_ids):
-                self.current_course = course_id
-                self.progress_signal.emit(f"\n=== 课程 {i+1}/{total_courses}: ID {course_id} ===")
-                
-                # 创建单课程的临时配置
-                import tempfile
-                fd, temp_course_config = tempfile.mkstemp(suffix='.json')
-                os.close(fd)
-                
-                # 复制原始配置并更新单课程ID
-                single_course_config = config.copy()
-                single_course_config["courseIDs"] = [course_id]
-                
-                with open(temp_course_config, 'w', encoding='utf-8') as f:
-                    json.dump(single_course_config, f, indent=2, ensure_ascii=False)
-                
-                # 构建命令
-                if canvassyncer_path == "python3 -m canvassyncer":
-                    command = ["python3", "-m", "canvassyncer", "-p", temp_course_config]
-                else:
-                    command = [canvassyncer_path, "-p", temp_course_config]
-                    
-                self.progress_signal.emit(f"使用路径: {canvassyncer_path}")
-                self.progress_signal.emit(f"执行命令: {' '.join(command)}")
-                
-                # 创建进程
-                process = subprocess.Popen(
-                    command,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    text=True,
-                    universal_newlines=True
-                )
-                
-                # 记录标准输出和错误
-                stdout_lines = []
-                stderr_lines = []
-                
-                # 读取输出
-                for line in process.stdout:
-                    cleaned_line = line.strip()
-                    stdout_lines.append(cleaned_line)
-                    self.progress_signal.emit(cleaned_line)
-                
-                # 尝试读取错误输出
-                for line in process.stderr:
+            # 边读边分析输出，不保存完整的输出
+            output = SyncerOutput()
+            
+            # 同时读取标准输出和错误输出(canvassyncer的进度条写在stderr)，输出一到就显示
+            try:
+                for stream, line in read_process_output(process, self.timeout):
+                    if self._stop.is_set():
+                        process.kill()
+                        process.wait()
+                        raise JobInterrupted()
                     cleaned_line = line.strip()
-                    stderr_lines.append(cleaned_line)
+                    if stream == "stdout":
+                        output.feed_stdout(cleaned_line)
+                        emit(cleaned_line)
+                        continue
                     
                     # 检查是否为进度条或无害警告
-                    if self.is_progress_bar(cleaned_line) or self.is_harmless_warning(cleaned_line):
+                    progress = self.is_progress_bar(cleaned_line)
+                    noise = progress or self.is_harmless_warning(cleaned_line)
+                    output.feed_stderr(cleaned_line, noise)
+                    if noise:
                         # 仍然显示输出，但不将其视为错误
-                        self.progress_signal.emit(f"信息: {cleaned_line}")
-                    else:
-                        self.progress_signal.emit(f"错误: {cleaned_line}")
-                    
-                # 等待进程完成，最多等待timeout秒
-                try:
-                    return_code = process.wait(timeout=self.timeout)
-                    
-                    # 检查是否有可能的错误
-                    has_error = False
-                    error_message = ""
-                    
-                    # 检查错误输出和常见错误信息
-                    for line in stderr_lines:
-                        if line and not self.is_harmless_warning(line) and not self.is_progress_bar(line):
-                            has_error = True
-                            error_message = line
-                            break
-                            
-                    # 检查标准输出中的错误信息
-                    for line in stdout_lines:
-                        if "error:" in line.lower() or "exception:" in line.lower() or "traceback" in line.lower():
-                            has_error = True
-                            error_message = line
-                            break
-                    
-                    # 特别处理KeyError情况
-                    if any("KeyError" in line for line in stdout_lines):
-                        self.progress_signal.emit(f"错误: 课程 {course_id} 配置或网络问题")
-                        self.progress_signal.emit("请检查:")
-                        self.progress_signal.emit("1. Canvas API令牌是否有效")
-                        self.progress_signal.emit("2. Canvas网址是否正确")
-                        self.progress_signal.emit("3. 课程ID是否存在")
-                        self.progress_signal.emit("4. 网络连接是否正常")
-                        failed_courses += 1
-                        # 删除临时文件
-                        try:
-                            os.remove(temp_course_config)
-                        except:
-                            pass
-                        continue
-                    
-                    # 检查下载完成的文件数量
-                    files_found = 0
-                    files_downloaded = 0
-                    
-                    for line in stdout_lines:
-                        if "Get " in line and " files!" in line:
-                            try:
-                                files_found = int(line.split("Get ")[1].split(" files")[0])
-                            except:
-                                pass
-                        
-                        if "Start to download " in line and " file(s)!" in line:
-                            try:
-                                files_downloaded = int(line.split("Start to download ")[1].split(" file(s)")[0])
-                            except:
-                                pass
-                    
-                    # 如果找到文件并开始下载，且没有明确的错误，就认为是成功的
-                    if files_found > 0 and not has_error:
-                        self.progress_signal.emit(f"课程 {course_id} 下载成功！共下载了 {files_downloaded} 个文件。")
-                        successful_courses += 1
-                        self.total_files_downloaded += files_downloaded
-                    elif return_code == 0 and not has_error:
-                        self.progress_signal.emit(f"课程 {course_id} 下载成功!")
-                        successful_courses += 1
+                        emit(f"信息: {cleaned_line}", progress)
                     else:
-                        if has_error:
-                            self.progress_signal.emit(f"课程 {course_id} 下载失败: {error_message}")
-                        else:
-                            self.progress_signal.emit(f"课程 {course_id} 下载失败，返回代码: {return_code}")
-                        failed_courses += 1
-                        
-                except subprocess.TimeoutExpired:
-                    process.kill()
-                    self.progress_signal.emit(f"课程 {course_id} 下载超时 (>{self.timeout}秒)")
-                    failed_courses += 1
+                        emit(f"错误: {cleaned_line}")
                 
-                # 删除临时文件
-                try:
-                    os.remove(temp_course_config)
-                except:
-                    pass
+                # 输出已经结束，等待进程退出
+                return_code = process.wait(timeout=self.timeout)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+                emit(f"课程 {course_id} 下载超时 (>{self.timeout}秒)")
+                return False
             
-            # 总结结果
-            self.progress_signal.emit("\n=== 下载完成 ===")
-            self.progress_signal.emit(f"总课程数: {total_courses}")
-            self.progress_signal.emit(f"成功下载: {successful_courses} 个课程")
-            if failed_courses > 0:
-                self.progress_signal.emit(f"下载失败: {failed_courses} 个课程")
-            self.progress_signal.emit(f"总共下载了 {self.total_files_downloaded} 个文件")
+            # canvassyncer不处理Canvas限流，被限流时同样表现为KeyError
+            if output.rate_limited:
+                emit(f"错误: 课程 {course_id} 请求过于频繁，被Canvas限流")
+                emit("请减少并发数，或使用内置下载引擎(会自动限速并重试)")
+                return False
+
+            # 特别处理KeyError情况
+            if output.key_error:
+                emit(f"错误: 课程 {course_id} 配置或网络问题")
+                emit("请检查:")
+                emit("1. Canvas API令牌是否有效")
+                emit("2. Canvas网址是否正确")
+                emit("3. 课程ID是否存在")
+                emit("4. 网络连接是否正常")
+                return False
             
-            if successful_courses == total_courses:
-                self.finished_signal.emit(True, f"所有 {total_courses} 个课程下载成功")
+            # 如果找到文件并开始下载，且没有明确的错误，就认为是成功的
+            has_error = output.has_error()
+            if output.files_found > 0 and not has_error:
+                emit(f"课程 {course_id} 下载成功！共下载了 {output.files_downloaded} 个文件。")
+                with self._count_lock:
+                    self.total_files_downloaded += output.files_downloaded
+                return True
+            elif return_code == 0 and not has_error:
+                emit(f"课程 {course_id} 下载成功!")
+                return True
+            
+            if output.recent:
+                emit("最近的输出:")
+                for recent_line in output.recent:
+                    emit(f"  {recent_line}")
+            if has_error:
+                emit(f"课程 {course_id} 下载失败: {output.error_message()}")
             else:
-                self.finished_signal.emit(False, f"部分课程下载失败 ({failed_courses}/{total_courses})")
-                
-        except FileNotFoundError:
-            self.progress_signal.emit("错误: 找不到canvassyncer命令")
-            self.progress_signal.emit("请确保已安装canvassyncer，可以使用 'pip install canvassyncer' 安装")
-            self.finished_signal.emit(False, "找不到canvassyncer命令")
-        except Exception as e:
-            self.progress_signal.emit(f"错误: {str(e)}")
-            self.finished_signal.emit(False, str(e))
+                emit(f"课程 {course_id} 下载失败，返回代码: {return_code}")
+            return False
+        finally:
+            # 删除临时文件
+            try:
+                os.remove(temp_course_config)
+            except:
+                pass
             
     def is_progress_bar(self, line):
         """检查是否为进度条输出"""
@@ -317,11 +604,48 @@ class DownloadThread(QThread):
         return False
 
 
+class PlanThread(QThread):
+    """预览线程：只列出课程文件并估计需要下载的内容，不下载文件"""
+    progress_signal = pyqtSignal(str)
+    finished_signal = pyqtSignal(bool, str)
+    
+    def __init__(self, config, jobs=1):
+        super().__init__()
+        self.config = config
+        self.jobs = jobs
+        
+    def run(self):
+        try:
+            settings = normalize_config(self.config)
+        except ValueError as e:
+            self.finished_signal.emit(False, f"配置无效: {e}")
+            return
+        self.progress_signal.emit(f"正在预览 {len(settings['course_ids'])} 个课程...")
+        session = CanvasSession(cache=open_cache())
+        started = time.monotonic()
+        try:
+            plans = plan_courses(session, [(settings, course_id) for course_id in settings["course_ids"]])
+        except Exception as e:
+            self.finished_signal.emit(False, str(e))
+            return
+        finally:
+            session.close()
+            if session.cache:
+                session.cache.close()
+        for line in format_plan(plans, ThroughputHistory().load(), self.jobs):
+            self.progress_signal.emit(line)
+        self.progress_signal.emit(f"预览用时 {time.monotonic() - started:.1f}秒")
+        failed = [plan for plan in plans if plan.error]
+        self.finished_signal.emit(not failed, f"{len(failed)} 个课程无法预览" if failed else "预览完成")
+
+
 class ConfigEditorWidget(QWidget):
     """配置编辑器小部件"""
     
     def __init__(self, parent=None):
         super().__init__(parent)
+        # 加载的配置中界面无法显示的筛选规则，保存时原样写回
+        self.extra_filters = {}
         self.init_ui()
         
     def init_ui(self):
@@ -404,6 +728,21 @@ class ConfigEditorWidget(QWidget):
         types_layout.addLayout(excludes_layout)
         
         filter_layout.addLayout(types_layout)
+        
+        # 目录、大小和日期筛选，列出文件时就排除，不会进入下载队列
+        rules_layout = QFormLayout()
+        self.paths_input = QLineEdit()
+        self.paths_input.setPlaceholderText("例如: Lectures/**, Homework/*.pdf (留空表示全部目录)")
+        self.video_limit_spin = QSpinBox()
+        self.video_limit_spin.setRange(0, 100000)
+        self.video_limit_spin.setSuffix(" MB")
+        self.video_limit_spin.setSpecialValueText("不限")
+        self.modified_after_input = QLineEdit()
+        self.modified_after_input.setPlaceholderText("YYYY-MM-DD (留空表示不限)")
+        rules_layout.addRow("只下载这些路径:", self.paths_input)
+        rules_layout.addRow("跳过大于此大小的视频:", self.video_limit_spin)
+        rules_layout.addRow("只下载此日期后修改的文件:", self.modified_after_input)
+        filter_layout.addLayout(rules_layout)
         filter_group.setLayout(filter_layout)
         
         # 按钮
@@ -485,6 +824,10 @@ class ConfigEditorWidget(QWidget):
         if excludes:
             config["excludes"] = excludes
             
+        filters = self.get_filters()
+        if filters:
+            config["filters"] = filters
+            
         # 保存到文件
         try:
             with open(file_path, 'w', encoding='utf-8') as f:
@@ -538,6 +881,8 @@ class ConfigEditorWidget(QWidget):
             for i in range(self.excludes_list.count()):
                 self.excludes_list.item(i).setSelected(False)
                 
+            self.set_filters(config.get("filters"))
+                
             # 设置包含的文件类型
             if "includes" in config:
                 for i in range(self.includes_list.count()):
@@ -581,6 +926,12 @@ class ConfigEditorWidget(QWidget):
             QMessageBox.warning(self, "验证失败", "请选择下载路径")
             return False
             
+        try:
+            FileFilter.from_settings({"filters": self.get_filters()})
+        except ValueError as e:
+            QMessageBox.warning(self, "验证失败", f"筛选规则无效: {e}")
+            return False
+            
         return True
         
     def get_config(self):
@@ -626,7 +977,65 @@ class ConfigEditorWidget(QWidget):
         if excludes:
             config["excludes"] = excludes
             
+        filters = self.get_filters()
+        if filters:
+            config["filters"] = filters
+            
         return config
+        
+    def get_filters(self):
+        """根据界面上的路径、视频大小和日期设置生成filters，没有规则时返回None"""
+        filters = {key: value for key, value in self.extra_filters.items() if key not in ("include", "exclude")}
+        include = list(self.extra_filters.get("include", []))
+        exclude = list(self.extra_filters.get("exclude", []))
+        
+        paths = [path.strip() for path in self.paths_input.text().split(",") if path.strip()]
+        if paths:
+            include.append({"path": paths})
+        if self.video_limit_spin.value():
+            exclude.append({"content_type": "video", "min_size": f"{self.video_limit_spin.value()}MB"})
+        modified_after = self.modified_after_input.text().strip()
+        if modified_after:
+            filters["modified_after"] = modified_after
+        
+        if include:
+            filters["include"] = include
+        if exclude:
+            filters["exclude"] = exclude
+        return filters or None
+        
+    def set_filters(self, filters):
+        """把配置中的filters显示在界面上，界面无法显示的规则保存在extra_filters中"""
+        filters = dict(filters or {})
+        self.paths_input.clear()
+        self.video_limit_spin.setValue(0)
+        self.modified_after_input.setText(str(filters.pop("modified_after", "") or ""))
+        
+        include = []
+        paths = []
+        for rule in filters.pop("include", None) or []:
+            if isinstance(rule, dict) and set(rule) == {"path"}:
+                paths.extend(rule["path"] if isinstance(rule["path"], list) else [rule["path"]])
+            else:
+                include.append(rule)
+        self.paths_input.setText(", ".join(paths))
+        
+        exclude = []
+        for rule in filters.pop("exclude", None) or []:
+            if (isinstance(rule, dict) and set(rule) == {"content_type", "min_size"}
+                    and rule["content_type"] == "video" and not self.video_limit_spin.value()):
+                try:
+                    self.video_limit_spin.setValue(max(1, round(parse_size(rule["min_size"]) / 1000000)))
+                    continue
+                except ValueError:
+                    pass
+            exclude.append(rule)
+        
+        if include:
+            filters["include"] = include
+        if exclude:
+            filters["exclude"] = exclude
+        self.extra_filters = filters
 
 
 class CanvasDownloaderGUI(QMainWindow):
@@ -636,7 +1045,11 @@ class CanvasDownloaderGUI(QMainWindow):
         super().__init__()
         self.temp_config_file = None
         self.download_threads = []
+        self.plan_thread = None
+        self.job_queue = JobQueue()
         self.init_ui()
+        # 窗口显示后再询问是否继续上次未完成的任务
+        QTimer.singleShot(0, self.resume_unfinished_jobs)
         
     def init_ui(self):
         """初始化UI"""
@@ -671,10 +1084,36 @@ class CanvasDownloaderGUI(QMainWindow):
         self.timeout_spin.setRange(60, 3600)
         self.timeout_spin.setValue(300)
         self.timeout_spin.setSingleStep(60)
+        self.timeout_spin.setToolTip("每个课程的基础超时时间；内置引擎会按待下载的文件大小自动延长，"
+                                     "并在单个文件传输停滞时自动重试")
         timeout_layout.addWidget(timeout_label)
         timeout_layout.addWidget(self.timeout_spin)
         
+        jobs_layout = QHBoxLayout()
+        jobs_label = QLabel("同时下载课程数:")
+        self.jobs_spin = QSpinBox()
+        self.jobs_spin.setRange(1, 8)
+        self.jobs_spin.setValue(1)
+        self.jobs_spin.setToolTip("默认与命令行的 -j 相同，一次只下载一个课程；课程较多时可以调大")
+        jobs_layout.addWidget(jobs_label)
+        jobs_layout.addWidget(self.jobs_spin)
+        
+        priority_layout = QHBoxLayout()
+        priority_label = QLabel("优先级:")
+        self.priority_spin = QSpinBox()
+        self.priority_spin.setRange(MIN_PRIORITY, MAX_PRIORITY)
+        self.priority_spin.setToolTip("数值大的课程先下载，例如把本周的课程设为较高优先级，归档课程保持0")
+        priority_layout.addWidget(priority_label)
+        priority_layout.addWidget(self.priority_spin)
+        
+        self.native_engine_check = QCheckBox("使用内置下载引擎")
+        self.native_engine_check.setChecked(True)
+        self.native_engine_check.setToolTip("取消勾选则为每个课程调用canvassyncer命令")
+        
         settings_layout.addLayout(timeout_layout)
+        settings_layout.addLayout(jobs_layout)
+        settings_layout.addLayout(priority_layout)
+        settings_layout.addWidget(self.native_engine_check)
         settings_layout.addStretch()
         settings_group.setLayout(settings_layout)
         
@@ -683,20 +1122,51 @@ class CanvasDownloaderGUI(QMainWindow):
         self.download_btn = QPushButton("开始下载")
         self.download_btn.clicked.connect(self.start_download)
         self.download_btn.setStyleSheet("background-color: #4CAF50; color: white; font-weight: bold;")
+        self.plan_btn = QPushButton("预览")
+        self.plan_btn.setToolTip("只列出课程文件，显示需要下载的文件数量、大小和预计用时，不下载文件")
+        self.plan_btn.clicked.connect(self.start_plan)
         controls_layout.addStretch()
+        controls_layout.addWidget(self.plan_btn)
         controls_layout.addWidget(self.download_btn)
         
+        # 下载队列
+        queue_group = QGroupBox("下载队列")
+        queue_layout = QHBoxLayout()
+        self.queue_list = QListWidget()
+        self.queue_list.setMaximumHeight(120)
+        queue_buttons = QVBoxLayout()
+        raise_btn = QPushButton("提高优先级")
+        raise_btn.clicked.connect(lambda: self.change_job_priority(1))
+        lower_btn = QPushButton("降低优先级")
+        lower_btn.clicked.connect(lambda: self.change_job_priority(-1))
+        remove_btn = QPushButton("移除")
+        remove_btn.clicked.connect(self.remove_job)
+        queue_buttons.addWidget(raise_btn)
+        queue_buttons.addWidget(lower_btn)
+        queue_buttons.addWidget(remove_btn)
+        queue_buttons.addStretch()
+        queue_layout.addWidget(self.queue_list)
+        queue_layout.addLayout(queue_buttons)
+        queue_group.setLayout(queue_layout)
+        
+        self.queue_timer = QTimer(self)
+        self.queue_timer.timeout.connect(self.refresh_queue)
+        self.queue_timer.start(1000)
+        
         # 日志输出
         log_group = QGroupBox("下载日志")
         log_layout = QVBoxLayout()
-        self.log_text = QTextEdit()
+        # 只保留最近的日志行，长时间同步时内存不会持续增长
+        self.log_text = QPlainTextEdit()
         self.log_text.setReadOnly(True)
+        self.log_text.setMaximumBlockCount(LOG_MAX_LINES)
         log_layout.addWidget(self.log_text)
         log_group.setLayout(log_layout)
         
         # 将所有组件添加到下载页面
         download_layout.addWidget(settings_group)
         download_layout.addLayout(controls_layout)
+        download_layout.addWidget(queue_group)
         download_layout.addWidget(log_group)
         
         tab_widget.addTab(download_widget, "下载管理")
@@ -768,42 +1238,128 @@ class CanvasDownloaderGUI(QMainWindow):
                 
             # 清空日志
             self.log_text.clear()
-            self.log_text.append(f"使用配置文件: {self.temp_config_file}")
-            self.log_text.append(f"Canvas网址: {config['canvasURL']}")
+            self.log_text.appendPlainText(f"使用配置文件: {self.temp_config_file}")
+            self.log_text.appendPlainText(f"Canvas网址: {config['canvasURL']}")
             
             # 显示所有课程ID
             if 'courseIDs' in config and config['courseIDs']:
-                self.log_text.append(f"课程ID: {', '.join(map(str, config['courseIDs']))}")
-                self.log_text.append(f"待下载课程数量: {len(config['courseIDs'])}")
+                self.log_text.appendPlainText(f"课程ID: {', '.join(map(str, config['courseIDs']))}")
+                self.log_text.appendPlainText(f"待下载课程数量: {len(config['courseIDs'])}")
             
-            self.log_text.append(f"下载目录: {config['downloadDir']}")
+            self.log_text.appendPlainText(f"下载目录: {config['downloadDir']}")
             if 'includes' in config:
-                self.log_text.append(f"包含文件类型: {', '.join(config['includes'])}")
+                self.log_text.appendPlainText(f"包含文件类型: {', '.join(config['includes'])}")
             if 'excludes' in config:
-                self.log_text.append(f"排除文件类型: {', '.join(config['excludes'])}")
-            self.log_text.append("正在准备下载...")
-            
-            # 创建并启动下载线程
-            thread = DownloadThread(self.temp_config_file, self.timeout_spin.value())
-            thread.progress_signal.connect(self.update_log)
-            thread.finished_signal.connect(self.download_finished)
+                self.log_text.appendPlainText(f"排除文件类型: {', '.join(config['excludes'])}")
+            if 'filters' in config:
+                self.log_text.appendPlainText(f"筛选规则: {json.dumps(config['filters'], ensure_ascii=False)}")
+            self.log_text.appendPlainText("正在准备下载...")
             
-            # 禁用下载按钮，避免重复点击
-            self.download_btn.setEnabled(False)
-            self.download_btn.setText("下载中...")
-            
-            # 保存并启动线程
-            self.download_threads.append(thread)
-            thread.start()
+            self.start_thread(self.temp_config_file)
             
         except Exception as e:
             QMessageBox.critical(self, "错误", f"启动下载失败: {str(e)}")
             self.download_btn.setEnabled(True)
             self.download_btn.setText("开始下载")
             
+    def start_plan(self):
+        """预览当前配置中的课程"""
+        if not self.config_editor.validate_inputs():
+            return
+        self.log_text.clear()
+        self.plan_thread = PlanThread(self.config_editor.get_config(), self.jobs_spin.value())
+        self.plan_thread.progress_signal.connect(self.update_log)
+        self.plan_thread.finished_signal.connect(self.plan_finished)
+        self.plan_btn.setEnabled(False)
+        self.plan_btn.setText("预览中...")
+        self.plan_thread.start()
+        
+    def plan_finished(self, success, message):
+        self.plan_btn.setEnabled(True)
+        self.plan_btn.setText("预览")
+        if not success:
+            QMessageBox.warning(self, "警告", f"预览未完全成功: {message}")
+        
+    def start_thread(self, config_file):
+        """创建并启动下载线程；config_file为None时只处理队列中已有的任务"""
+        engine = "native" if self.native_engine_check.isChecked() else "canvassyncer"
+        thread = DownloadThread(config_file, self.timeout_spin.value(), self.jobs_spin.value(), engine,
+                                self.job_queue, self.priority_spin.value())
+        thread.progress_signal.connect(self.update_log)
+        thread.finished_signal.connect(self.download_finished)
+        
+        # 禁用下载按钮，避免重复点击
+        self.download_btn.setEnabled(False)
+        self.download_btn.setText("下载中...")
+        
+        # 只保留仍在运行的线程
+        self.download_threads = [t for t in self.download_threads if t.isRunning()]
+        self.download_threads.append(thread)
+        thread.start()
+        
+    def resume_unfinished_jobs(self):
+        """启动时恢复上次没有完成的任务"""
+        self.job_queue.requeue_interrupted()
+        jobs = self.job_queue.unfinished()
+        self.refresh_queue()
+        if not jobs:
+            return
+        reply = QMessageBox.question(
+            self, "继续下载",
+            f"发现 {len(jobs)} 个上次没有完成的课程下载任务，是否继续下载？\n"
+            "选择“否”将清空这些任务。",
+            QMessageBox.Yes | QMessageBox.No, QMessageBox.Yes)
+        if reply == QMessageBox.Yes:
+            self.log_text.clear()
+            self.log_text.appendPlainText(f"继续上次未完成的 {len(jobs)} 个课程...")
+            self.start_thread(None)
+        else:
+            self.job_queue.clear_pending()
+            self.refresh_queue()
+            
+    def refresh_queue(self):
+        """刷新下载队列列表，保持当前选中的任务"""
+        current = self.queue_list.currentItem()
+        selected = current.data(Qt.UserRole) if current else None
+        self.queue_list.clear()
+        for job in self.job_queue.unfinished():
+            text = f"[优先级 {job.priority}] 课程 {job.course_id} - {STATE_NAMES.get(job.state, job.state)}"
+            if job.attempts > 1 or (job.attempts and job.state != RUNNING):
+                text += f" (第 {job.attempts} 次尝试)"
+            item = QListWidgetItem(text)
+            item.setData(Qt.UserRole, job.id)
+            self.queue_list.addItem(item)
+            if job.id == selected:
+                self.queue_list.setCurrentItem(item)
+                
+    def selected_job(self):
+        item = self.queue_list.currentItem()
+        if item is None:
+            return None
+        job_id = item.data(Qt.UserRole)
+        for job in self.job_queue.unfinished():
+            if job.id == job_id:
+                return job
+        return None
+        
+    def change_job_priority(self, delta):
+        job = self.selected_job()
+        if job:
+            self.job_queue.set_priority(job.id, job.priority + delta)
+            self.refresh_queue()
+            
+    def remove_job(self):
+        job = self.selected_job()
+        if job:
+            if job.state == RUNNING:
+                QMessageBox.information(self, "提示", "正在下载的课程不能移除")
+                return
+            self.job_queue.remove(job.id)
+            self.refresh_queue()
+        
     def update_log(self, message):
-        """更新日志输出"""
-        self.log_text.append(message)
+        """更新日志输出，message是下载线程合并后的一批日志"""
+        self.log_text.appendPlainText(message)
         # 滚动到底部
         self.log_text.verticalScrollBar().setValue(
             self.log_text.verticalScrollBar().maximum()
@@ -830,11 +1386,21 @@ class CanvasDownloaderGUI(QMainWindow):
         
     def closeEvent(self, event):
         """关闭时清理"""
-        # 停止所有线程
+        # 请求所有线程停止，正在下载的课程放回队列，下次启动时从断点继续
         for thread in self.download_threads:
             if thread.isRunning():
+                thread.stop()
+        for thread in self.download_threads:
+            if thread.isRunning() and not thread.wait(STOP_WAIT_MS):
+                # 长时间没有响应(例如网络请求卡住)，只能强制结束；任务会在下次启动时恢复
                 thread.terminate()
                 thread.wait()
+        # 预览只读取元数据，不需要保存状态
+        if self.plan_thread and self.plan_thread.isRunning() and not self.plan_thread.wait(STOP_WAIT_MS):
+            self.plan_thread.terminate()
+            self.plan_thread.wait()
+        self.queue_timer.stop()
+        self.job_queue.close()
                 
         # 删除临时文件
         if self.temp_config_file and os.path.exists(self.temp_config_file):
@@ -0,0 +1,774 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Canvas内置同步引擎
+直接调用Canvas Files API列出并下载课程文件，不再为每个课程启动canvassyncer子进程。
+所有课程共享同一个带连接池的HTTP会话。
+"""
+
+import os
+import re
+import json
+import time
+import socket
+import sqlite3
+import logging
+import threading
+import http.client
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse, urljoin, urlencode
+
+from canvas_manifest import get_manifest
+from canvas_partial import PartialDownload, IncompleteDownloadError, parse_content_range
+from canvas_stall import StallError, StallPolicy
+from canvas_listing import PendingFiles, iter_items, LIST_CONCURRENCY
+from canvas_store import get_store, place_file
+from canvas_ratelimit import get_throttle, is_rate_limited, MAX_THROTTLE_RETRIES
+from canvas_events import make_event, ByteProgress, LISTED, FILE_STARTED, FILE_DONE, ERROR, SUMMARY
+from canvas_retry import RetryPolicy, is_transient
+from canvas_filters import FileFilter, parse_date
+from canvas_segments import SegmentPolicy, DEFAULT_SEGMENTS
+
+logger = logging.getLogger("canvas-downloader-engine")
+
+USER_AGENT = "canvas-downloader/0.1.0"
+CHUNK_SIZE = 64 * 1024
+MAX_REDIRECTS = 5
+
+
+class CanvasAPIError(Exception):
+    """Canvas接口返回错误状态码"""
+
+    def __init__(self, status, message, url=""):
+        super().__init__(f"HTTP {status}: {message}")
+        self.status = status
+        self.message = message
+        self.url = url
+
+
+class CourseTimeout(Exception):
+    """课程同步超过了允许的时间"""
+
+
+class CanvasSession:
+    """线程安全的HTTP连接池，在所有课程之间共享，保持连接复用"""
+
+    def __init__(self, timeout=30, pool_size=8, cache=None):
+        self.timeout = timeout
+        self.pool_size = pool_size
+        # 可选的ResponseCache(见canvas_cache)，get_json据此发送条件请求
+        self.cache = cache
+        self._lock = threading.Lock()
+        self._idle = {}
+
+    def _connect(self, key):
+        scheme, host, port = key
+        if scheme == "https":
+            return http.client.HTTPSConnection(host, port, timeout=self.timeout)
+        return http.client.HTTPConnection(host, port, timeout=self.timeout)
+
+    def _acquire(self, key):
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                return idle.pop(), True
+        return self._connect(key), False
+
+    def _release(self, key, conn):
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.pool_size:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        """关闭所有空闲连接"""
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+    def _send(self, method, url, headers):
+        """发送一次请求，返回(连接键, 连接, 响应)"""
+        parsed = urlparse(url)
+        scheme = parsed.scheme or "https"
+        port = parsed.port or (443 if scheme == "https" else 80)
+        key = (scheme, parsed.hostname, port)
+        path = parsed.path or "/"
+        if parsed.query:
+            path += "?" + parsed.query
+
+        conn, reused = self._acquire(key)
+        try:
+            conn.request(method, path, headers=headers)
+            return key, conn, conn.getresponse()
+        except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+            conn.close()
+            if not reused:
+                raise
+        # 复用的连接可能已被服务器关闭，换一个新连接重试一次
+        conn = self._connect(key)
+        try:
+            conn.request(method, path, headers=headers)
+            return key, conn, conn.getresponse()
+        except Exception:
+            conn.close()
+            raise
+
+    def open(self, method, url, token=None, headers=None):
+        """发送请求并跟随重定向，返回CanvasResponse（需要调用close归还连接）"""
+        origin = urlparse(url).netloc
+        redirects = 0
+        attempt = 0
+        while redirects <= MAX_REDIRECTS:
+            request_headers = {"User-Agent": USER_AGENT, "Accept-Encoding": "identity"}
+            # 令牌只发送给Canvas站点本身，不发送给文件存储服务器
+            to_canvas = bool(token) and urlparse(url).netloc == origin
+            if to_canvas:
+                request_headers["Authorization"] = f"Bearer {token}"
+            if headers:
+                request_headers.update(headers)
+
+            # 只有发往Canvas站点的请求受限流控制
+            throttle = get_throttle(origin) if to_canvas else None
+            if throttle:
+                throttle.acquire()
+            try:
+                key, conn, response = self._send(method, url, request_headers)
+            except BaseException:
+                if throttle:
+                    throttle.release()
+                raise
+            response_headers = {k.lower(): v for k, v in response.getheaders()}
+            body = None
+            if throttle and response.status in (403, 429):
+                body = response.read()
+                if is_rate_limited(response.status, body) and attempt < MAX_THROTTLE_RETRIES:
+                    self._finish(key, conn, response)
+                    delay = throttle.release(response_headers, limited=True, attempt=attempt)
+                    attempt += 1
+                    logger.info(f"Canvas限流，{delay:.1f}秒后重试 ({attempt}/{MAX_THROTTLE_RETRIES}): {url}")
+                    continue
+            if throttle:
+                throttle.release(response_headers)
+
+            if response.status in (301, 302, 303, 307, 308) and response.getheader("Location"):
+                location = urljoin(url, response.getheader("Location"))
+                response.read()
+                self._finish(key, conn, response)
+                url = location
+                redirects += 1
+                continue
+            return CanvasResponse(self, key, conn, response, url, body)
+        raise CanvasAPIError(310, "重定向次数过多", url)
+
+    def _finish(self, key, conn, response):
+        if response.will_close or not response.isclosed():
+            conn.close()
+        else:
+            self._release(key, conn)
+
+    def get_json(self, url, token=None, max_age=None):
+        """GET请求并解析JSON，返回(数据, 响应头)
+
+        设置了缓存时发送条件请求，内容没有变化(304)时使用缓存的响应；
+        max_age 秒内确认过的缓存直接使用，不发送请求。
+        """
+        cached = self.cache.get(url, token) if self.cache else None
+        if cached and max_age and cached.age() < max_age:
+            self.cache.count("hits")
+            return json.loads(cached.body.decode("utf-8")), cached.headers
+        response = self.open("GET", url, token, headers=cached.conditional_headers() if cached else None)
+        try:
+            body = response.read()
+            if cached and response.status == 304:
+                self.cache.touch(cached)
+                self.cache.count("revalidated")
+                return json.loads(cached.body.decode("utf-8")), cached.headers
+            if response.status >= 400:
+                raise CanvasAPIError(response.status, _error_message(body), url)
+            data = json.loads(body.decode("utf-8"))
+            if self.cache and response.status == 200:
+                self.cache.put(url, token, response.headers, body)
+                self.cache.count("misses")
+            return data, response.headers
+        finally:
+            response.close()
+
+
+class CanvasResponse:
+    """包装http.client响应，读取完毕后把连接归还连接池"""
+
+    def __init__(self, session, key, conn, response, url, body=None):
+        self.session = session
+        self.key = key
+        self.conn = conn
+        self.response = response
+        self.url = url
+        self.status = response.status
+        self.headers = {k.lower(): v for k, v in response.getheaders()}
+        # 检查限流时已经读出的响应体
+        self._body = body
+        self._closed = False
+
+    def read(self, amt=None):
+        if self._body is not None:
+            body, self._body = self._body, b""
+            return body
+        return self.response.read(amt)
+
+    def iter_content(self, chunk_size=CHUNK_SIZE):
+        while True:
+            chunk = self.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self.session._finish(self.key, self.conn, self.response)
+
+
+class CourseResult:
+    """单个课程同步的结构化结果"""
+
+    def __init__(self, course_id):
+        self.course_id = course_id
+        self.course_code = str(course_id)
+        self.success = False
+        self.files_found = 0
+        self.files_downloaded = 0
+        self.files_skipped = 0
+        self.files_deduplicated = 0
+        self.bytes_downloaded = 0
+        # 从开始同步到文件列表完成的秒数
+        self.list_time = 0.0
+        self.errors = []
+        # 所有错误都是暂时性的(服务器错误、超时、连接中断)时，失败的课程可以重新排队
+        self.retryable = True
+        self.elapsed = 0.0
+
+    def add_error(self, message, transient=False):
+        self.errors.append(message)
+        if not transient:
+            self.retryable = False
+
+    def to_dict(self):
+        return {
+            "course_id": self.course_id,
+            "course_code": self.course_code,
+            "success": self.success,
+            "files_found": self.files_found,
+            "files_downloaded": self.files_downloaded,
+            "files_skipped": self.files_skipped,
+            "files_deduplicated": self.files_deduplicated,
+            "bytes_downloaded": self.bytes_downloaded,
+            "list_time": round(self.list_time, 3),
+            "errors": list(self.errors),
+            "retryable": not self.success and self.retryable,
+            "elapsed": round(self.elapsed, 3),
+        }
+
+
+def _error_message(body):
+    """从Canvas错误响应中提取错误信息"""
+    try:
+        data = json.loads(body.decode("utf-8"))
+    except Exception:
+        return body[:200].decode("utf-8", "replace")
+    if isinstance(data, dict):
+        errors = data.get("errors")
+        if isinstance(errors, list) and errors:
+            first = errors[0]
+            if isinstance(first, dict):
+                return first.get("message", str(first))
+            return str(first)
+        if data.get("message"):
+            return data["message"]
+    return str(data)[:200]
+
+
+def normalize_config(config):
+    """把两种配置格式统一为引擎使用的设置，筛选规则无效时抛出ValueError"""
+    if "base_url" in config and "course_id" in config:
+        course_ids = [config["course_id"]]
+        base_url = config["base_url"]
+        download_dir = config.get("download_path", ".")
+    else:
+        course_ids = list(config.get("courseIDs", []))
+        base_url = config.get("canvasURL", "")
+        download_dir = config.get("downloadDir", ".")
+
+    # filesizeThresh 与canvassyncer保持一致，单位为MB
+    threshold = config.get("filesizeThresh")
+    settings = {
+        "base_url": base_url.rstrip("/"),
+        "token": config.get("token", ""),
+        "course_ids": course_ids,
+        "download_dir": download_dir,
+        "filesize_thresh": float(threshold) if threshold else None,
+        "allow_audio": config.get("allowAudio", True),
+        "allow_video": config.get("allowVideo", True),
+        "allow_image": config.get("allowImage", True),
+        "includes": [ext.lower().lstrip(".") for ext in config.get("includes", [])],
+        "excludes": [ext.lower().lstrip(".") for ext in config.get("excludes", [])],
+        # 去重存储目录，true表示使用默认位置
+        "dedup_store": config.get("dedupStore"),
+        # 大文件分段下载的连接数，1表示不分段；segmentThreshold 单位为MB
+        "segments": int(config.get("segments", DEFAULT_SEGMENTS)),
+        "segment_threshold": (float(config["segmentThreshold"]) * 1000000
+                              if config.get("segmentThreshold") is not None else None),
+        # 更细的筛选规则，见canvas_filters
+        "filters": config.get("filters"),
+    }
+    if settings["segments"] < 1:
+        raise ValueError(f"segments 必须大于等于1: {settings['segments']}")
+    if settings["segment_threshold"] is not None and settings["segment_threshold"] <= 0:
+        raise ValueError(f"segmentThreshold 必须大于0: {config['segmentThreshold']}")
+    # 所有筛选设置编译为一个筛选器，同步时不再重复解析
+    settings["file_filter"] = FileFilter.from_settings(settings)
+    return settings
+
+
+def sanitize_name(name):
+    """替换文件名中的非法字符；"." 和 ".." 这样只有点和空格的名称也替换掉，否则路径会指向上级目录"""
+    name = re.sub(r'[\/\\\:\*\?\"\<\>\|]', "_", name)
+    return name if name.strip(" .") else "_"
+
+
+def file_allowed(settings, file_info, folder_path=""):
+    """根据配置判断文件是否需要下载，folder_path 是文件在课程目录中的相对目录"""
+    file_filter = settings.get("file_filter") or FileFilter.from_settings(settings)
+    return file_filter.allows(file_info, folder_path)
+
+
+def parse_timestamp(value):
+    """把Canvas的ISO时间转换为时间戳"""
+    if not value:
+        return 0
+    try:
+        return parse_date(value)
+    except ValueError:
+        return 0
+
+
+class CanvasClient:
+    """绑定到某个Canvas站点和令牌的API客户端"""
+
+    def __init__(self, session, base_url, token, list_concurrency=LIST_CONCURRENCY, max_age=None):
+        self.session = session
+        self.base_url = base_url.rstrip("/")
+        self.api_url = self.base_url + "/api/v1"
+        self.token = token
+        self.list_concurrency = list_concurrency
+        # 在这段时间(秒)内确认过的缓存响应直接使用，见CanvasSession.get_json
+        self.max_age = max_age
+
+    def get(self, path):
+        url = path if path.startswith("http") else self.api_url + path
+        return self.session.get_json(url, self.token, self.max_age)
+
+    def iter_paginated(self, path, stop=None, params=None):
+        """读取列表接口的所有页面，页数已知时并发获取；params 是 [(名称, 值)] 形式的查询参数"""
+        url = self.api_url + path
+        if params:
+            url += "?" + urlencode(params)
+        return iter_items(self.session, url, self.token, self.list_concurrency, stop, self.max_age)
+
+    def get_course(self, course_id):
+        data, _ = self.get(f"/courses/{course_id}")
+        return data
+
+    def list_folders(self, course_id):
+        """返回 {folder_id: 相对路径}"""
+        folders = {}
+        for folder in self.iter_paginated(f"/courses/{course_id}/folders"):
+            full_name = folder.get("full_name", "")
+            if full_name.startswith("course files"):
+                full_name = full_name[len("course files"):]
+            # 忽略空的、"." 和 ".." 这样的路径部分，文件只能保存在课程目录中
+            parts = [sanitize_name(p) for p in full_name.split("/") if p.strip(" .")]
+            folders[folder["id"]] = os.path.join(*parts) if parts else ""
+        return folders
+
+    def list_files(self, course_id, stop=None, file_filter=None):
+        """列出课程文件，file_filter 中能由Canvas处理的条件作为查询参数，减少返回的文件"""
+        params = file_filter.query_params() if file_filter else None
+        return self.iter_paginated(f"/courses/{course_id}/files", stop, params)
+
+
+def local_path_for(settings, course_code, folders, file_info):
+    """计算文件在本地的保存路径，与canvassyncer的目录结构一致"""
+    folder = folders.get(file_info.get("folder_id"), "")
+    name = sanitize_name(file_info.get("display_name") or file_info.get("filename") or str(file_info["id"]))
+    return os.path.join(settings["download_dir"], sanitize_name(course_code), folder, name)
+
+
+def is_up_to_date(manifest, path, file_info):
+    """本地文件存在且不比Canvas上的旧时认为无需下载，文件的大小和修改时间来自清单中的本地索引"""
+    local = manifest.local_file(path)
+    if local is None:
+        return False
+    size, mtime = local
+    if file_info.get("size") is not None and size != file_info["size"]:
+        return False
+    return mtime >= parse_timestamp(file_info.get("modified_at") or file_info.get("updated_at"))
+
+
+def download_file(session, token, file_info, path, deadline=None, monitor=None, store=None, progress=None,
+                  segments=None):
+    """下载单个文件到path，支持断点续传，返回(本次下载的字节数, ETag)
+
+    segments 是SegmentPolicy，超过其阈值的文件用多个连接分段下载。
+    """
+    url = file_info.get("url")
+    if not url:
+        raise CanvasAPIError(0, "文件没有下载地址")
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    partial = PartialDownload(path, file_info).load()
+    if partial.is_complete():
+        finish_download(partial.finish(), path, file_info, store)
+        return 0, partial.etag
+    if segments and segments.should_split(partial.size):
+        written = download_segments(session, token, url, partial, segments, deadline, monitor, progress)
+        if written is not None:
+            finish_download(partial.finish(), path, file_info, store)
+            return written, partial.etag
+        # 服务器不支持Range请求，改为单个连接下载
+        partial = PartialDownload(path, file_info).load()
+    written = 0
+    response = session.open("GET", url, token, headers=partial.range_headers())
+    if response.status == 416 and partial.ranges:
+        # 断点超出了服务器上的文件，丢弃已下载的部分从头下载
+        response.close()
+        partial.discard()
+        response = session.open("GET", url, token)
+    try:
+        if response.status >= 400:
+            raise CanvasAPIError(response.status, _error_message(response.read()), url)
+        partial.etag = response.headers.get("etag")
+        f = partial.begin(response.status, response.headers)
+        try:
+            for chunk in response.iter_content():
+                partial.write(f, chunk)
+                written += len(chunk)
+                if monitor:
+                    monitor.update(len(chunk))
+                if progress:
+                    progress.update(len(chunk))
+                if deadline and deadline.expired():
+                    raise CourseTimeout()
+        except BaseException:
+            # 中断时保留已下载的部分，下次从断点继续
+            partial.checkpoint(f)
+            raise
+        finally:
+            f.close()
+    finally:
+        response.close()
+
+    finish_download(partial.finish(), path, file_info, store)
+    return written, partial.etag
+
+
+def _range_response(response, start, size, url):
+    """检查分段请求的响应是否正好从start开始，返回响应中的ETag"""
+    if response.status >= 400:
+        raise CanvasAPIError(response.status, _error_message(response.read()), url)
+    content_range = parse_content_range(response.headers.get("content-range"))
+    if not content_range or content_range[0] != start or content_range[2] not in (None, size):
+        raise IncompleteDownloadError(f"服务器返回的范围与请求不符: {response.headers.get('content-range')}")
+    return response.headers.get("etag")
+
+
+def download_segments(session, token, url, partial, policy, deadline=None, monitor=None, progress=None):
+    """用多个连接并行下载partial中缺少的范围，返回本次下载的字节数；服务器不支持Range请求时返回None"""
+    pieces = policy.ranges(partial)
+    if not pieces:
+        return 0
+    # 第一段的请求同时用来确认服务器支持Range，并得到重定向后的文件存储地址
+    start, end = pieces[0]
+    first = session.open("GET", url, token, headers={"Range": f"bytes={start}-{end - 1}"})
+    if first.status == 200:
+        first.close()
+        return None
+    if first.status == 416:
+        # 日志与服务器上的文件不符，丢弃后用单个连接从头下载
+        first.close()
+        partial.discard()
+        return None
+    try:
+        etag = _range_response(first, start, partial.size, url)
+    except BaseException:
+        first.close()
+        raise
+    if partial.ranges and partial.etag and etag and etag != partial.etag:
+        # 已下载的部分与现在的文件内容不是同一个版本
+        first.close()
+        partial.discard()
+        raise IncompleteDownloadError("文件在下载过程中发生了变化")
+    partial.etag = etag or partial.etag
+    # 令牌只发送给Canvas站点本身
+    final_url = first.url
+    final_token = token if urlparse(final_url).netloc == urlparse(url).netloc else None
+
+    # 预先分配文件大小，各段写入自己的偏移
+    mode = "r+b" if os.path.exists(partial.part_path) else "wb"
+    with open(partial.part_path, mode) as f:
+        f.truncate(partial.size)
+
+    lock = threading.Lock()
+    failed = threading.Event()
+    written = [0]
+
+    def fetch(start, end, response):
+        if failed.is_set():
+            if response:
+                response.close()
+            return
+        try:
+            if response is None:
+                response = session.open("GET", final_url, final_token, headers={"Range": f"bytes={start}-{end - 1}"})
+                etag = _range_response(response, start, partial.size, final_url)
+                if partial.etag and etag and etag != partial.etag:
+                    raise IncompleteDownloadError("文件在下载过程中发生了变化")
+            position = start
+            # 不使用缓冲，保存续传日志时数据已经交给操作系统
+            with open(partial.part_path, "r+b", buffering=0) as f:
+                f.seek(start)
+                for chunk in response.iter_content():
+                    if failed.is_set():
+                        return
+                    chunk = memoryview(chunk)[:end - position]
+                    offset = position
+                    while chunk:
+                        count = f.write(chunk)
+                        chunk = chunk[count:]
+                        position += count
+                    with lock:
+                        partial.record(f, offset, position - offset)
+                        written[0] += position - offset
+                        if monitor:
+                            monitor.update(position - offset)
+                        if progress:
+                            progress.update(position - offset)
+                    if deadline and deadline.expired():
+                        raise CourseTimeout()
+                    if position >= end:
+                        break
+            if position < end:
+                raise IncompleteDownloadError(f"分段 {start}-{end - 1} 只收到 {position - start} 字节")
+        except BaseException:
+            failed.set()
+            raise
+        finally:
+            if response:
+                response.close()
+
+    with ThreadPoolExecutor(max_workers=max(1, min(policy.segments, len(pieces)))) as executor:
+        futures = [executor.submit(fetch, start, end, first)]
+        futures += [executor.submit(fetch, start, end, None) for start, end in pieces[1:]]
+    errors = [future.exception() for future in futures if future.exception()]
+    if errors:
+        # 保留已下载的范围，下次只获取缺少的部分
+        try:
+            partial.save()
+        except OSError as e:
+            logger.warning(f"保存续传日志失败: {e}")
+        raise errors[0]
+    return written[0]
+
+
+def finish_download(temp_path, path, file_info, store=None):
+    """把下载完成的临时文件移动到最终位置，启用去重存储时链接到存储中的内容"""
+    if store:
+        # 硬链接与存储中的内容共用修改时间，不能改成某一个Canvas文件的时间
+        if place_file(store.add(temp_path, file_info), path):
+            return
+    else:
+        os.replace(temp_path, path)
+    set_modified_time(path, file_info)
+
+
+def set_modified_time(path, file_info):
+    """使用Canvas上的修改时间，下次同步据此判断是否需要更新"""
+    modified = parse_timestamp(file_info.get("modified_at") or file_info.get("updated_at"))
+    if modified:
+        os.utime(path, (modified, modified))
+
+
+def transfer_files(session, settings, pending, manifest, result, emit, deadline=None, stall=None, retry=None):
+    """逐个下载待同步的文件，emit(事件类型, **字段) 报告进度"""
+    stall = stall or StallPolicy()
+    retry = retry or RetryPolicy()
+    store = get_store(settings["dedup_store"])
+    segments = SegmentPolicy.from_settings(settings)
+    for file_info, path in pending:
+        name = file_info.get('display_name')
+        file_id = file_info.get("id")
+        relpath = os.path.relpath(path, settings['download_dir'])
+        emit(FILE_STARTED, file_id=file_id, name=name, path=relpath, size=file_info.get("size"),
+             queued=pending.waited(file_info))
+        stalls = failures = 0
+        while True:
+            if deadline and deadline.expired():
+                raise CourseTimeout()
+            try:
+                written, etag = download_file(session, settings["token"], file_info, path,
+                                              deadline, stall.monitor(), store,
+                                              ByteProgress(emit, file_id, file_info.get("size")), segments)
+            except (StallError, socket.timeout) as e:
+                # 停滞的传输从断点重试，超过次数后记为失败
+                if stalls < stall.retries:
+                    stalls += 1
+                    emit(ERROR, file_id=file_id, name=name, message=f"传输停滞: {e}",
+                         retry=f"{stalls}/{stall.retries}")
+                    continue
+                result.add_error(f"{name}: 传输停滞: {e}", transient=True)
+                emit(ERROR, file_id=file_id, name=name, message="传输停滞")
+            except (CanvasAPIError, IncompleteDownloadError, ConnectionError, http.client.HTTPException) as e:
+                # 暂时性错误(5xx、连接被重置)退避后重试，永久性错误(401、404)直接记为失败
+                if retry.should_retry(e, failures):
+                    delay = retry.delay(failures)
+                    failures += 1
+                    emit(ERROR, file_id=file_id, name=name, message=f"{e}，{delay:.1f}秒后重试",
+                         retry=f"{failures}/{retry.retries}")
+                    time.sleep(delay)
+                    continue
+                result.add_error(f"{name}: {e}", is_transient(e))
+                emit(ERROR, file_id=file_id, name=name, message=str(e))
+            else:
+                manifest.record(file_info, path, etag)
+                result.bytes_downloaded += written
+                result.files_downloaded += 1
+                emit(FILE_DONE, file_id=file_id, name=name, path=relpath, bytes=written, linked=False)
+            break
+
+
+def plan_course(client, settings, course_id, folders, manifest, result, pending, deadline, emit, stop):
+    """列出课程文件并筛选出需要下载的，边列边放入pending队列"""
+    store = get_store(settings["dedup_store"])
+    file_filter = settings.get("file_filter") or FileFilter.from_settings(settings)
+    try:
+        for file_info in client.list_files(course_id, stop, file_filter):
+            result.files_found += 1
+            if not file_filter.allows(file_info, folders.get(file_info.get("folder_id"), "")):
+                result.files_skipped += 1
+                continue
+            path = local_path_for(settings, result.course_code, folders, file_info)
+            if manifest.is_unchanged(file_info, path):
+                result.files_skipped += 1
+                continue
+            # 清单中没有记录但本地已有最新文件(例如之前由canvassyncer下载)，补记到清单
+            if is_up_to_date(manifest, path, file_info):
+                manifest.record(file_info, path)
+                result.files_skipped += 1
+                continue
+            # 其他课程或下载目录已经下载过同一个文件，直接链接
+            blob = store.lookup(file_info) if store else None
+            if blob:
+                if not place_file(blob, path):
+                    set_modified_time(path, file_info)
+                manifest.record(file_info, path)
+                result.files_deduplicated += 1
+                emit(FILE_DONE, file_id=file_info.get("id"), name=file_info.get("display_name"),
+                     path=os.path.relpath(path, settings["download_dir"]), bytes=0, linked=True)
+                continue
+            if deadline:
+                deadline.add_bytes(file_info.get("size") or 0)
+            pending.put(file_info, path)
+
+        emit(LISTED, files_found=result.files_found, pending=pending.count, pending_bytes=pending.expected_bytes)
+    finally:
+        pending.close()
+
+
+def sync_course(session, settings, course_id, events=None, timeout=None, transfer=None, stall=None, retry=None):
+    """同步单个课程，返回CourseResult
+
+    文件列表在后台线程中分页获取，列出一页就开始下载。
+    events 接收进度事件(见canvas_events)，最后一个事件是summary；
+    timeout 是课程的基础期限，随列出的待下载字节数放宽；
+    transfer 可替换文件传输阶段，签名与transfer_files相同，默认逐个下载；
+    retry 是单个文件遇到暂时性错误时的重试策略。
+    """
+    result = CourseResult(course_id)
+    stall = stall or StallPolicy()
+    started = time.monotonic()
+    deadline = stall.course_deadline(started, timeout)
+
+    def emit(kind, **fields):
+        if events:
+            fields.setdefault("course_id", course_id)
+            events(make_event(kind, **fields))
+
+    client = CanvasClient(session, settings["base_url"], settings["token"])
+    manifest = get_manifest(settings["download_dir"])
+    # 常驻进程中两次同步之间删除的文件也要重新下载
+    manifest.refresh()
+    listing_errors = []
+    listing = None
+    stop = threading.Event()
+
+    try:
+        course = client.get_course(course_id)
+        result.course_code = course.get("course_code") or str(course_id)
+        folders = client.list_folders(course_id)
+
+        pending = PendingFiles()
+
+        def run_listing():
+            try:
+                plan_course(client, settings, course_id, folders, manifest, result,
+                            pending, deadline, emit, stop)
+            except Exception as e:
+                listing_errors.append(e)
+            finally:
+                result.list_time = time.monotonic() - started
+
+        listing = threading.Thread(target=run_listing, name=f"list-{course_id}", daemon=True)
+        listing.start()
+
+        (transfer or transfer_files)(session, settings, pending, manifest, result, emit, deadline, stall, retry)
+
+        listing.join()
+        if listing_errors:
+            raise listing_errors[0]
+        result.success = not result.errors
+    except CourseTimeout:
+        result.add_error(f"超时 (>{int(deadline.seconds())}秒)", transient=True)
+        emit(ERROR, message=result.errors[-1])
+    except CanvasAPIError as e:
+        result.add_error(str(e), is_transient(e))
+        emit(ERROR, message=result.errors[-1])
+    except (OSError, http.client.HTTPException, ValueError) as e:
+        result.add_error(f"{e.__class__.__name__}: {e}", is_transient(e))
+        emit(ERROR, message=result.errors[-1])
+    except sqlite3.Error as e:
+        # 例如其他进程长时间占用同一下载目录的同步清单，稍后重试
+        result.add_error(f"同步清单出错: {e}", transient=isinstance(e, sqlite3.OperationalError))
+        emit(ERROR, message=result.errors[-1])
+    finally:
+        stop.set()
+        if listing is not None:
+            listing.join()
+        result.elapsed = time.monotonic() - started
+        try:
+            manifest.save()
+        except (OSError, sqlite3.Error) as e:
+            logger.warning(f"保存同步清单失败: {e}")
+        store = get_store(settings["dedup_store"])
+        if store:
+            try:
+                store.save()
+            except OSError as e:
+                logger.warning(f"保存去重存储索引失败: {e}")
+
+    emit(SUMMARY, **result.to_dict())
+    return result
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+同步进度事件
+同步引擎不再输出给人看的文本，而是产生带类型的事件(dict)，每个事件可编码为一行JSON：
+
+    {"event": "file_done", "course_id": 123, "time": 1700000000.0, "file_id": 1, ...}
+
+事件类型:
+    listed        课程文件列表完成 (files_found, pending, pending_bytes)
+    file_started  开始下载文件 (file_id, name, path, size, queued: 列出后等待传输的秒数)
+    bytes         下载进度，按时间间隔合并 (file_id, bytes, total)
+    file_done     文件已保存 (file_id, name, path, bytes, linked)
+    error         错误 (message, 可选 file_id/name/retry)
+    summary       课程同步结果，字段同 CourseResult.to_dict()
+
+命令行的 --events 把事件逐行写到标准输出，图形界面和命令行日志都通过 format_event 显示事件。
+"""
+
+import json
+import time
+import threading
+
+LISTED = "listed"
+FILE_STARTED = "file_started"
+BYTES = "bytes"
+FILE_DONE = "file_done"
+ERROR = "error"
+SUMMARY = "summary"
+
+# 同一文件的bytes事件最短间隔(秒)
+BYTES_INTERVAL = 0.5
+
+
+def make_event(kind, **fields):
+    event = {"event": kind, "time": round(time.time(), 3)}
+    event.update(fields)
+    return event
+
+
+def encode(event):
+    """编码为一行JSON(不含换行符)"""
+    return json.dumps(event, ensure_ascii=False, separators=(",", ":"))
+
+
+def decode(line):
+    """解析一行JSON事件，不是事件时返回None"""
+    line = line.strip()
+    if not line.startswith("{"):
+        return None
+    try:
+        event = json.loads(line)
+    except ValueError:
+        return None
+    if not isinstance(event, dict) or "event" not in event:
+        return None
+    return event
+
+
+def format_event(event):
+    """把事件转换为日志文本，不需要显示的事件(bytes)返回None"""
+    kind = event.get("event")
+    if kind == LISTED:
+        if event.get("pending"):
+            return f"找到 {event.get('files_found', 0)} 个文件，需要下载 {event['pending']} 个"
+        return f"找到 {event.get('files_found', 0)} 个文件，本地文件均已是最新"
+    if kind == FILE_STARTED:
+        return f"开始下载: {event.get('path') or event.get('name')}"
+    if kind == FILE_DONE:
+        if event.get("linked"):
+            return f"已从去重存储链接: {event.get('path')}"
+        return f"已下载: {event.get('path')}"
+    if kind == ERROR:
+        name = event.get("name")
+        message = f"{name}: {event.get('message')}" if name else event.get("message")
+        if event.get("retry"):
+            return f"重试 ({event['retry']}): {message}"
+        return f"错误: {message}"
+    if kind == SUMMARY:
+        if event.get("success"):
+            return (f"课程 {event.get('course_code')} 同步完成: 找到 {event.get('files_found', 0)} 个文件，"
+                    f"下载 {event.get('files_downloaded', 0)} 个，"
+                    f"从去重存储链接 {event.get('files_deduplicated', 0)} 个，跳过 {event.get('files_skipped', 0)} 个")
+        errors = event.get("errors") or []
+        return f"课程 {event.get('course_code')} 同步失败: {errors[0] if errors else '未知错误'}"
+    return None
+
+
+class EventWriter:
+    """把事件逐行写入文本流，可在多个线程中共用"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+        line = encode(event) + "\n"
+        with self._lock:
+            self.stream.write(line)
+            self.stream.flush()
+
+
+class ByteProgress:
+    """把每个数据块的进度合并为间隔发送的bytes事件"""
+
+    def __init__(self, emit, file_id, total, interval=BYTES_INTERVAL):
+        self.emit = emit
+        self.file_id = file_id
+        self.total = total
+        self.interval = interval
+        self.done = 0
+        self._sent_at = time.monotonic()
+
+    def update(self, nbytes):
+        self.done += nbytes
+        now = time.monotonic()
+        if now - self._sent_at >= self.interval:
+            self._sent_at = now
+            self.emit(BYTES, file_id=self.file_id, bytes=self.done, total=self.total)
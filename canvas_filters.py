@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+文件筛选规则
+配置中的 includes/excludes、filesizeThresh、allowAudio/allowVideo/allowImage 和新的 filters 字段
+在同步开始前编译为一组匹配器，列出文件时逐条判断，不需要的文件不会进入下载队列。
+
+filters 的格式：
+
+    "filters": {
+        "include": [{"path": "Lectures/**"}, {"ext": ["pdf", "pptx"]}],
+        "exclude": [{"ext": ["mp4", "mov"], "min_size": "200MB"}, {"content_type": "video"}],
+        "modified_after": "2024-09-01"
+    }
+
+每条规则中的条件同时满足才算匹配：ext(扩展名)、path(相对于课程目录的glob，** 匹配多级目录)、
+regex(相对路径的正则表达式)、min_size/max_size(字节数或 "200MB" 这样的字符串)、
+modified_after/modified_before(日期)、content_type("video" 或 "video/mp4")。
+设置了include时文件至少要匹配其中一条；匹配任意一条exclude的文件被跳过。
+只按content_type筛选的规则还会作为 content_types[]/exclude_content_types[] 参数交给Canvas，减少列表的页数。
+"""
+
+import re
+import os
+import mimetypes
+from datetime import datetime, timedelta, timezone
+
+SIZE_UNITS = {
+    "": 1, "b": 1,
+    "k": 1000, "kb": 1000, "kib": 1024,
+    "m": 1000 ** 2, "mb": 1000 ** 2, "mib": 1024 ** 2,
+    "g": 1000 ** 3, "gb": 1000 ** 3, "gib": 1024 ** 3,
+}
+RULE_KEYS = {"ext", "path", "regex", "min_size", "max_size", "modified_after", "modified_before", "content_type"}
+# ISO 8601日期或时间，秒的小数部分和时区都是可选的(Canvas的时间戳可能带有 .123Z 或 +08:00)
+_ISO_DATE = re.compile(r"^(\d{4})-(\d{2})-(\d{2})"
+                       r"(?:[T ](\d{2}):(\d{2})(?::(\d{2})(?:\.(\d+))?)?)?"
+                       r"\s*(Z|[+-]\d{2}:?\d{2})?$", re.IGNORECASE)
+
+
+def _as_list(value):
+    if value is None:
+        return []
+    return list(value) if isinstance(value, (list, tuple)) else [value]
+
+
+def parse_size(value):
+    """把字节数或 "200MB"、"1.5 GiB" 这样的字符串转换为字节数"""
+    if isinstance(value, (int, float)):
+        return int(value)
+    match = re.match(r"^\s*([\d.]+)\s*([a-zA-Z]*)\s*$", str(value))
+    if not match or match.group(2).lower() not in SIZE_UNITS:
+        raise ValueError(f"无法识别的文件大小: {value}")
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2).lower()])
+
+
+def parse_date(value):
+    """把 "2024-09-01"、"2024-09-01T08:00:00Z" 或 "2024-09-01T08:00:00.5+08:00" 转换为时间戳，没有时区时按UTC"""
+    match = _ISO_DATE.match(str(value).strip())
+    if not match:
+        raise ValueError(f"无法识别的日期: {value}")
+    year, month, day, hour, minute, second, fraction, offset = match.groups()
+    tz = timezone.utc
+    if offset and offset.upper() != "Z":
+        sign = -1 if offset[0] == "-" else 1
+        digits = offset[1:].replace(":", "")
+        tz = timezone(sign * timedelta(hours=int(digits[:2]), minutes=int(digits[2:])))
+    try:
+        dt = datetime(int(year), int(month), int(day), int(hour or 0), int(minute or 0), int(second or 0),
+                      int((fraction or "0")[:6].ljust(6, "0")), tzinfo=tz)
+    except ValueError:
+        raise ValueError(f"无法识别的日期: {value}")
+    return dt.timestamp()
+
+
+def glob_to_regex(pattern):
+    """把glob转换为正则：* 和 ? 不跨目录，** 匹配任意多级目录"""
+    pattern = pattern.replace("\\", "/").lstrip("/")
+    parts = []
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith("**/", i):
+            parts.append("(?:.*/)?")
+            i += 3
+        elif pattern.startswith("**", i):
+            parts.append(".*")
+            i += 2
+        elif pattern[i] == "*":
+            parts.append("[^/]*")
+            i += 1
+        elif pattern[i] == "?":
+            parts.append("[^/]")
+            i += 1
+        else:
+            parts.append(re.escape(pattern[i]))
+            i += 1
+    # 以 / 结尾或不含通配符的目录名匹配其中的所有文件
+    regex = "".join(parts)
+    if pattern.endswith("/"):
+        regex += ".*"
+    elif not any(char in pattern for char in "*?"):
+        regex += "(?:/.*)?"
+    return regex
+
+
+class FileFacts:
+    """判断规则时需要的文件属性，每个文件只计算一次"""
+
+    __slots__ = ("ext", "size", "modified", "content_type", "path")
+
+    def __init__(self, file_info, folder_path=""):
+        name = file_info.get("display_name") or file_info.get("filename") or ""
+        self.ext = os.path.splitext(name)[1].lower().lstrip(".")
+        self.size = file_info.get("size") or 0
+        self.modified = _canvas_time(file_info.get("modified_at") or file_info.get("updated_at"))
+        self.content_type = (file_info.get("content-type") or mimetypes.guess_type(name)[0] or "").lower()
+        folder = folder_path.replace(os.sep, "/").strip("/")
+        self.path = f"{folder}/{name}" if folder else name
+
+
+def _canvas_time(value):
+    if not value:
+        return 0
+    try:
+        return parse_date(value)
+    except ValueError:
+        return 0
+
+
+class FilterRule:
+    """一条规则，条件按开销从小到大排列，遇到不满足的条件立即返回"""
+
+    def __init__(self, spec):
+        if not isinstance(spec, dict):
+            raise ValueError(f"筛选规则必须是对象: {spec}")
+        unknown = set(spec) - RULE_KEYS
+        if unknown:
+            raise ValueError(f"未知的筛选条件: {', '.join(sorted(unknown))}")
+        self.spec = spec
+        checks = []
+
+        extensions = frozenset(ext.lower().lstrip(".") for ext in _as_list(spec.get("ext")))
+        if extensions:
+            checks.append(lambda facts: facts.ext in extensions)
+        if spec.get("min_size") is not None:
+            min_size = parse_size(spec["min_size"])
+            checks.append(lambda facts: facts.size >= min_size)
+        if spec.get("max_size") is not None:
+            max_size = parse_size(spec["max_size"])
+            checks.append(lambda facts: facts.size <= max_size)
+        if spec.get("modified_after"):
+            after = parse_date(spec["modified_after"])
+            checks.append(lambda facts: facts.modified >= after)
+        if spec.get("modified_before"):
+            before = parse_date(spec["modified_before"])
+            checks.append(lambda facts: facts.modified < before)
+
+        self.content_types = tuple(_content_type_prefix(value) for value in _as_list(spec.get("content_type")))
+        if self.content_types:
+            content_types = self.content_types
+            checks.append(lambda facts: facts.content_type.startswith(content_types))
+
+        # 所有glob和正则合并为一个预编译的表达式
+        patterns = [glob_to_regex(pattern) for pattern in _as_list(spec.get("path"))]
+        patterns += _as_list(spec.get("regex"))
+        self.uses_path = bool(patterns)
+        if patterns:
+            try:
+                path_regex = re.compile("|".join(f"(?:{pattern})" for pattern in patterns), re.IGNORECASE)
+            except re.error as e:
+                raise ValueError(f"无效的路径规则 {patterns}: {e}")
+            checks.append(lambda facts: path_regex.fullmatch(facts.path) is not None)
+        self._checks = tuple(checks)
+
+    def matches(self, facts):
+        for check in self._checks:
+            if not check(facts):
+                return False
+        return True
+
+    def only_content_type(self):
+        """规则只按content_type筛选时可以交给Canvas"""
+        return bool(self.content_types) and set(self.spec) == {"content_type"}
+
+
+def _content_type_prefix(value):
+    value = str(value).lower().strip()
+    # "video" 匹配所有 video/* 类型
+    return value if "/" in value else value + "/"
+
+
+class FileFilter:
+    """编译后的筛选器，includes 中的每一组至少匹配一条，excludes 中的规则都不能匹配"""
+
+    def __init__(self, include_groups=(), excludes=()):
+        self.include_groups = [list(group) for group in include_groups if group]
+        self.excludes = list(excludes)
+        rules = [rule for group in self.include_groups for rule in group] + self.excludes
+        self.uses_path = any(rule.uses_path for rule in rules)
+
+    @classmethod
+    def from_settings(cls, settings):
+        """由normalize_config得到的设置编译筛选器，规则无效时抛出ValueError"""
+        include_groups = []
+        excludes = []
+        # 原有的扩展名、大小和类型设置
+        if settings.get("includes"):
+            include_groups.append([FilterRule({"ext": settings["includes"]})])
+        if settings.get("excludes"):
+            excludes.append(FilterRule({"ext": settings["excludes"]}))
+        if settings.get("filesize_thresh"):
+            excludes.append(FilterRule({"min_size": int(settings["filesize_thresh"] * 1000000) + 1}))
+        for kind in ("audio", "video", "image"):
+            if not settings.get(f"allow_{kind}", True):
+                excludes.append(FilterRule({"content_type": kind}))
+
+        filters = settings.get("filters") or {}
+        if not isinstance(filters, dict):
+            raise ValueError("filters 必须是对象")
+        include_groups.append([FilterRule(spec) for spec in _as_list(filters.get("include"))])
+        excludes.extend(FilterRule(spec) for spec in _as_list(filters.get("exclude")))
+        # 顶层的 modified_after 等条件作为一组只有一条规则的include
+        top_level = {key: value for key, value in filters.items() if key in RULE_KEYS}
+        if top_level:
+            include_groups.append([FilterRule(top_level)])
+        return cls(include_groups, excludes)
+
+    def allows(self, file_info, folder_path=""):
+        facts = FileFacts(file_info, folder_path)
+        for rule in self.excludes:
+            if rule.matches(facts):
+                return False
+        for group in self.include_groups:
+            for rule in group:
+                if rule.matches(facts):
+                    break
+            else:
+                return False
+        return True
+
+    def query_params(self):
+        """可以交给Canvas列表接口的参数，返回 [(名称, 值)]"""
+        params = []
+        for group in self.include_groups:
+            if all(rule.only_content_type() for rule in group):
+                types = sorted({content_type for rule in group for content_type in rule.content_types})
+                params.extend(("content_types[]", content_type.rstrip("/")) for content_type in types)
+                # Canvas只能表达一组content_types，其余的组只在本地判断
+                break
+        for rule in self.excludes:
+            if rule.only_content_type():
+                params.extend(("exclude_content_types[]", content_type.rstrip("/"))
+                              for content_type in rule.content_types)
+        return params
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+持久化的下载任务队列
+课程任务和文件任务保存在SQLite数据库中，带有优先级、状态和尝试次数。
+程序崩溃或窗口关闭后，未完成的课程任务在下次启动时恢复为等待状态，
+已下载的文件由同步清单跳过，下载到一半的文件从 .part 断点继续。
+"""
+
+import os
+import json
+import time
+import sqlite3
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+DEFAULT_DB_PATH = os.path.join(os.path.expanduser("~"), ".cache", "canvas-downloader", "jobs.db")
+
+# 优先级范围，数值大的任务先下载
+MIN_PRIORITY = 0
+MAX_PRIORITY = 9
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+STATE_NAMES = {
+    PENDING: "等待中",
+    RUNNING: "下载中",
+    DONE: "已完成",
+    FAILED: "失败",
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS course_jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_key TEXT NOT NULL,
+    course_id INTEGER NOT NULL,
+    config TEXT NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 0,
+    state TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS course_jobs_claim ON course_jobs (state, priority DESC, id);
+CREATE TABLE IF NOT EXISTS file_jobs (
+    course_job_id INTEGER NOT NULL,
+    file_id INTEGER NOT NULL,
+    name TEXT,
+    path TEXT,
+    state TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    updated REAL NOT NULL,
+    PRIMARY KEY (course_job_id, file_id)
+);
+"""
+
+
+class JobInterrupted(Exception):
+    """任务被用户停止(例如关闭窗口)，应放回队列而不是记为失败"""
+
+
+class CourseJob:
+    """course_jobs表中的一行"""
+
+    def __init__(self, row):
+        self.id, self.job_key, self.course_id, config, self.priority, self.state, \
+            self.attempts, self.error = row
+        self.config = json.loads(config)
+
+
+def clamp_priority(priority):
+    return max(MIN_PRIORITY, min(MAX_PRIORITY, int(priority)))
+
+
+def _try_lock(f):
+    """对文件加非阻塞的排他锁，进程退出(包括崩溃)时自动释放"""
+    try:
+        if fcntl:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        return False
+    return True
+
+
+def job_key(config, course_id):
+    """同一Canvas站点、同一课程、同一下载目录视为同一个任务"""
+    base_url = config.get("canvasURL") or config.get("base_url") or ""
+    download_dir = config.get("downloadDir") or config.get("download_path") or ""
+    return f"{base_url.rstrip('/')}|{course_id}|{os.path.abspath(os.path.expanduser(download_dir))}"
+
+
+class JobQueue:
+    """SQLite中的任务队列，可在多个线程中共用"""
+
+    _COLUMNS = "id, job_key, course_id, config, priority, state, attempts, error"
+
+    def __init__(self, path=DEFAULT_DB_PATH):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        # 持有时表示本进程是唯一使用这个队列的程序实例
+        self._instance_lock = None
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        # 数据库中保存了包含令牌的配置
+        try:
+            os.chmod(path, 0o600)
+        except OSError:
+            pass
+        with self._db:
+            self._db.executescript(_SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+            if self._instance_lock:
+                self._instance_lock.close()
+                self._instance_lock = None
+
+    def _claim_instance(self):
+        """尝试成为唯一使用队列的实例，其他实例仍在运行时返回False"""
+        if self._instance_lock:
+            return True
+        f = open(self.path + ".lock", "a+")
+        if not _try_lock(f):
+            f.close()
+            return False
+        self._instance_lock = f
+        return True
+
+    def _execute(self, sql, params=()):
+        with self._lock, self._db:
+            return self._db.execute(sql, params).fetchall()
+
+    def add_course(self, config, course_id, priority=0):
+        """加入课程任务；同一课程已在队列中时只更新配置和优先级，返回任务id"""
+        key = job_key(config, course_id)
+        priority = clamp_priority(priority)
+        now = time.time()
+        with self._lock, self._db:
+            row = self._db.execute(
+                "SELECT id FROM course_jobs WHERE job_key = ? AND state IN (?, ?)",
+                (key, PENDING, RUNNING)).fetchone()
+            if row:
+                self._db.execute("UPDATE course_jobs SET config = ?, priority = ?, updated = ? WHERE id = ?",
+                                 (json.dumps(config, ensure_ascii=False), priority, now, row[0]))
+                return row[0]
+            cursor = self._db.execute(
+                "INSERT INTO course_jobs (job_key, course_id, config, priority, state, created, updated) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, course_id, json.dumps(config, ensure_ascii=False), priority, PENDING, now, now))
+            return cursor.lastrowid
+
+    def claim(self):
+        """取出优先级最高的等待任务并标记为下载中，没有任务时返回None"""
+        with self._lock, self._db:
+            row = self._db.execute(
+                f"SELECT {self._COLUMNS} FROM course_jobs WHERE state = ? ORDER BY priority DESC, id LIMIT 1",
+                (PENDING,)).fetchone()
+            if row is None:
+                return None
+            self._db.execute("UPDATE course_jobs SET state = ?, attempts = attempts + 1, updated = ? WHERE id = ?",
+                             (RUNNING, time.time(), row[0]))
+        job = CourseJob(row)
+        job.state = RUNNING
+        job.attempts += 1
+        return job
+
+    def finish(self, job_id, success, error=None):
+        self._execute("UPDATE course_jobs SET state = ?, error = ?, updated = ? WHERE id = ?",
+                      (DONE if success else FAILED, error, time.time(), job_id))
+
+    def release(self, job_id):
+        """被中断的任务放回队列，下次继续"""
+        self._execute("UPDATE course_jobs SET state = ?, updated = ? WHERE id = ?",
+                      (PENDING, time.time(), job_id))
+
+    def requeue_interrupted(self):
+        """启动时调用：上次异常退出时仍在下载中的任务恢复为等待，返回恢复的数量
+
+        另一个程序实例正在运行时它的任务可能仍在下载，不做恢复。
+        """
+        if not self._claim_instance():
+            return 0
+        with self._lock, self._db:
+            return self._db.execute("UPDATE course_jobs SET state = ?, updated = ? WHERE state = ?",
+                                    (PENDING, time.time(), RUNNING)).rowcount
+
+    def set_priority(self, job_id, priority):
+        self._execute("UPDATE course_jobs SET priority = ?, updated = ? WHERE id = ?",
+                      (clamp_priority(priority), time.time(), job_id))
+
+    def remove(self, job_id):
+        """移除等待中的任务"""
+        with self._lock, self._db:
+            if self._db.execute("DELETE FROM course_jobs WHERE id = ? AND state = ?",
+                                (job_id, PENDING)).rowcount:
+                self._db.execute("DELETE FROM file_jobs WHERE course_job_id = ?", (job_id,))
+
+    def clear_pending(self):
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM file_jobs WHERE course_job_id IN "
+                             "(SELECT id FROM course_jobs WHERE state = ?)", (PENDING,))
+            self._db.execute("DELETE FROM course_jobs WHERE state = ?", (PENDING,))
+
+    def unfinished(self):
+        """等待中和下载中的任务，按处理顺序排列"""
+        rows = self._execute(
+            f"SELECT {self._COLUMNS} FROM course_jobs WHERE state IN (?, ?) "
+            "ORDER BY state = ? DESC, priority DESC, id", (PENDING, RUNNING, RUNNING))
+        return [CourseJob(row) for row in rows]
+
+    def record_file(self, course_job_id, file_id, state, name=None, path=None, error=None):
+        """记录文件任务的状态，开始下载时增加尝试次数"""
+        now = time.time()
+        with self._lock, self._db:
+            # 不使用UPSERT语法，兼容较旧的SQLite
+            self._db.execute("INSERT OR IGNORE INTO file_jobs (course_job_id, file_id, state, updated) "
+                             "VALUES (?, ?, ?, ?)", (course_job_id, file_id, state, now))
+            self._db.execute(
+                "UPDATE file_jobs SET state = ?, name = COALESCE(?, name), path = COALESCE(?, path), "
+                "attempts = attempts + ?, error = ?, updated = ? WHERE course_job_id = ? AND file_id = ?",
+                (state, name, path, 1 if state == RUNNING else 0, error, now, course_job_id, file_id))
+
+    def file_counts(self, course_job_id):
+        """返回 {状态: 文件数}"""
+        rows = self._execute("SELECT state, COUNT(*) FROM file_jobs WHERE course_job_id = ? GROUP BY state",
+                             (course_job_id,))
+        return dict(rows)
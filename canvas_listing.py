@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Canvas分页列表
+每页请求100条，根据第一页Link头中的 rel="last" 并发获取其余页面；
+没有last链接时(例如书签式分页)退回到逐页跟随 rel="next"。
+列出的文件以流的形式交给传输阶段，不必等整个列表完成才开始下载。
+"""
+
+import re
+import time
+import queue
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse, urlunparse, parse_qsl, urlencode
+
+logger = logging.getLogger("canvas-downloader-listing")
+
+PER_PAGE = 100
+LIST_CONCURRENCY = 4
+
+_DONE = object()
+
+
+def parse_link_header(value):
+    """解析Link响应头，返回 {rel: url}"""
+    links = {}
+    if not value:
+        return links
+    for part in value.split(","):
+        match = re.match(r'\s*<([^>]*)>\s*;\s*rel="?([^";]+)"?', part)
+        if match:
+            links[match.group(2)] = match.group(1)
+    return links
+
+
+def with_query(url, **params):
+    """返回替换了查询参数的URL，保留其他参数(包括 content_types[] 这样重复的参数)"""
+    parsed = urlparse(url)
+    query = [(key, value) for key, value in parse_qsl(parsed.query, keep_blank_values=True) if key not in params]
+    query.extend((key, str(value)) for key, value in params.items())
+    return urlunparse(parsed._replace(query=urlencode(query)))
+
+
+def remaining_page_urls(links):
+    """根据rel="last"构造第2页到最后一页的URL，页码不是数字时返回None"""
+    last = links.get("last")
+    if not last:
+        return None
+    page = dict(parse_qsl(urlparse(last).query)).get("page", "")
+    if not page.isdigit():
+        return None
+    return [with_query(last, page=number) for number in range(2, int(page) + 1)]
+
+
+def iter_pages(session, url, token, concurrency=LIST_CONCURRENCY, stop=None, max_age=None):
+    """按完成顺序逐页产出列表数据(每页是一个list)，max_age 传给session.get_json"""
+    url = with_query(url, per_page=PER_PAGE)
+    data, headers = session.get_json(url, token, max_age)
+    yield data if isinstance(data, list) else []
+
+    links = parse_link_header(headers.get("link"))
+    urls = remaining_page_urls(links)
+    if urls is None:
+        # 无法预知总页数，只能逐页跟随next
+        next_url = links.get("next")
+        while next_url and not (stop and stop.is_set()):
+            data, headers = session.get_json(next_url, token, max_age)
+            yield data if isinstance(data, list) else []
+            next_url = parse_link_header(headers.get("link")).get("next")
+        return
+
+    if not urls:
+        return
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(urls)))) as executor:
+        futures = [executor.submit(session.get_json, page_url, token, max_age) for page_url in urls]
+        try:
+            for future in as_completed(futures):
+                if stop and stop.is_set():
+                    break
+                data, _ = future.result()
+                yield data if isinstance(data, list) else []
+        finally:
+            for future in futures:
+                future.cancel()
+
+
+def iter_items(session, url, token, concurrency=LIST_CONCURRENCY, stop=None, max_age=None):
+    """逐条产出所有页面中的条目"""
+    for page in iter_pages(session, url, token, concurrency, stop, max_age):
+        for item in page:
+            yield item
+
+
+class PendingFiles:
+    """列表线程与传输阶段之间的线程安全队列，可供多个消费者同时读取"""
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self.count = 0
+        self.expected_bytes = 0
+        self._queued_at = {}
+
+    def put(self, file_info, path):
+        self.count += 1
+        self.expected_bytes += file_info.get("size") or 0
+        self._queued_at[id(file_info)] = time.monotonic()
+        self._queue.put((file_info, path))
+
+    def waited(self, file_info):
+        """条目从放入队列到开始传输等待的秒数"""
+        queued = self._queued_at.pop(id(file_info), None)
+        return round(time.monotonic() - queued, 3) if queued is not None else 0.0
+
+    def close(self):
+        """列表结束，消费者取完剩余条目后停止"""
+        self._queue.put(_DONE)
+
+    def get(self):
+        """取出下一个条目，列表已结束时返回None"""
+        item = self._queue.get()
+        if item is _DONE:
+            # 放回结束标记，让其他消费者也能停止
+            self._queue.put(_DONE)
+            return None
+        return item
+
+    def __iter__(self):
+        while True:
+            item = self.get()
+            if item is None:
+                return
+            yield item
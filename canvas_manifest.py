@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+本地同步清单
+记录每个Canvas文件的id、updated_at、大小、ETag和本地路径，
+下次同步时只需比较元数据即可跳过未变化的文件。
+
+清单保存在下载目录的SQLite数据库中，同时索引本地文件的大小和修改时间，以及每个目录的修改时间。
+判断本地文件是否存在时只对所在目录做一次stat：目录的修改时间没有变化就直接使用索引，
+变化了(有文件被添加、删除或改名)才重新列出这个目录。这样同步前的准备时间不会随下载目录的大小增长。
+数据库使用WAL日志，每次写入立即提交，多个进程(命令行、图形界面、后台服务)可以同时使用同一个下载目录。
+"""
+
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+
+logger = logging.getLogger("canvas-downloader-manifest")
+
+INDEX_NAME = ".canvas_index.db"
+# 旧版本使用的JSON清单，首次创建数据库时导入
+MANIFEST_NAME = ".canvas_manifest.json"
+MANIFEST_VERSION = 1
+
+# 一次同步中同一目录在这段时间(秒)内只检查一次修改时间，每次同步开始时重新检查(见refresh)
+DIR_CHECK_SECONDS = 60
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id TEXT PRIMARY KEY,
+    updated_at TEXT,
+    size INTEGER,
+    etag TEXT,
+    path TEXT
+);
+CREATE TABLE IF NOT EXISTS local_files (
+    path TEXT PRIMARY KEY,
+    dir TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS local_files_dir ON local_files (dir);
+CREATE TABLE IF NOT EXISTS dirs (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL
+);
+"""
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+class Manifest:
+    """一个下载目录的同步清单和本地文件索引，线程安全"""
+
+    def __init__(self, root, readonly=False):
+        self.root = root
+        self.path = os.path.join(root, INDEX_NAME)
+        # 只读时不创建也不修改数据库，重新列出的目录保存在内存中
+        self.readonly = readonly
+        self._db = None
+        self._lock = threading.Lock()
+        # {相对目录: 检查时间}
+        self._checked = {}
+        # 只读时: {相对目录: {相对路径: (大小, 修改时间)}}
+        self._scanned = {}
+
+    def load(self):
+        """打开数据库，第一次使用时导入旧的JSON清单"""
+        if self.readonly:
+            if os.path.exists(self.path):
+                self._db = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, timeout=30,
+                                           check_same_thread=False)
+            return self
+        os.makedirs(self.root, exist_ok=True)
+        created = not os.path.exists(self.path)
+        try:
+            self._open()
+        except sqlite3.DatabaseError as e:
+            logger.warning(f"无法读取同步清单 {self.path}，将重新建立: {e}")
+            if self._db:
+                self._db.close()
+            os.remove(self.path)
+            created = True
+            self._open()
+        if created:
+            self._import_json(os.path.join(self.root, MANIFEST_NAME))
+        return self
+
+    def _open(self):
+        self._db = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        # WAL模式下读取不会阻塞其他进程的写入；每次提交不必等待fsync
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        with self._db:
+            self._db.executescript(_SCHEMA)
+
+    def _import_json(self, path):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except (ValueError, OSError) as e:
+            logger.warning(f"无法读取旧的同步清单 {path}: {e}")
+            return
+        if data.get("version") != MANIFEST_VERSION:
+            return
+        rows = [(str(file_id), entry.get("updated_at"), entry.get("size"), entry.get("etag"), entry.get("path"))
+                for file_id, entry in data.get("files", {}).items()]
+        with self._lock, self._db:
+            self._db.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)", rows)
+        logger.info(f"已从 {path} 导入 {len(rows)} 条同步记录")
+
+    def save(self):
+        """每次写入都已提交，保留这个方法以兼容原来的JSON清单"""
+        with self._lock:
+            if self._db:
+                self._db.commit()
+
+    def close(self):
+        with self._lock:
+            if self._db:
+                self._db.commit()
+                self._db.close()
+                self._db = None
+
+    def refresh(self):
+        """开始新一次同步：之后重新检查各目录的修改时间，发现上次同步后被删除或修改的文件"""
+        with self._lock:
+            self._checked.clear()
+
+    def get(self, file_id):
+        if self._db is None:
+            return None
+        with self._lock:
+            row = self._db.execute("SELECT id, updated_at, size, etag, path FROM files WHERE id = ?",
+                                   (str(file_id),)).fetchone()
+        if row is None:
+            return None
+        return {"id": row[0], "updated_at": row[1], "size": row[2], "etag": row[3], "path": row[4]}
+
+    def is_unchanged(self, file_info, local_path):
+        """Canvas元数据与清单一致且本地文件仍在时返回True"""
+        entry = self.get(file_info["id"])
+        if not entry:
+            return False
+        if entry.get("updated_at") != file_info.get("updated_at"):
+            return False
+        if entry.get("size") != file_info.get("size"):
+            return False
+        if entry.get("path") != local_path:
+            return False
+        return self.local_file(local_path) is not None
+
+    def record(self, file_info, local_path, etag=None):
+        """记录一个已同步的文件，同时更新本地文件索引"""
+        row = (str(file_info["id"]), file_info.get("updated_at"), file_info.get("size"), etag, local_path)
+        relpath = self._relative(local_path)
+        try:
+            stat = os.stat(local_path)
+        except OSError:
+            stat = None
+        with self._lock, self._db:
+            old = self._db.execute("SELECT id, updated_at, size, etag, path FROM files WHERE id = ?",
+                                   (row[0],)).fetchone()
+            if old != row:
+                self._db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)", row)
+            if relpath is not None and stat is not None:
+                self._db.execute("INSERT OR REPLACE INTO local_files VALUES (?, ?, ?, ?)",
+                                 (relpath, os.path.dirname(relpath), stat.st_size, stat.st_mtime))
+
+    def local_file(self, path):
+        """返回本地文件的 (大小, 修改时间)，文件不存在时返回None"""
+        relpath = self._relative(path)
+        if relpath is None:
+            # 不在下载目录中的文件不做索引
+            try:
+                stat = os.stat(path)
+            except OSError:
+                return None
+            return (stat.st_size, stat.st_mtime)
+        directory = os.path.dirname(relpath)
+        with self._lock:
+            self._check_dir(directory)
+            if directory in self._scanned:
+                return self._scanned[directory].get(relpath)
+            if self._db is None:
+                return None
+            row = self._db.execute("SELECT size, mtime FROM local_files WHERE path = ?", (relpath,)).fetchone()
+        return tuple(row) if row else None
+
+    def _relative(self, path):
+        relpath = os.path.relpath(os.path.abspath(path), self.root)
+        if relpath == os.curdir or relpath.startswith(os.pardir + os.sep) or relpath == os.pardir:
+            return None
+        return relpath
+
+    def _check_dir(self, directory):
+        """在持有锁时调用：目录的修改时间与索引不同时重新列出目录"""
+        now = time.monotonic()
+        checked = self._checked.get(directory)
+        if checked is not None and now - checked < DIR_CHECK_SECONDS:
+            return
+        self._checked[directory] = now
+        full_path = os.path.join(self.root, directory)
+        try:
+            mtime_ns = os.stat(full_path).st_mtime_ns
+        except OSError:
+            mtime_ns = None
+        row = None
+        if self._db is not None:
+            row = self._db.execute("SELECT mtime_ns FROM dirs WHERE path = ?", (directory,)).fetchone()
+        if row is not None and row[0] == mtime_ns:
+            return
+
+        rows = []
+        if mtime_ns is not None:
+            try:
+                for entry in os.scandir(full_path):
+                    try:
+                        if entry.is_file():
+                            stat = entry.stat()
+                            rows.append((os.path.join(directory, entry.name), directory,
+                                         stat.st_size, stat.st_mtime))
+                    except OSError:
+                        continue
+            except OSError as e:
+                logger.debug(f"无法列出目录 {full_path}: {e}")
+                mtime_ns = None
+        if self.readonly:
+            self._scanned[directory] = {path: (size, mtime) for path, _, size, mtime in rows}
+            return
+        # 一个事务中替换整个目录的索引并立即提交
+        with self._db:
+            self._db.execute("DELETE FROM local_files WHERE dir = ?", (directory,))
+            if mtime_ns is None:
+                self._db.execute("DELETE FROM dirs WHERE path = ?", (directory,))
+                return
+            self._db.executemany("INSERT OR REPLACE INTO local_files VALUES (?, ?, ?, ?)", rows)
+            self._db.execute("INSERT OR REPLACE INTO dirs VALUES (?, ?)", (directory, mtime_ns))
+
+
+def get_manifest(download_dir):
+    """返回下载目录对应的清单，同一目录的并发课程共享一个对象"""
+    root = os.path.abspath(download_dir)
+    with _registry_lock:
+        manifest = _registry.get(root)
+        if manifest is None:
+            manifest = Manifest(root).load()
+            _registry[root] = manifest
+        return manifest
+
+
+def open_readonly(download_dir):
+    """只读打开下载目录的清单(用于预览)，不创建数据库；下载目录不存在时返回None"""
+    root = os.path.abspath(download_dir)
+    if not os.path.isdir(root):
+        return None
+    return Manifest(root, readonly=True).load()
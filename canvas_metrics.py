@@ -0,0 +1,453 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+同步指标
+RunMetrics 从进度事件(见canvas_events)中收集一次运行里每个课程和每个文件的耗时：
+列表时间、排队等待、传输时间、字节数、重试次数和吞吐量，可写成JSON或CSV报告。
+Counters 是常驻进程(后台服务、监视模式)使用的累计计数器，不保留单个文件的记录，
+通过 MetricsServer 以Prometheus文本格式在 /metrics 提供。
+ThroughputHistory 保存每个Canvas站点以往的下载速度，用于预估同步需要的时间(见canvas_plan)。
+"""
+
+import os
+import csv
+import json
+import time
+import logging
+import threading
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+from canvas_events import FILE_STARTED, FILE_DONE, ERROR, SUMMARY
+
+logger = logging.getLogger("canvas-downloader-metrics")
+
+# 汇总日志中列出的最慢课程数量
+SLOWEST_COURSES = 3
+
+DEFAULT_HISTORY_PATH = os.path.join(os.path.expanduser("~"), ".cache", "canvas-downloader", "throughput.json")
+# 没有历史数据时的估计：每个文件的固定开销(秒)和传输速度(字节/秒)
+DEFAULT_FILE_SECONDS = 0.5
+DEFAULT_BYTES_PER_SECOND = 5 * 1024 * 1024
+# 拟合下载速度时，平均大小超过这个值的文件主要反映传输速度
+LARGE_FILE_BYTES = 1024 * 1024
+# 合并历史数据时本次运行的权重
+HISTORY_WEIGHT = 0.3
+
+COURSE_FIELDS = ["course_id", "course_code", "host", "success", "queue_wait", "list_time", "elapsed",
+                 "files_found", "files_downloaded", "files_deduplicated", "files_skipped", "files_failed",
+                 "bytes_downloaded", "transfer_time", "retries", "mb_per_second", "error"]
+FILE_FIELDS = ["course_id", "host", "file_id", "name", "path", "status", "bytes", "queue_wait",
+               "transfer_time", "mb_per_second", "retries", "error"]
+
+# (名称, 类型, 说明)
+COUNTERS = [
+    ("canvas_downloader_courses_total", "counter", "同步的课程数量，按结果分类(requeued: 暂时失败，已重新排队)"),
+    ("canvas_downloader_course_seconds_total", "counter", "课程同步的总耗时(秒)"),
+    ("canvas_downloader_list_seconds_total", "counter", "列出课程文件的总耗时(秒)"),
+    ("canvas_downloader_files_total", "counter", "保存的文件数量，按方式(下载或去重链接)分类"),
+    ("canvas_downloader_bytes_total", "counter", "下载的字节数"),
+    ("canvas_downloader_file_retries_total", "counter", "单个文件的重试次数"),
+    ("canvas_downloader_file_errors_total", "counter", "最终失败的文件数量"),
+]
+
+
+def _rate(nbytes, seconds):
+    return round(nbytes / seconds / (1024 * 1024), 3) if seconds else None
+
+
+class _FileRecord:
+    def __init__(self, course_id, host, file_id):
+        self.course_id = course_id
+        self.host = host
+        self.file_id = file_id
+        self.name = None
+        self.path = None
+        self.status = "pending"
+        self.bytes = 0
+        self.queue_wait = None
+        self.started = None
+        self.transfer_time = None
+        self.retries = 0
+        self.error = None
+
+    def to_dict(self):
+        return {
+            "course_id": self.course_id,
+            "host": self.host,
+            "file_id": self.file_id,
+            "name": self.name,
+            "path": self.path,
+            "status": self.status,
+            "bytes": self.bytes,
+            "queue_wait": self.queue_wait,
+            "transfer_time": self.transfer_time,
+            "mb_per_second": _rate(self.bytes, self.transfer_time),
+            "retries": self.retries,
+            "error": self.error,
+        }
+
+
+class RunMetrics:
+    """收集一次运行的课程和文件耗时，可在多个线程中共用"""
+
+    def __init__(self, counters=None):
+        self.counters = counters
+        self.started = time.time()
+        self.finished = None
+        self.courses = []
+        # {(站点, 课程ID): 在courses中的位置}，重新排队的课程只保留最后一次同步
+        self._course_index = {}
+        # {课程ID: {文件ID: _FileRecord}}
+        self._files = {}
+        self._lock = threading.Lock()
+
+    def wrap(self, events, host=""):
+        """返回记录指标后再把事件交给events的回调"""
+        def on_event(event):
+            self.record(event, host)
+            if events:
+                events(event)
+        return on_event
+
+    def record(self, event, host=""):
+        if self.counters:
+            self.counters.record(event, host)
+        kind = event.get("event")
+        if kind not in (FILE_STARTED, FILE_DONE, ERROR, SUMMARY):
+            return
+        course_id = event.get("course_id")
+        with self._lock:
+            if kind == SUMMARY:
+                self._add_course(event, host)
+                return
+            file_id = event.get("file_id")
+            if file_id is None:
+                return
+            files = self._files.setdefault(course_id, {})
+            record = files.get(file_id)
+            if record is None:
+                record = files[file_id] = _FileRecord(course_id, host, file_id)
+            record.name = event.get("name") or record.name
+            record.path = event.get("path") or record.path
+            if kind == FILE_STARTED:
+                record.status = "downloading"
+                record.started = event["time"]
+                record.queue_wait = event.get("queued")
+            elif kind == FILE_DONE:
+                record.status = "linked" if event.get("linked") else "downloaded"
+                record.bytes = event.get("bytes") or 0
+                if record.started is not None:
+                    record.transfer_time = round(event["time"] - record.started, 3)
+            elif event.get("retry"):
+                record.retries += 1
+            else:
+                record.status = "failed"
+                record.error = event.get("message")
+
+    def _add_course(self, summary, host):
+        course_id = summary.get("course_id")
+        files = list(self._files.get(course_id, {}).values())
+        elapsed = summary.get("elapsed") or 0
+        transfer_time = sum(record.transfer_time or 0 for record in files)
+        errors = summary.get("errors") or []
+        course = {
+            "course_id": course_id,
+            "course_code": summary.get("course_code"),
+            "host": host,
+            "success": bool(summary.get("success")),
+            # 从运行开始到课程开始同步的时间(等待空闲的并发名额)
+            "queue_wait": round(max(0.0, summary["time"] - elapsed - self.started), 3),
+            "list_time": summary.get("list_time"),
+            "elapsed": elapsed,
+            "files_found": summary.get("files_found", 0),
+            "files_downloaded": summary.get("files_downloaded", 0),
+            "files_deduplicated": summary.get("files_deduplicated", 0),
+            "files_skipped": summary.get("files_skipped", 0),
+            "files_failed": sum(1 for record in files if record.status == "failed"),
+            "bytes_downloaded": summary.get("bytes_downloaded", 0),
+            "transfer_time": round(transfer_time, 3),
+            "retries": sum(record.retries for record in files),
+            "mb_per_second": _rate(summary.get("bytes_downloaded", 0), elapsed),
+            "error": errors[0] if errors else None,
+        }
+        # 暂时失败后重新排队的课程，用最后一次同步的结果替换之前的记录
+        index = self._course_index.get((host, course_id))
+        if index is None:
+            self._course_index[(host, course_id)] = len(self.courses)
+            self.courses.append(course)
+        else:
+            self.courses[index] = course
+
+    def totals(self):
+        with self._lock:
+            elapsed = (self.finished or time.time()) - self.started
+            nbytes = sum(course["bytes_downloaded"] for course in self.courses)
+            return {
+                "elapsed": round(elapsed, 3),
+                "courses": len(self.courses),
+                "courses_failed": sum(1 for course in self.courses if not course["success"]),
+                "files_downloaded": sum(course["files_downloaded"] for course in self.courses),
+                "files_deduplicated": sum(course["files_deduplicated"] for course in self.courses),
+                "files_failed": sum(course["files_failed"] for course in self.courses),
+                "bytes_downloaded": nbytes,
+                "retries": sum(course["retries"] for course in self.courses),
+                "mb_per_second": _rate(nbytes, elapsed),
+            }
+
+    def hosts(self):
+        """按Canvas站点汇总"""
+        hosts = {}
+        with self._lock:
+            for course in self.courses:
+                host = hosts.setdefault(course["host"], {"courses": 0, "elapsed": 0.0, "list_time": 0.0,
+                                                         "bytes_downloaded": 0, "retries": 0})
+                host["courses"] += 1
+                host["elapsed"] = round(host["elapsed"] + course["elapsed"], 3)
+                host["list_time"] = round(host["list_time"] + (course["list_time"] or 0), 3)
+                host["bytes_downloaded"] += course["bytes_downloaded"]
+                host["retries"] += course["retries"]
+        return hosts
+
+    def to_dict(self):
+        with self._lock:
+            courses = list(self.courses)
+            files = [record.to_dict() for records in self._files.values() for record in records.values()]
+        return {
+            "started": self.started,
+            "finished": self.finished,
+            "totals": self.totals(),
+            "hosts": self.hosts(),
+            "courses": courses,
+            "files": files,
+        }
+
+    def transfer_samples(self):
+        """返回 {站点: [(字节数, 传输秒数)]}，只包括实际下载的文件"""
+        samples = {}
+        with self._lock:
+            for records in self._files.values():
+                for record in records.values():
+                    if record.status == "downloaded" and record.transfer_time is not None:
+                        samples.setdefault(record.host, []).append((record.bytes, record.transfer_time))
+        return samples
+
+    def finish(self):
+        self.finished = time.time()
+
+    def write_report(self, path):
+        """写入运行报告：.csv 写课程表，文件表写入同名的 .files.csv；其他扩展名写JSON"""
+        report = self.to_dict()
+        if path.lower().endswith(".csv"):
+            _write_csv(path, COURSE_FIELDS, report["courses"])
+            _write_csv(path[:-4] + ".files.csv", FILE_FIELDS, report["files"])
+        else:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+
+    def summary_lines(self):
+        """运行结束时显示的汇总"""
+        totals = self.totals()
+        lines = [f"本次运行用时 {totals['elapsed']:.1f}秒，下载 {totals['bytes_downloaded'] / (1024 * 1024):.1f} MB"
+                 f" (平均 {totals['mb_per_second'] or 0:.2f} MB/秒)，文件重试 {totals['retries']} 次"]
+        with self._lock:
+            slowest = sorted(self.courses, key=lambda course: course["elapsed"], reverse=True)[:SLOWEST_COURSES]
+        if len(self.courses) > 1:
+            lines.append("最慢的课程: " + ", ".join(
+                f"{course['course_code']} {course['elapsed']:.1f}秒(列表 {course['list_time'] or 0:.1f}秒)"
+                for course in slowest))
+        return lines
+
+
+def _write_csv(path, fields, rows):
+    # utf-8-sig 让Excel正确识别中文
+    with open(path, 'w', encoding='utf-8-sig', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=fields, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def fit_transfer_time(samples):
+    """用最小二乘把文件传输时间拟合为 固定开销 + 字节数 / 速度，返回(每个文件的秒数, 字节/秒)"""
+    n = len(samples)
+    sum_x = float(sum(nbytes for nbytes, _ in samples))
+    sum_y = float(sum(seconds for _, seconds in samples))
+    sum_xx = sum(float(nbytes) * nbytes for nbytes, _ in samples)
+    sum_xy = sum(float(nbytes) * seconds for nbytes, seconds in samples)
+    denominator = n * sum_xx - sum_x * sum_x
+    slope = (n * sum_xy - sum_x * sum_y) / denominator if denominator > 0 else 0.0
+    if slope <= 0:
+        # 文件大小都相近，无法区分固定开销和传输时间：小文件的时间算作固定开销，大文件的算作传输
+        if sum_x / n < LARGE_FILE_BYTES or not sum_y:
+            return sum_y / n, None
+        return 0.0, sum_x / sum_y
+    return max(0.0, (sum_y - slope * sum_x) / n), 1 / slope
+
+
+class ThroughputHistory:
+    """每个Canvas站点以往的下载速度，保存在JSON文件中"""
+
+    def __init__(self, path=DEFAULT_HISTORY_PATH):
+        self.path = path
+        # {站点: {"file_seconds": 秒, "bytes_per_second": 字节/秒, "runs": 次数}}
+        self.hosts = {}
+
+    def load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.hosts = json.load(f).get("hosts", {})
+        except FileNotFoundError:
+            pass
+        except (ValueError, OSError, AttributeError) as e:
+            logger.warning(f"无法读取下载速度记录 {self.path}: {e}")
+        return self
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        temp_path = f"{self.path}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({"hosts": self.hosts}, f, ensure_ascii=False, indent=2)
+        os.replace(temp_path, self.path)
+
+    def update(self, metrics):
+        """合并一次运行的传输记录，返回是否有新数据"""
+        updated = False
+        for host, samples in metrics.transfer_samples().items():
+            file_seconds, bytes_per_second = fit_transfer_time(samples)
+            old = self.hosts.get(host)
+            if old:
+                file_seconds = old["file_seconds"] * (1 - HISTORY_WEIGHT) + file_seconds * HISTORY_WEIGHT
+                if bytes_per_second is None:
+                    bytes_per_second = old["bytes_per_second"]
+                elif old["bytes_per_second"]:
+                    bytes_per_second = (old["bytes_per_second"] * (1 - HISTORY_WEIGHT)
+                                        + bytes_per_second * HISTORY_WEIGHT)
+            self.hosts[host] = {"file_seconds": round(file_seconds, 4),
+                                "bytes_per_second": round(bytes_per_second) if bytes_per_second else None,
+                                "runs": (old or {}).get("runs", 0) + 1}
+            updated = True
+        return updated
+
+    def estimate(self, host, files, nbytes):
+        """估计逐个下载files个文件、共nbytes字节需要的秒数，返回(秒数, 是否有历史数据)"""
+        entry = self.hosts.get(host)
+        file_seconds = entry["file_seconds"] if entry else DEFAULT_FILE_SECONDS
+        bytes_per_second = (entry or {}).get("bytes_per_second") or DEFAULT_BYTES_PER_SECOND
+        return files * file_seconds + nbytes / bytes_per_second, entry is not None
+
+
+def record_throughput(metrics, path=DEFAULT_HISTORY_PATH):
+    """把一次运行的下载速度合并到历史记录，供 --plan 估计时间"""
+    history = ThroughputHistory(path).load()
+    try:
+        if history.update(metrics):
+            history.save()
+    except OSError as e:
+        logger.warning(f"保存下载速度记录失败: {e}")
+
+
+class Counters:
+    """常驻进程的累计计数器，按站点区分"""
+
+    def __init__(self):
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def wrap(self, events, host=""):
+        def on_event(event):
+            self.record(event, host)
+            if events:
+                events(event)
+        return on_event
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def record(self, event, host=""):
+        kind = event.get("event")
+        if kind == FILE_DONE:
+            self.inc("canvas_downloader_files_total", host=host,
+                     method="linked" if event.get("linked") else "downloaded")
+            self.inc("canvas_downloader_bytes_total", event.get("bytes") or 0, host=host)
+        elif kind == ERROR and event.get("file_id") is not None:
+            if event.get("retry"):
+                self.inc("canvas_downloader_file_retries_total", host=host)
+            else:
+                self.inc("canvas_downloader_file_errors_total", host=host)
+        elif kind == SUMMARY:
+            if event.get("success"):
+                result = "success"
+            else:
+                result = "requeued" if event.get("requeued") else "failure"
+            self.inc("canvas_downloader_courses_total", host=host, result=result)
+            self.inc("canvas_downloader_course_seconds_total", event.get("elapsed") or 0, host=host)
+            self.inc("canvas_downloader_list_seconds_total", event.get("list_time") or 0, host=host)
+
+    def render(self):
+        """Prometheus文本格式"""
+        with self._lock:
+            values = sorted(self._values.items())
+        lines = []
+        for name, kind, help_text in COUNTERS:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for (key, labels), value in values:
+                if key != name:
+                    continue
+                label_text = ",".join(f'{label}="{_escape(str(v))}"' for label, v in labels)
+                value = _format_value(value)
+                lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _format_value(value):
+    # 字节数很快超过 :g 的6位有效数字，整数值按整数输出
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.server.counters.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_metrics_server(counters, port):
+    """启动指标服务，端口被占用等情况下记录错误并返回None，同步照常进行"""
+    try:
+        return MetricsServer(counters, port).start()
+    except OSError as e:
+        logger.error(f"无法在端口 {port} 提供指标，本次运行不提供 /metrics: {e}")
+        return None
+
+
+class MetricsServer:
+    """在后台线程中通过HTTP提供 /metrics，只监听本机"""
+
+    def __init__(self, counters, port, host="127.0.0.1"):
+        self.server = HTTPServer((host, port), _MetricsHandler)
+        self.server.counters = counters
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name="metrics", daemon=True).start()
+        logger.info(f"指标地址: http://{self.server.server_address[0]}:{self.server.server_address[1]}/metrics")
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+可续传的分块下载
+下载过程中数据写入 .part 文件，已完成的字节范围记录在 .part.json 日志中。
+下载被中断(超时、断网、关闭程序)后，下一次同步用HTTP Range请求从断点继续，
+完成后校验文件大小再移动到最终位置。
+"""
+
+import os
+import re
+import json
+import time
+import logging
+
+logger = logging.getLogger("canvas-downloader-partial")
+
+JOURNAL_SUFFIX = ".part.json"
+# 每写入这么多字节或经过这么长时间就保存一次日志
+JOURNAL_INTERVAL_BYTES = 4 * 1024 * 1024
+JOURNAL_INTERVAL_SECONDS = 2.0
+
+
+class IncompleteDownloadError(Exception):
+    """下载完成后文件大小与Canvas上的不一致"""
+
+
+def merge_ranges(ranges):
+    """合并重叠或相邻的 [start, end) 范围"""
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def parse_content_range(value):
+    """解析 Content-Range: bytes start-end/total，返回(start, end, total)"""
+    match = re.match(r"\s*bytes\s+(\d+)-(\d+)/(\d+|\*)", value or "")
+    if not match:
+        return None
+    total = None if match.group(3) == "*" else int(match.group(3))
+    return int(match.group(1)), int(match.group(2)) + 1, total
+
+
+class PartialDownload:
+    """一个文件的 .part 数据和已完成范围日志"""
+
+    def __init__(self, path, file_info):
+        self.path = path
+        self.part_path = path + ".part"
+        self.journal_path = path + JOURNAL_SUFFIX
+        self.file_id = file_info.get("id")
+        self.updated_at = file_info.get("updated_at")
+        self.size = file_info.get("size")
+        self.etag = None
+        self.ranges = []
+        self._unsaved = 0
+        self._saved_at = time.monotonic()
+
+    def load(self):
+        """读取日志；日志与当前Canvas文件不符或数据文件丢失时从头开始"""
+        try:
+            with open(self.journal_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return self
+        if (data.get("id") != self.file_id or data.get("updated_at") != self.updated_at
+                or data.get("size") != self.size):
+            self.discard()
+            return self
+        try:
+            part_size = os.path.getsize(self.part_path)
+        except OSError:
+            self.discard()
+            return self
+        # 日志只可能落后于数据，不会超前；超出文件大小的部分不可信
+        self.ranges = merge_ranges([r[0], min(r[1], part_size)] for r in data.get("ranges", [])
+                                   if r[0] < part_size)
+        self.etag = data.get("etag")
+        return self
+
+    def save(self):
+        """原子地写入日志"""
+        data = {
+            "id": self.file_id,
+            "updated_at": self.updated_at,
+            "size": self.size,
+            "etag": self.etag,
+            "ranges": self.ranges,
+        }
+        temp_path = self.journal_path + ".tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(temp_path, self.journal_path)
+        self._unsaved = 0
+        self._saved_at = time.monotonic()
+
+    def discard(self):
+        """删除 .part 数据和日志"""
+        self.ranges = []
+        for path in (self.part_path, self.journal_path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def completed_bytes(self):
+        return sum(end - start for start, end in self.ranges)
+
+    def resume_offset(self):
+        """从文件开头连续完成的字节数，顺序下载从这里继续"""
+        if self.ranges and self.ranges[0][0] == 0:
+            return self.ranges[0][1]
+        return 0
+
+    def missing_ranges(self, size=None):
+        """尚未下载的 [start, end) 范围"""
+        size = self.size if size is None else size
+        missing = []
+        position = 0
+        for start, end in self.ranges:
+            if start > position:
+                missing.append([position, start])
+            position = max(position, end)
+        if size is not None and position < size:
+            missing.append([position, size])
+        return missing
+
+    def is_complete(self):
+        """日志表明所有数据都已写入(例如在改名前被中断)，不需要再请求服务器"""
+        return bool(self.size) and bool(self.ranges) and not self.missing_ranges()
+
+    def range_headers(self):
+        """续传时需要附加的请求头"""
+        offset = self.resume_offset()
+        if not offset:
+            return {}
+        return {"Range": f"bytes={offset}-"}
+
+    def begin(self, status, headers):
+        """根据响应确定写入位置，返回以正确偏移打开的文件对象"""
+        offset = self.resume_offset()
+        if status == 206 and offset:
+            content_range = parse_content_range(headers.get("content-range"))
+            if not content_range or content_range[0] != offset:
+                raise IncompleteDownloadError(f"服务器返回的范围与请求不符: {headers.get('content-range')}")
+            if self.size is None:
+                self.size = content_range[2]
+            f = open(self.part_path, "r+b")
+            f.seek(offset)
+            return f
+        # 服务器忽略了Range请求或者没有断点，从头下载
+        if offset:
+            logger.debug(f"服务器不支持断点续传，重新下载: {self.path}")
+        self.ranges = []
+        if self.size is None and headers.get("content-length"):
+            self.size = int(headers["content-length"])
+        return open(self.part_path, "wb")
+
+    def write(self, f, chunk):
+        """在文件当前位置写入数据并记录范围，按一定间隔保存日志"""
+        offset = f.tell()
+        f.write(chunk)
+        self.record(f, offset, len(chunk))
+
+    def record(self, f, offset, length):
+        """记录已写入的范围；保存日志前先刷新数据，保证日志不会超前于数据"""
+        self.ranges = merge_ranges(self.ranges + [[offset, offset + length]])
+        self._unsaved += length
+        if (self._unsaved >= JOURNAL_INTERVAL_BYTES
+                or time.monotonic() - self._saved_at >= JOURNAL_INTERVAL_SECONDS):
+            f.flush()
+            self.save()
+
+    def checkpoint(self, f):
+        """把已写入的数据刷到磁盘后保存日志，中断时调用"""
+        try:
+            if not f.closed:
+                f.flush()
+            self.save()
+        except OSError as e:
+            logger.warning(f"保存续传日志失败: {e}")
+
+    def finish(self):
+        """校验大小，成功后删除日志并返回 .part 路径"""
+        actual = os.path.getsize(self.part_path)
+        if self.size is not None and (actual != self.size or self.missing_ranges()):
+            self.discard()
+            raise IncompleteDownloadError(f"文件大小不一致: 期望 {self.size} 字节，实际 {actual} 字节")
+        try:
+            os.remove(self.journal_path)
+        except OSError:
+            pass
+        return self.part_path
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+同步预览
+只读取元数据，不下载文件：并发列出各课程的文件，应用筛选规则并与本地同步清单比较，
+统计每个课程新增、有变化和无需下载的文件，以及需要下载的字节数，再按以往的下载速度(见canvas_metrics)估计用时。
+列表请求优先使用HTTP缓存中最近确认过的响应(见canvas_cache)，重复预览通常只需几秒。
+"""
+
+import time
+import sqlite3
+import http.client
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+from canvas_engine import CanvasClient, CanvasAPIError, local_path_for, is_up_to_date
+from canvas_filters import FileFilter
+from canvas_manifest import open_readonly
+from canvas_store import get_store
+
+# 预览时直接使用这段时间(秒)内确认过的缓存响应，更早的响应发送条件请求
+DEFAULT_PLAN_MAX_AGE = 3600
+# 同时预览的课程数量
+PLAN_JOBS = 8
+
+
+class CoursePlan:
+    """单个课程的预览结果"""
+
+    def __init__(self, course_id, host=""):
+        self.course_id = course_id
+        self.host = host
+        self.course_code = str(course_id)
+        self.files_found = 0
+        self.files_new = 0
+        self.files_changed = 0
+        self.files_unchanged = 0
+        self.files_filtered = 0
+        # 去重存储中已有、只需链接的文件
+        self.files_linked = 0
+        self.bytes_new = 0
+        self.bytes_changed = 0
+        self.list_time = 0.0
+        self.error = None
+        # 由estimate填写
+        self.seconds = None
+        self.estimated_from_history = False
+
+    @property
+    def files_to_download(self):
+        return self.files_new + self.files_changed
+
+    @property
+    def bytes_to_download(self):
+        return self.bytes_new + self.bytes_changed
+
+    def estimate(self, history):
+        """按站点以往的下载速度估计逐个下载需要的秒数"""
+        self.seconds, self.estimated_from_history = history.estimate(
+            self.host, self.files_to_download, self.bytes_to_download)
+        return self.seconds
+
+    def to_dict(self):
+        return {
+            "course_id": self.course_id,
+            "course_code": self.course_code,
+            "host": self.host,
+            "files_found": self.files_found,
+            "files_new": self.files_new,
+            "files_changed": self.files_changed,
+            "files_unchanged": self.files_unchanged,
+            "files_filtered": self.files_filtered,
+            "files_linked": self.files_linked,
+            "bytes_new": self.bytes_new,
+            "bytes_changed": self.bytes_changed,
+            "list_time": round(self.list_time, 3),
+            "estimated_seconds": round(self.seconds, 1) if self.seconds is not None else None,
+            "error": self.error,
+        }
+
+
+def plan_sync(session, settings, course_id, max_age=DEFAULT_PLAN_MAX_AGE):
+    """预览单个课程的同步，返回CoursePlan；不写入文件，也不创建下载目录"""
+    plan = CoursePlan(course_id, urlparse(settings["base_url"]).netloc.lower())
+    started = time.monotonic()
+    client = CanvasClient(session, settings["base_url"], settings["token"], max_age=max_age)
+    # 下载目录还不存在时所有文件都是新增的
+    manifest = open_readonly(settings["download_dir"])
+    store = get_store(settings["dedup_store"])
+    file_filter = settings.get("file_filter") or FileFilter.from_settings(settings)
+    try:
+        course = client.get_course(course_id)
+        plan.course_code = course.get("course_code") or str(course_id)
+        folders = client.list_folders(course_id)
+        for file_info in client.list_files(course_id, file_filter=file_filter):
+            plan.files_found += 1
+            if not file_filter.allows(file_info, folders.get(file_info.get("folder_id"), "")):
+                plan.files_filtered += 1
+                continue
+            path = local_path_for(settings, plan.course_code, folders, file_info)
+            if manifest and (manifest.is_unchanged(file_info, path) or is_up_to_date(manifest, path, file_info)):
+                plan.files_unchanged += 1
+                continue
+            if store and store.lookup(file_info):
+                plan.files_linked += 1
+                continue
+            size = file_info.get("size") or 0
+            # 清单中有记录或本地已有同名文件：Canvas上的文件有更新
+            if manifest and (manifest.get(file_info["id"]) or manifest.local_file(path)):
+                plan.files_changed += 1
+                plan.bytes_changed += size
+            else:
+                plan.files_new += 1
+                plan.bytes_new += size
+    except CanvasAPIError as e:
+        plan.error = str(e)
+    except (OSError, http.client.HTTPException, ValueError, sqlite3.Error) as e:
+        plan.error = f"{e.__class__.__name__}: {e}"
+    finally:
+        if manifest:
+            manifest.close()
+    plan.list_time = time.monotonic() - started
+    return plan
+
+
+def plan_courses(session, tasks, max_age=DEFAULT_PLAN_MAX_AGE, jobs=PLAN_JOBS):
+    """并发预览多个课程，tasks 是 [(settings, course_id)]，按原顺序返回CoursePlan列表"""
+    if not tasks:
+        return []
+    with ThreadPoolExecutor(max_workers=max(1, min(jobs, len(tasks)))) as executor:
+        futures = [executor.submit(plan_sync, session, settings, course_id, max_age)
+                   for settings, course_id in tasks]
+        return [future.result() for future in futures]
+
+
+def schedule_seconds(durations, jobs):
+    """jobs个课程同时下载时的大致总用时：按用时从长到短分配给最早空闲的工作线程"""
+    workers = [0.0] * max(1, jobs)
+    for seconds in sorted(durations, reverse=True):
+        workers[workers.index(min(workers))] += seconds
+    return max(workers)
+
+
+def format_duration(seconds):
+    seconds = int(round(seconds))
+    if seconds >= 3600:
+        return f"{seconds // 3600}小时{seconds % 3600 // 60:02d}分"
+    if seconds >= 60:
+        return f"{seconds // 60}分{seconds % 60:02d}秒"
+    return f"{seconds}秒"
+
+
+def format_size(nbytes):
+    if nbytes >= 1024 ** 3:
+        return f"{nbytes / 1024 ** 3:.2f} GB"
+    return f"{nbytes / 1024 ** 2:.1f} MB"
+
+
+def format_plan(plans, history, jobs=1):
+    """预览结果的文本表格，课程按预计用时从长到短排列"""
+    for plan in plans:
+        plan.estimate(history)
+    ok = sorted((plan for plan in plans if not plan.error), key=lambda plan: plan.seconds, reverse=True)
+    lines = [f"{'课程':<20}{'新增':>8}{'有变化':>8}{'未变化':>8}{'已筛除':>8}{'需下载':>12}{'预计用时':>12}"]
+    for plan in ok:
+        unchanged = plan.files_unchanged + plan.files_linked
+        lines.append(f"{plan.course_code[:20]:<20}{plan.files_new:>8}{plan.files_changed:>8}{unchanged:>8}"
+                     f"{plan.files_filtered:>8}{format_size(plan.bytes_to_download):>12}"
+                     f"{format_duration(plan.seconds):>12}")
+    for plan in plans:
+        if plan.error:
+            lines.append(f"课程 {plan.course_id} 无法预览: {plan.error}")
+
+    files = sum(plan.files_to_download for plan in ok)
+    nbytes = sum(plan.bytes_to_download for plan in ok)
+    total = schedule_seconds([plan.seconds for plan in ok], jobs)
+    lines.append(f"共 {len(ok)} 个课程，需要下载 {files} 个文件，{format_size(nbytes)}，"
+                 f"同时下载 {jobs} 个课程预计用时 {format_duration(total)}")
+    if any(not plan.estimated_from_history for plan in ok if plan.files_to_download):
+        lines.append("部分站点还没有下载记录，按默认速度估计；完成一次下载后的预估会更准确")
+    return lines
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Canvas API限流调度
+同一Canvas站点的所有下载线程共享一个令牌桶，并根据响应头 X-Rate-Limit-Remaining
+调整请求速度和同时进行的请求数量：额度充足(或站点不返回额度)时从初始速度逐步加速到上限，
+额度下降时减速；遇到 403 "Rate Limit Exceeded" (或429) 时退避后重试，而不是让整个课程失败。
+"""
+
+import time
+import random
+import asyncio
+import logging
+import threading
+
+logger = logging.getLogger("canvas-downloader-ratelimit")
+
+# Canvas的限流桶容量约为700，剩余额度低于这些值时开始减速
+LOW_REMAINING = 100
+MID_REMAINING = 300
+HIGH_REMAINING = 500
+
+# 初始的每秒请求数，额度充足时逐步增加到MAX_RATE
+DEFAULT_RATE = 20.0
+MAX_RATE = 500.0
+MIN_RATE = 0.5
+# 每个额度充足的响应之后速度乘以这个系数
+RATE_GROWTH = 1.1
+DEFAULT_BURST = 10
+DEFAULT_MAX_IN_FLIGHT = 8
+MAX_THROTTLE_RETRIES = 6
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 30.0
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def is_rate_limited(status, body=b""):
+    """判断响应是否为Canvas限流"""
+    if status == 429:
+        return True
+    return status == 403 and b"Rate Limit Exceeded" in (body or b"")
+
+
+def backoff_delay(attempt):
+    """指数退避加随机抖动"""
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt))
+    return delay * (0.5 + random.random() / 2)
+
+
+class HostThrottle:
+    """一个Canvas站点的令牌桶和自适应并发上限，线程安全"""
+
+    def __init__(self, rate=DEFAULT_RATE, burst=DEFAULT_BURST, max_in_flight=DEFAULT_MAX_IN_FLIGHT,
+                 max_rate=MAX_RATE):
+        self.max_rate = max(rate, max_rate)
+        self.rate = rate
+        self.burst = burst
+        self.max_in_flight = max_in_flight
+        self.limit = max_in_flight
+        self.in_flight = 0
+        self.tokens = float(burst)
+        self.paused_until = 0.0
+        self.remaining = None
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def try_acquire(self):
+        """尝试占用一个请求名额，成功返回0，否则返回建议等待的秒数"""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if now < self.paused_until:
+                return self.paused_until - now
+            if self.in_flight >= self.limit:
+                return 0.05
+            if self.tokens < 1:
+                return (1 - self.tokens) / self.rate
+            self.tokens -= 1
+            self.in_flight += 1
+            return 0
+
+    def acquire(self):
+        while True:
+            wait = self.try_acquire()
+            if not wait:
+                return
+            time.sleep(min(wait, 1.0))
+
+    async def acquire_async(self):
+        while True:
+            wait = self.try_acquire()
+            if not wait:
+                return
+            await asyncio.sleep(min(wait, 1.0))
+
+    def release(self, headers=None, limited=False, attempt=0):
+        """请求结束，根据响应头调整速度；被限流时返回需要等待的秒数"""
+        with self._lock:
+            self.in_flight = max(0, self.in_flight - 1)
+            remaining = (headers or {}).get("x-rate-limit-remaining")
+            try:
+                remaining = float(remaining) if remaining is not None else None
+            except ValueError:
+                remaining = None
+            if not limited:
+                if remaining is None:
+                    # 没有额度信息时与额度充足时一样逐步加速，被限流后同样由此恢复
+                    self.rate = min(self.max_rate, self.rate * RATE_GROWTH)
+                    self.limit = min(self.max_in_flight, self.limit + 1)
+                else:
+                    self.remaining = remaining
+                    self._adjust(remaining)
+                return 0
+            # 被限流：同一次暂停期间只减半一次速度和并发，所有线程一起暂停
+            now = time.monotonic()
+            if now >= self.paused_until:
+                self.rate = max(MIN_RATE, self.rate / 2)
+                self.limit = max(1, self.limit // 2)
+            delay = backoff_delay(attempt)
+            self.paused_until = max(self.paused_until, now + delay)
+            self.tokens = 0
+            return delay
+
+    def _adjust(self, remaining):
+        if remaining < LOW_REMAINING:
+            self.rate = max(MIN_RATE, self.rate / 2)
+            self.limit = max(1, self.limit // 2)
+        elif remaining < MID_REMAINING:
+            self.rate = max(MIN_RATE, self.rate * 0.8)
+            self.limit = max(1, self.limit - 1)
+        elif remaining > HIGH_REMAINING:
+            self.rate = min(self.max_rate, self.rate * RATE_GROWTH)
+            self.limit = min(self.max_in_flight, self.limit + 1)
+
+
+def get_throttle(host):
+    """返回站点共享的HostThrottle"""
+    with _registry_lock:
+        throttle = _registry.get(host)
+        if throttle is None:
+            throttle = HostThrottle()
+            _registry[host] = throttle
+        return throttle
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+失败重试
+错误分为暂时性的(5xx、超时、连接被重置、传输中断、限流)和永久性的(401、403、404等)。
+只有暂时性错误按指数退避加随机抖动重试：单个文件在课程内重试(借助 .part 从断点继续)，
+失败的课程在本轮全部课程处理完后重新排队。
+"""
+
+import socket
+import random
+import asyncio
+import http.client
+
+from canvas_partial import IncompleteDownloadError
+from canvas_stall import StallError
+
+DEFAULT_FILE_RETRIES = 3
+DEFAULT_FILE_DELAY = 1.0
+DEFAULT_COURSE_RETRIES = 2
+DEFAULT_COURSE_DELAY = 30.0
+DEFAULT_MAX_DELAY = 300.0
+
+# 这些状态码表示服务器暂时不可用或请求超时，稍后重试通常会成功
+TRANSIENT_STATUS = (408, 425, 429)
+
+_TRANSIENT_ERRORS = (StallError, IncompleteDownloadError, ConnectionError, socket.timeout,
+                     asyncio.TimeoutError, EOFError, http.client.HTTPException)
+
+
+def is_transient_status(status, message=""):
+    """HTTP状态码是否表示暂时性错误"""
+    if status >= 500 or status in TRANSIENT_STATUS:
+        return True
+    # 重试多次后仍被限流
+    return status == 403 and "Rate Limit Exceeded" in (message or "")
+
+
+def is_transient(error):
+    """判断异常是否为暂时性错误，只有暂时性错误值得重试"""
+    # CanvasAPIError 带有HTTP状态码
+    status = getattr(error, "status", None)
+    if isinstance(status, int):
+        return is_transient_status(status, getattr(error, "message", ""))
+    if isinstance(error, _TRANSIENT_ERRORS):
+        return True
+    # 域名解析暂时失败
+    return isinstance(error, socket.gaierror) and error.errno == getattr(socket, "EAI_AGAIN", None)
+
+
+class RetryPolicy:
+    """重试次数和退避时间"""
+
+    def __init__(self, retries=DEFAULT_FILE_RETRIES, base_delay=DEFAULT_FILE_DELAY, max_delay=DEFAULT_MAX_DELAY):
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def should_retry(self, error, attempt):
+        """第attempt次(从0开始)失败后是否重试"""
+        return attempt < self.retries and is_transient(error)
+
+    def delay(self, attempt):
+        """指数退避加随机抖动，避免多个任务同时重试"""
+        delay = min(self.max_delay, self.base_delay * (2 ** attempt))
+        return delay * (0.5 + random.random() / 2)
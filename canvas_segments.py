@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+大文件分段下载
+文件存储服务器对单个连接的速度常有限制。超过阈值的文件把尚未下载的部分切分为多个字节范围，
+用多个连接并行获取，各自写入预先分配好大小的 .part 文件的对应偏移。
+已完成的范围记录在 .part.json 中(见canvas_partial)，中断后只重新获取缺少的部分，完成后校验文件大小。
+"""
+
+DEFAULT_SEGMENTS = 4
+# 超过这个大小(字节)的文件才分段下载
+DEFAULT_SEGMENT_THRESHOLD = 64 * 1024 * 1024
+# 每段至少这么大，避免把中等大小的文件切得过碎
+MIN_SEGMENT_SIZE = 16 * 1024 * 1024
+
+
+def split_ranges(missing, segments, min_size=MIN_SEGMENT_SIZE):
+    """把尚未下载的 [start, end) 范围切分为大约segments段，每段不小于min_size"""
+    total = sum(end - start for start, end in missing)
+    if not total:
+        return []
+    target = max(min_size, -(-total // max(1, segments)))
+    pieces = []
+    for start, end in missing:
+        # 向下取整，切出的每段都不小于target
+        count = max(1, (end - start) // target)
+        step = -(-(end - start) // count)
+        for offset in range(start, end, step):
+            pieces.append([offset, min(offset + step, end)])
+    return pieces
+
+
+class SegmentPolicy:
+    """分段下载的连接数和大小阈值"""
+
+    def __init__(self, segments=DEFAULT_SEGMENTS, threshold=DEFAULT_SEGMENT_THRESHOLD, min_size=MIN_SEGMENT_SIZE):
+        self.segments = segments
+        self.threshold = threshold
+        self.min_size = min_size
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls(settings.get("segments", DEFAULT_SEGMENTS),
+                   settings.get("segment_threshold") or DEFAULT_SEGMENT_THRESHOLD)
+
+    def should_split(self, size):
+        """Canvas给出了文件大小且超过阈值时分段下载"""
+        return self.segments > 1 and bool(size) and size > self.threshold
+
+    def ranges(self, partial):
+        """需要并行获取的范围"""
+        return split_ranges(partial.missing_ranges(), self.segments, self.min_size)
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+按传输进度判断超时
+单个文件的吞吐量持续低于阈值时中止并重试该文件(借助 .part 从断点继续)，
+课程的总期限则按待下载的字节数放宽，不再用一个固定的墙钟时间杀掉正常的长时间同步。
+"""
+
+import time
+
+# 低于该速度(字节/秒)并持续一个检测窗口，认为传输停滞
+DEFAULT_MIN_RATE = 10 * 1024
+DEFAULT_STALL_SECONDS = 30
+DEFAULT_STALL_RETRIES = 2
+# 估算课程期限时假设的最低平均速度(字节/秒)
+DEFAULT_DEADLINE_RATE = 100 * 1024
+
+
+class StallError(Exception):
+    """传输速度持续低于阈值"""
+
+
+class ThroughputMonitor:
+    """统计一个传输在最近窗口内的速度"""
+
+    def __init__(self, min_rate, window):
+        self.min_rate = min_rate
+        self.window = window
+        self._window_start = time.monotonic()
+        self._window_bytes = 0
+
+    def update(self, nbytes):
+        """记录收到的数据，窗口结束时速度不达标则抛出StallError"""
+        self._window_bytes += nbytes
+        now = time.monotonic()
+        elapsed = now - self._window_start
+        if elapsed < self.window:
+            return
+        rate = self._window_bytes / elapsed
+        if rate < self.min_rate:
+            raise StallError(f"{self.window}秒内平均速度 {rate / 1024:.1f}KB/s 低于 {self.min_rate / 1024:.1f}KB/s")
+        self._window_start = now
+        self._window_bytes = 0
+
+
+class StallPolicy:
+    """停滞检测和课程期限的参数"""
+
+    def __init__(self, min_rate=DEFAULT_MIN_RATE, window=DEFAULT_STALL_SECONDS,
+                 retries=DEFAULT_STALL_RETRIES, deadline_rate=DEFAULT_DEADLINE_RATE):
+        self.min_rate = min_rate
+        self.window = window
+        self.retries = retries
+        self.deadline_rate = deadline_rate
+
+    def monitor(self):
+        return ThroughputMonitor(self.min_rate, self.window)
+
+    def course_deadline(self, started, timeout):
+        """课程期限：基础超时加上按待下载字节数估算的传输时间，未设置超时时返回None"""
+        if not timeout:
+            return None
+        return CourseDeadline(started, timeout, self.deadline_rate)
+
+
+class CourseDeadline:
+    """随列出的待下载字节数增长的课程期限"""
+
+    def __init__(self, started, timeout, rate):
+        self.started = started
+        self.timeout = timeout
+        self.rate = rate
+        self.expected_bytes = 0
+
+    def add_bytes(self, nbytes):
+        self.expected_bytes += nbytes
+
+    def seconds(self):
+        return self.timeout + self.expected_bytes / self.rate
+
+    def expired(self):
+        return time.monotonic() > self.started + self.seconds()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+内容寻址的去重存储
+每个文件内容只在存储目录中保存一份(按SHA-256命名)，各课程下载目录中的文件是指向它的硬链接，
+不支持硬链接时依次尝试reflink和普通复制。
+按 Canvas文件id + 大小 + updated_at 建立索引，多个配置(例如交叉列出的课程分区)
+引用同一个Canvas文件时只需下载一次。
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import logging
+import threading
+
+logger = logging.getLogger("canvas-downloader-store")
+
+DEFAULT_STORE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "canvas-downloader", "store")
+INDEX_NAME = "index.json"
+# Linux上的FICLONE ioctl，用于在btrfs/xfs等文件系统上创建reflink
+FICLONE = 0x40049409
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def file_key(file_info):
+    """Canvas文件在存储索引中的键"""
+    return f"{file_info['id']}:{file_info.get('size')}:{file_info.get('updated_at')}"
+
+
+def hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _reflink(source, dest):
+    import fcntl
+    with open(source, "rb") as src, open(dest, "wb") as dst:
+        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+
+
+def place_file(source, dest):
+    """把source放到dest：优先硬链接，其次reflink，最后复制；返回是否为硬链接"""
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    temp_path = dest + ".link"
+    try:
+        os.remove(temp_path)
+    except OSError:
+        pass
+    linked = True
+    try:
+        os.link(source, temp_path)
+    except OSError:
+        linked = False
+        try:
+            _reflink(source, temp_path)
+        except (OSError, ImportError):
+            shutil.copyfile(source, temp_path)
+    os.replace(temp_path, dest)
+    return linked
+
+
+class BlobStore:
+    """存储目录及其 Canvas文件 -> 内容哈希 索引"""
+
+    def __init__(self, root):
+        self.root = root
+        self.index_path = os.path.join(root, INDEX_NAME)
+        self.index = {}
+        self.dirty = False
+        self._lock = threading.Lock()
+
+    def load(self):
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                self.index = json.load(f)
+        except FileNotFoundError:
+            pass
+        except (ValueError, OSError) as e:
+            logger.warning(f"无法读取去重存储索引 {self.index_path}，将重新建立: {e}")
+        return self
+
+    def save(self):
+        with self._lock:
+            if not self.dirty:
+                return
+            data = dict(self.index)
+            self.dirty = False
+        os.makedirs(self.root, exist_ok=True)
+        temp_path = f"{self.index_path}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(temp_path, self.index_path)
+
+    def blob_path(self, digest):
+        return os.path.join(self.root, digest[:2], digest)
+
+    def lookup(self, file_info):
+        """返回已存储的内容路径，没有或已损坏时返回None"""
+        with self._lock:
+            digest = self.index.get(file_key(file_info))
+        if not digest:
+            return None
+        path = self.blob_path(digest)
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return None
+        if file_info.get("size") is not None and size != file_info["size"]:
+            return None
+        return path
+
+    def add(self, source, file_info):
+        """把下载好的文件移入存储，返回内容路径；相同内容已存在时丢弃新文件"""
+        digest = hash_file(source)
+        path = self.blob_path(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.exists(path):
+            os.remove(source)
+        else:
+            # 存储目录可能在另一个文件系统上
+            shutil.move(source, path)
+        with self._lock:
+            self.index[file_key(file_info)] = digest
+            self.dirty = True
+        return path
+
+
+def get_store(root):
+    """返回存储目录对应的BlobStore，同一进程内共享；root为True时使用默认目录"""
+    if not root:
+        return None
+    if root is True:
+        root = DEFAULT_STORE_DIR
+    root = os.path.abspath(os.path.expanduser(root))
+    with _registry_lock:
+        store = _registry.get(root)
+        if store is None:
+            store = BlobStore(root).load()
+            _registry[root] = store
+        return store
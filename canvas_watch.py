@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+持续同步(监视模式)
+按间隔轮询每个课程，只同步有变化的课程。每次轮询只请求一页只含一个文件的列表
+(按updated_at倒序)，由文件总数和最近修改的文件组成指纹，指纹不变就跳过完整的列表和同步。
+每个课程的下一次轮询时间加入随机抖动，避免大量课程同时请求Canvas。
+"""
+
+import time
+import heapq
+import random
+import logging
+from urllib.parse import parse_qsl, urlparse
+
+from canvas_listing import parse_link_header, with_query
+
+logger = logging.getLogger("canvas-downloader-watch")
+
+DEFAULT_INTERVAL = 600
+# 轮询间隔的随机浮动比例
+DEFAULT_JITTER = 0.2
+
+
+def course_fingerprint(session, settings, course_id):
+    """用一次请求得到课程文件的指纹：文件总数 + 最近修改的文件id和时间"""
+    url = with_query(f"{settings['base_url']}/api/v1/courses/{course_id}/files",
+                     per_page=1, sort="updated_at", order="desc")
+    data, headers = session.get_json(url, settings["token"])
+    data = data if isinstance(data, list) else []
+    # 每页一个文件时，最后一页的页码就是文件总数
+    last = parse_link_header(headers.get("link")).get("last")
+    page = dict(parse_qsl(urlparse(last).query)).get("page", "") if last else ""
+    count = page if page.isdigit() else len(data)
+    newest = data[0] if data else {}
+    return f"{count}:{newest.get('id')}:{newest.get('updated_at')}"
+
+
+class CourseWatcher:
+    """记录每个课程的指纹和下一次轮询时间"""
+
+    def __init__(self, interval=DEFAULT_INTERVAL, jitter=DEFAULT_JITTER):
+        self.interval = interval
+        self.jitter = jitter
+        self.fingerprints = {}
+        self._due = []
+        self._order = 0
+
+    def add(self, key, delay=0):
+        # 加入序号，时间相同时按加入顺序，也避免比较key
+        self._order += 1
+        heapq.heappush(self._due, (time.monotonic() + delay, self._order, key))
+
+    def schedule(self, key):
+        """安排下一次轮询，间隔在 interval*(1±jitter) 之间随机"""
+        self.add(key, self.interval * random.uniform(1 - self.jitter, 1 + self.jitter))
+
+    def wait(self):
+        """等到下一个课程需要轮询，返回它的key"""
+        due, _, key = heapq.heappop(self._due)
+        delay = due - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        return key
+
+    def pop_due(self):
+        """取出所有已经到期的课程(例如上一轮同步期间到期的)，不等待"""
+        keys = []
+        now = time.monotonic()
+        while self._due and self._due[0][0] <= now:
+            keys.append(heapq.heappop(self._due)[2])
+        return keys
+
+    def changed(self, key, fingerprint):
+        """指纹与上次不同(或第一次轮询)时返回True并记录新指纹"""
+        if self.fingerprints.get(key) == fingerprint:
+            return False
+        self.fingerprints[key] = fingerprint
+        return True
+
+    def forget(self, key):
+        """同步失败后忘记指纹，下一次轮询时重新同步"""
+        self.fingerprints.pop(key, None)
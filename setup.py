@@ -13,7 +13,12 @@ setup(
     long_description_content_type="text/markdown",
     url="https://github.com/yourusername/canvas-downloader",
     packages=find_packages(),
-    py_modules=["canvas_downloader", "canvas_downloader_gui"],
+    py_modules=["canvas_downloader", "canvas_downloader_gui", "canvas_engine", "canvas_manifest",
+                "canvas_async", "canvas_partial", "canvas_stall",
+                "canvas_listing", "canvas_store", "canvas_ratelimit", "canvas_events",
+                "canvas_daemon", "canvas_watch", "canvas_jobs",
+                "canvas_retry", "canvas_metrics", "canvas_filters", "canvas_cache",
+                "canvas_plan", "canvas_segments"],
     classifiers=[
         "Programming Language :: Python :: 3",
         "License :: OSI Approved :: MIT License",
@@ -27,6 +32,7 @@ setup(
     entry_points={
         "console_scripts": [
             "canvas-downloader=canvas_downloader:main",
+            "canvas-downloader-daemon=canvas_daemon:main",
         ],
         "gui_scripts": [
             "canvas-downloader-gui=canvas_downloader_gui:main",
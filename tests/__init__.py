@@ -0,0 +1,17 @@
+# -*- coding: utf-8 -*-
+"""测试使用 benchmarks/fake_canvas.py 中的模拟Canvas服务器"""
+
+import os
+import sys
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_DIR = os.path.join(REPO_DIR, "benchmarks")
+for path in (REPO_DIR, BENCH_DIR):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+
+def expected_content(size):
+    """模拟服务器返回的文件内容"""
+    from fake_canvas import _BLOCK
+    return (_BLOCK * (size // len(_BLOCK) + 1))[:size]
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""HTTP响应缓存"""
+
+import os
+import time
+import tempfile
+import unittest
+
+import tests  # noqa: F401
+from fake_canvas import FakeCanvasServer, FakeCanvasConfig
+
+from canvas_cache import ResponseCache
+from canvas_engine import CanvasSession, CanvasClient
+
+HEADERS = {"etag": 'W/"1"', "last-modified": "Sun, 01 Sep 2024 00:00:00 GMT"}
+
+
+class ResponseCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.temp.name, "cache", "http-cache.db")
+
+    def tearDown(self):
+        self.temp.cleanup()
+
+    def open(self, **kwargs):
+        cache = ResponseCache(self.path, **kwargs)
+        self.addCleanup(cache.close)
+        return cache
+
+    def test_put_and_get(self):
+        cache = self.open()
+        self.assertIsNone(cache.get("https://canvas/a", "token"))
+        cache.put("https://canvas/a", "token", HEADERS, b"[1]")
+        cached = cache.get("https://canvas/a", "token")
+        self.assertEqual(cached.body, b"[1]")
+        self.assertEqual(cached.headers, HEADERS)
+        self.assertEqual(cached.conditional_headers(),
+                         {"If-None-Match": 'W/"1"', "If-Modified-Since": HEADERS["last-modified"]})
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o600)
+
+    def test_keyed_by_token(self):
+        cache = self.open()
+        cache.put("https://canvas/a", "token", HEADERS, b"[1]")
+        self.assertIsNone(cache.get("https://canvas/a", "other-token"))
+        # 数据库中不保存令牌本身
+        cache.put("https://canvas/b", "secret-token-123", HEADERS, b"[2]")
+        keys = [row[0] for row in cache._db.execute("SELECT key FROM responses")]
+        self.assertEqual(len(keys), 2)
+        self.assertFalse(any("secret-token-123" in key for key in keys))
+
+    def test_touch_updates_validated(self):
+        cache = self.open()
+        cache.put("https://canvas/a", "token", HEADERS, b"[1]")
+        cached = cache.get("https://canvas/a", "token")
+        cache._db.execute("UPDATE responses SET validated = 0")
+        self.assertGreater(cache.get("https://canvas/a", "token").age(), 3600)
+        cache.touch(cached)
+        self.assertLess(cache.get("https://canvas/a", "token").age(), 60)
+
+    def test_ttl_expiry(self):
+        cache = self.open(ttl=60)
+        cache.put("https://canvas/a", "token", HEADERS, b"[1]")
+        cache.put("https://canvas/b", "token", HEADERS, b"[2]")
+        with cache._db:
+            cache._db.execute("UPDATE responses SET accessed = ? WHERE key LIKE '%/a'", (time.time() - 120,))
+        self.assertIsNone(cache.get("https://canvas/a", "token"))
+        self.assertIsNotNone(cache.get("https://canvas/b", "token"))
+        cache.close()
+        # 打开时删除过期的响应
+        time.sleep(0.2)
+        cache = self.open(ttl=0.1)
+        self.assertEqual(cache._size, 0)
+
+    def test_lru_eviction(self):
+        cache = self.open(max_bytes=5000)
+        body = b"x" * 1000
+        for name in "abcd":
+            cache.put(f"https://canvas/{name}", "token", HEADERS, body)
+            time.sleep(0.01)
+        # 最近使用过的a不会被淘汰
+        self.assertIsNotNone(cache.get("https://canvas/a", "token"))
+        cache.put("https://canvas/e", "token", HEADERS, body)
+        self.assertLessEqual(cache._size, 5000 * 0.9)
+        self.assertIsNotNone(cache.get("https://canvas/a", "token"))
+        self.assertIsNotNone(cache.get("https://canvas/e", "token"))
+        self.assertIsNone(cache.get("https://canvas/b", "token"))
+        self.assertEqual(cache._size, cache._db.execute("SELECT SUM(size) FROM responses").fetchone()[0])
+
+
+class CachedSessionTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = FakeCanvasServer(FakeCanvasConfig(courses=1, files=25, page_size=10)).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def setUp(self):
+        self.temp = tempfile.TemporaryDirectory()
+        self.cache = ResponseCache(os.path.join(self.temp.name, "http-cache.db"))
+        self.session = CanvasSession(cache=self.cache)
+
+    def tearDown(self):
+        self.session.close()
+        self.cache.close()
+        self.temp.cleanup()
+
+    def list_files(self):
+        client = CanvasClient(self.session, self.server.base_url, "test-token")
+        return list(client.list_files(1))
+
+    def test_not_modified_uses_cached_pages(self):
+        first = self.list_files()
+        self.assertEqual(self.cache.misses, 3)
+        not_modified = self.server.stats.not_modified
+        second = self.list_files()
+        # 页面按完成顺序产出，比较时不考虑顺序
+        self.assertEqual(sorted(second, key=lambda f: f["id"]), sorted(first, key=lambda f: f["id"]))
+        self.assertEqual(self.cache.revalidated, 3)
+        self.assertEqual(self.server.stats.not_modified - not_modified, 3)
+
+    def test_changed_page_refetched(self):
+        self.list_files()
+        files = self.server.list_files(1)
+        removed = files.pop()
+        try:
+            second = self.list_files()
+        finally:
+            files.append(removed)
+        self.assertEqual(len(second), 24)
+        self.assertGreaterEqual(self.cache.misses, 4)
+
+    def test_max_age_skips_request(self):
+        url = f"{self.server.base_url}/api/v1/courses/1"
+        self.session.get_json(url, "test-token")
+        requests = self.server.stats.requests
+        data, _ = self.session.get_json(url, "test-token", max_age=60)
+        self.assertEqual(data["course_code"], "BENCH1")
+        self.assertEqual(self.server.stats.requests, requests)
+        self.assertEqual(self.cache.hits, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""后台同步服务：通过socket提交请求"""
+
+import os
+import json
+import time
+import tempfile
+import threading
+import unittest
+
+from tests import expected_content
+from fake_canvas import FakeCanvasServer, FakeCanvasConfig
+
+from canvas_daemon import SyncService, DaemonClient, daemon_running, USE_UNIX_SOCKET, DONE
+from canvas_events import FILE_DONE, ERROR, SUMMARY
+from canvas_manifest import get_manifest
+
+
+class DaemonTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp = tempfile.TemporaryDirectory()
+        self.address = os.path.join(self.temp.name, "daemon.sock" if USE_UNIX_SOCKET else "daemon.json")
+        self.download_dir = os.path.join(self.temp.name, "downloads")
+        self.service = SyncService(self.address)
+        self.thread = threading.Thread(target=self.service.serve_forever, daemon=True)
+        self.thread.start()
+        deadline = time.monotonic() + 10
+        while not daemon_running(self.address):
+            self.assertLess(time.monotonic(), deadline, "后台服务没有启动")
+            time.sleep(0.05)
+        self.client = DaemonClient(self.address)
+
+    def tearDown(self):
+        self.client.shutdown()
+        self.thread.join(10)
+        if os.path.isdir(self.download_dir):
+            get_manifest(self.download_dir).close()
+        self.temp.cleanup()
+
+    def start_canvas(self, **options):
+        server = FakeCanvasServer(FakeCanvasConfig(**options)).start()
+        self.addCleanup(server.stop)
+        return server
+
+    def config(self, server):
+        return {"canvasURL": server.base_url, "token": "test-token", "courseIDs": server.course_ids(),
+                "downloadDir": self.download_dir}
+
+    def downloaded_files(self):
+        return [os.path.join(root, name) for root, _, names in os.walk(self.download_dir)
+                for name in names if name.endswith(".bin")]
+
+    def test_ping(self):
+        self.assertTrue(self.client.ping())
+        # 只有当前用户可以连接
+        self.assertEqual(os.stat(self.address).st_mode & 0o077, 0)
+
+    def test_sync(self):
+        server = self.start_canvas(courses=1, files=12, size=3000)
+        events = []
+        self.assertTrue(self.client.sync(self.config(server), events.append, course_ids=[1]))
+        self.assertEqual(sum(1 for event in events if event["event"] == FILE_DONE), 12)
+        self.assertEqual([event["success"] for event in events if event["event"] == SUMMARY], [True])
+        files = self.downloaded_files()
+        self.assertEqual(len(files), 12)
+        with open(files[0], "rb") as f:
+            self.assertEqual(f.read(), expected_content(3000))
+
+    def test_invalid_config(self):
+        events = []
+        server = self.start_canvas(courses=1, files=1)
+        self.assertFalse(self.client.sync(dict(self.config(server), segments=0), events.append))
+        self.assertEqual(events[0]["event"], ERROR)
+
+    def test_wrong_token(self):
+        # Unix socket不使用令牌，这里直接设置服务端的令牌
+        self.service.token = "secret"
+        try:
+            events = list(self.client.request({"op": "ping", "token": "wrong"}))
+            self.assertEqual([event["event"] for event in events], [ERROR])
+            self.assertFalse(self.client.ping())
+            events = list(self.client.request({"op": "ping", "token": "secret"}))
+            self.assertEqual(events[0]["event"], "pong")
+        finally:
+            self.service.token = None
+
+    def test_disconnect_cancels_sync(self):
+        server = self.start_canvas(courses=1, files=300, size=1000, latency=0.01)
+        events = self.client.request({"op": "sync", "config": self.config(server), "options": {}})
+        for event in events:
+            if event["event"] == FILE_DONE:
+                break
+        # 关闭连接，相当于图形界面停止了任务
+        events.close()
+        time.sleep(0.5)
+        requests = server.stats.requests
+        time.sleep(0.5)
+        self.assertEqual(server.stats.requests, requests)
+        self.assertLess(len(self.downloaded_files()), 300)
+        # 之后的请求不受影响
+        self.assertTrue(self.client.ping())
+
+    def test_unknown_op(self):
+        events = list(self.client.request({"op": "reboot"}))
+        self.assertEqual(events[0]["event"], ERROR)
+        self.assertNotIn(DONE, [event["event"] for event in events])
+
+    def test_invalid_request_line(self):
+        sock, _ = self.client._connect()
+        with sock:
+            sock.sendall(b"not json\n")
+            reply = json.loads(sock.makefile("r", encoding="utf-8").readline())
+        self.assertEqual(reply["event"], ERROR)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""内置同步引擎：列表分页、下载和第二次同步时跳过"""
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from tests import expected_content
+from fake_canvas import FakeCanvasServer, FakeCanvasConfig
+
+from canvas_engine import CanvasSession, CanvasClient, sync_course, normalize_config, local_path_for
+from canvas_manifest import get_manifest
+
+
+class EngineTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = FakeCanvasServer(FakeCanvasConfig(courses=1, files=25, size=3000, page_size=10)).start()
+        cls.session = CanvasSession()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.session.close()
+        cls.server.stop()
+
+    def setUp(self):
+        self.temp = tempfile.TemporaryDirectory()
+        self.download_dir = os.path.join(self.temp.name, "downloads")
+        self.settings = normalize_config({"canvasURL": self.server.base_url, "token": "test-token",
+                                          "courseIDs": [1], "downloadDir": self.download_dir})
+
+    def tearDown(self):
+        if os.path.isdir(self.download_dir):
+            get_manifest(self.download_dir).close()
+        self.temp.cleanup()
+
+    def downloaded_files(self):
+        return sorted(os.path.join(root, name) for root, _, names in os.walk(self.download_dir)
+                      for name in names if name.endswith(".bin"))
+
+    def test_list_files_follows_pagination(self):
+        client = CanvasClient(self.session, self.server.base_url, "test-token")
+        files = list(client.list_files(1))
+        self.assertEqual(len(files), 25)
+        self.assertEqual(len({f["id"] for f in files}), 25)
+
+    def test_sync_downloads_then_skips(self):
+        result = sync_course(self.session, self.settings, 1)
+        self.assertTrue(result.success, result.errors)
+        self.assertEqual(result.files_found, 25)
+        self.assertEqual(result.files_downloaded, 25)
+        self.assertEqual(result.bytes_downloaded, 25 * 3000)
+
+        files = self.downloaded_files()
+        self.assertEqual(len(files), 25)
+        self.assertTrue(any(os.sep + "Lectures" + os.sep in path for path in files))
+        with open(files[0], "rb") as f:
+            self.assertEqual(f.read(), expected_content(3000))
+
+        again = sync_course(self.session, self.settings, 1)
+        self.assertTrue(again.success, again.errors)
+        self.assertEqual(again.files_downloaded, 0)
+        self.assertEqual(again.files_skipped, 25)
+
+    def test_deleted_file_is_downloaded_again(self):
+        sync_course(self.session, self.settings, 1)
+        os.remove(self.downloaded_files()[0])
+        result = sync_course(self.session, self.settings, 1)
+        self.assertEqual(result.files_downloaded, 1)
+
+    def test_missing_course_is_not_retryable(self):
+        events = []
+        result = sync_course(self.session, self.settings, 99, events=events.append)
+        self.assertFalse(result.success)
+        self.assertFalse(result.retryable)
+        self.assertEqual(events[-1]["event"], "summary")
+
+
+
+class LocalPathTest(unittest.TestCase):
+
+    def test_paths_stay_inside_download_dir(self):
+        folders = [{"id": 1, "full_name": "course files/../../x"},
+                   {"id": 2, "full_name": "course files/Lectures/./Week 1"},
+                   {"id": 3, "full_name": "course files/ .. /a:b"}]
+        client = CanvasClient(None, "https://canvas.example.edu", "token")
+        with mock.patch.object(CanvasClient, "iter_paginated", return_value=folders):
+            folders = client.list_folders(1)
+        self.assertEqual(folders, {1: "x", 2: os.path.join("Lectures", "Week 1"), 3: "a_b"})
+
+        download_dir = os.path.abspath("downloads")
+        settings = {"download_dir": download_dir}
+        cases = [("CS101", 1, "notes.pdf", os.path.join("CS101", "x", "notes.pdf")),
+                 ("..", 2, "..", os.path.join("_", "Lectures", "Week 1", "_")),
+                 ("CS/101", 3, "../../.bashrc", os.path.join("CS_101", "a_b", ".._.._.bashrc"))]
+        for course_code, folder_id, name, expected in cases:
+            path = local_path_for(settings, course_code, folders, {"id": 5, "folder_id": folder_id,
+                                                                   "display_name": name})
+            self.assertEqual(path, os.path.join(download_dir, expected))
+            self.assertTrue(os.path.normpath(path).startswith(download_dir + os.sep))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""文件筛选规则"""
+
+import re
+import unittest
+from datetime import datetime, timezone
+
+import tests  # noqa: F401
+from canvas_filters import FileFilter, glob_to_regex, parse_date, parse_size
+
+
+def matches(pattern, path):
+    return re.fullmatch(glob_to_regex(pattern), path, re.IGNORECASE) is not None
+
+
+def file_info(name, size=1000, modified="2024-10-01T00:00:00Z", content_type=None):
+    info = {"display_name": name, "size": size, "modified_at": modified}
+    if content_type:
+        info["content-type"] = content_type
+    return info
+
+
+class GlobTest(unittest.TestCase):
+
+    def test_single_star_stays_in_directory(self):
+        self.assertTrue(matches("*.pdf", "a.pdf"))
+        self.assertFalse(matches("*.pdf", "Lectures/a.pdf"))
+        self.assertTrue(matches("Lectures/?.pdf", "Lectures/a.pdf"))
+
+    def test_double_star(self):
+        self.assertTrue(matches("**/*.pdf", "a.pdf"))
+        self.assertTrue(matches("**/*.pdf", "Lectures/Week 1/a.pdf"))
+        self.assertTrue(matches("Lectures/**", "Lectures/Week 1/a.pdf"))
+
+    def test_plain_directory_matches_contents(self):
+        self.assertTrue(matches("Lectures", "Lectures/a.pdf"))
+        self.assertTrue(matches("Lectures/", "Lectures/Week 1/a.pdf"))
+        self.assertTrue(matches("Lectures/a.pdf", "Lectures/a.pdf"))
+        self.assertFalse(matches("Lectures", "Lectures2/a.pdf"))
+
+    def test_special_characters_escaped(self):
+        self.assertTrue(matches("notes (1).txt", "notes (1).txt"))
+        self.assertFalse(matches("a.pdf", "axpdf"))
+
+
+class ParseTest(unittest.TestCase):
+
+    def test_parse_size(self):
+        self.assertEqual(parse_size(123), 123)
+        self.assertEqual(parse_size("200MB"), 200 * 1000 ** 2)
+        self.assertEqual(parse_size("1.5 GiB"), int(1.5 * 1024 ** 3))
+        self.assertEqual(parse_size("10k"), 10000)
+        for value in ("", "MB", "10 parsecs"):
+            with self.assertRaises(ValueError):
+                parse_size(value)
+
+    def test_parse_date(self):
+        midnight = datetime(2024, 9, 1, tzinfo=timezone.utc).timestamp()
+        self.assertEqual(parse_date("2024-09-01"), midnight)
+        self.assertEqual(parse_date("2024-09-01T08:00:00Z"), midnight + 8 * 3600)
+        self.assertEqual(parse_date("2024-09-01T08:00:00+08:00"), midnight)
+        self.assertEqual(parse_date("2024-09-01T08:00:00-0130"), midnight + 9.5 * 3600)
+        self.assertAlmostEqual(parse_date("2024-09-01T00:00:00.250Z"), midnight + 0.25)
+        self.assertEqual(parse_date("2024-09-01 00:30"), midnight + 1800)
+
+    def test_parse_date_invalid(self):
+        for value in ("yesterday", "2024-13-01", "2024-09-01T25:00:00Z"):
+            with self.assertRaises(ValueError):
+                parse_date(value)
+
+
+class FileFilterTest(unittest.TestCase):
+
+    def test_legacy_settings(self):
+        file_filter = FileFilter.from_settings({"excludes": ["exe"], "filesize_thresh": 1, "allow_video": False})
+        self.assertTrue(file_filter.allows(file_info("a.pdf")))
+        self.assertFalse(file_filter.allows(file_info("setup.exe")))
+        self.assertFalse(file_filter.allows(file_info("big.pdf", size=2000000)))
+        self.assertFalse(file_filter.allows(file_info("lecture.mp4")))
+        self.assertEqual(file_filter.query_params(), [("exclude_content_types[]", "video")])
+
+    def test_include_path_and_exclude(self):
+        file_filter = FileFilter.from_settings({"filters": {
+            "include": [{"path": "Lectures"}, {"ext": "pptx"}],
+            "exclude": [{"ext": ["mp4"], "min_size": "200MB"}],
+        }})
+        self.assertTrue(file_filter.uses_path)
+        self.assertTrue(file_filter.allows(file_info("a.pdf"), "Lectures"))
+        self.assertTrue(file_filter.allows(file_info("b.pptx"), "Other"))
+        self.assertFalse(file_filter.allows(file_info("a.pdf"), "Other"))
+        self.assertTrue(file_filter.allows(file_info("small.mp4", size=1000), "Lectures"))
+        self.assertFalse(file_filter.allows(file_info("big.mp4", size=300 * 1000 ** 2), "Lectures"))
+
+    def test_top_level_dates(self):
+        file_filter = FileFilter.from_settings({"filters": {"modified_after": "2024-09-01"}})
+        self.assertTrue(file_filter.allows(file_info("new.pdf", modified="2024-09-01T00:00:00.5Z")))
+        self.assertFalse(file_filter.allows(file_info("old.pdf", modified="2024-08-31T23:00:00-00:30")))
+
+    def test_content_type_query_params(self):
+        file_filter = FileFilter.from_settings({"filters": {"include": [{"content_type": ["application/pdf"]}]}})
+        self.assertEqual(file_filter.query_params(), [("content_types[]", "application/pdf")])
+        self.assertTrue(file_filter.allows(file_info("a.pdf")))
+        self.assertFalse(file_filter.allows(file_info("a.docx", content_type="application/msword")))
+
+    def test_invalid_rules(self):
+        for filters in ({"include": [{"size": 1}]}, {"include": ["*.pdf"]}, {"exclude": [{"regex": "("}]},
+                        {"include": [{"min_size": "lots"}]}, ["*.pdf"]):
+            with self.assertRaises(ValueError):
+                FileFilter.from_settings({"filters": filters})
+
+
+if __name__ == '__main__':
+    unittest.main()
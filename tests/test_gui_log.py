@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""下载线程的批量日志"""
+
+import time
+import unittest
+
+import tests  # noqa: F401
+
+try:
+    from canvas_downloader_gui import LogBuffer
+except ImportError:  # 没有安装PyQt5
+    LogBuffer = None
+
+
+class FakeSignal:
+    def __init__(self):
+        self.batches = []
+
+    def emit(self, message):
+        self.batches.append(message)
+
+
+@unittest.skipIf(LogBuffer is None, "需要PyQt5")
+class LogBufferTest(unittest.TestCase):
+
+    def test_progress_lines_collapse_to_latest(self):
+        signal = FakeSignal()
+        log = LogBuffer(signal)
+        log.add("开始")
+        for percent in range(0, 101, 10):
+            log.add(f"课程1 {percent}%", progress_key=1)
+        log.add("课程2 5%", progress_key=2)
+        log.add("完成")
+        log.flush()
+        self.assertEqual(signal.batches, ["开始\n课程1 100%\n课程2 5%\n完成"])
+
+    def test_empty_flush_sends_nothing(self):
+        signal = FakeSignal()
+        LogBuffer(signal).flush()
+        self.assertEqual(signal.batches, [])
+
+    def test_many_lines_are_sent_in_few_batches(self):
+        signal = FakeSignal()
+        log = LogBuffer(signal, interval=0.05)
+        log.start()
+        for i in range(20000):
+            log.add(f"第{i}行")
+        time.sleep(0.1)
+        log.add("最后一行")
+        log.stop()
+        lines = "\n".join(signal.batches).split("\n")
+        self.assertEqual(len(lines), 20001)
+        self.assertEqual(lines[-1], "最后一行")
+        self.assertLess(len(signal.batches), 100)
+
+
+if __name__ == "__main__":
+    unittest.main()
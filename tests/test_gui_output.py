@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""逐行分析canvassyncer输出"""
+
+import unittest
+
+import tests  # noqa: F401
+
+try:
+    from canvas_downloader_gui import SyncerOutput
+except ImportError:  # 没有安装PyQt5
+    SyncerOutput = None
+
+
+@unittest.skipIf(SyncerOutput is None, "需要PyQt5")
+class SyncerOutputTest(unittest.TestCase):
+
+    def test_counts_and_first_error(self):
+        output = SyncerOutput()
+        output.feed_stdout("Get 12 files!")
+        output.feed_stdout("Start to download 3 file(s)!")
+        output.feed_stdout("Error: first")
+        output.feed_stdout("Error: second")
+        self.assertEqual(output.files_found, 12)
+        self.assertEqual(output.files_downloaded, 3)
+        self.assertTrue(output.has_error())
+        self.assertEqual(output.error_message(), "Error: first")
+
+    def test_stdout_error_preferred_over_stderr(self):
+        output = SyncerOutput()
+        output.feed_stderr("warning from a library")
+        output.feed_stdout("Traceback (most recent call last):")
+        self.assertEqual(output.error_message(), "Traceback (most recent call last):")
+
+    def test_noise_is_not_an_error(self):
+        output = SyncerOutput()
+        output.feed_stderr(" 50%|#####     | 5/10", noise=True)
+        self.assertFalse(output.has_error())
+        self.assertEqual(list(output.recent), [])
+
+    def test_rate_limit_detected_in_noise(self):
+        output = SyncerOutput()
+        output.feed_stderr("403 Forbidden (Rate Limit Exceeded)", noise=True)
+        self.assertTrue(output.rate_limited)
+
+    def test_memory_is_bounded(self):
+        output = SyncerOutput(recent=5)
+        for i in range(100000):
+            output.feed_stdout(f"line {i}")
+        self.assertEqual(list(output.recent), [f"line {i}" for i in range(99995, 100000)])
+
+
+if __name__ == "__main__":
+    unittest.main()
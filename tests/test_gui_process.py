@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""canvassyncer子进程输出的读取"""
+
+import sys
+import subprocess
+import unittest
+
+import tests  # noqa: F401
+
+try:
+    from canvas_downloader_gui import read_process_output
+except ImportError:  # 没有安装PyQt5
+    read_process_output = None
+
+# 先向stderr写入远超管道缓冲区(通常64KB)的数据，再写stdout
+FLOOD_CHILD = r"""
+import sys
+line = "x" * 1023 + "\n"
+for _ in range(8 * 1024):
+    sys.stderr.write(line)
+sys.stderr.flush()
+print("Get 3 files!", flush=True)
+"""
+
+
+@unittest.skipIf(read_process_output is None, "需要PyQt5")
+class ReadProcessOutputTest(unittest.TestCase):
+
+    def start(self, code):
+        process = subprocess.Popen([sys.executable, "-c", code], stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                   universal_newlines=True)
+        self.addCleanup(process.wait)
+        self.addCleanup(process.kill)
+        return process
+
+    def test_stderr_flood_does_not_deadlock(self):
+        process = self.start(FLOOD_CHILD)
+        stderr_bytes = 0
+        stdout_lines = []
+        for name, line in read_process_output(process, timeout=30):
+            if name == "stderr":
+                stderr_bytes += len(line)
+            else:
+                stdout_lines.append(line.strip())
+        self.assertEqual(process.wait(timeout=10), 0)
+        self.assertEqual(stderr_bytes, 8 * 1024 * 1024)
+        self.assertEqual(stdout_lines, ["Get 3 files!"])
+
+    def test_timeout(self):
+        process = self.start("import time; time.sleep(30)")
+        with self.assertRaises(subprocess.TimeoutExpired):
+            for _ in read_process_output(process, timeout=0.5):
+                pass
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""持久化的任务队列"""
+
+import os
+import sys
+import tempfile
+import subprocess
+import unittest
+
+import tests
+from canvas_jobs import JobQueue, PENDING, RUNNING, DONE, FAILED, MAX_PRIORITY, MIN_PRIORITY
+
+CONFIG = {"canvasURL": "https://canvas.example.edu", "token": "t", "downloadDir": "/tmp/courses"}
+
+
+class JobQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.temp.name, "jobs.db")
+        self.queue = JobQueue(self.path)
+
+    def tearDown(self):
+        self.queue.close()
+        self.temp.cleanup()
+
+    def test_claims_highest_priority_first(self):
+        low = self.queue.add_course(CONFIG, 1, priority=0)
+        high = self.queue.add_course(CONFIG, 2, priority=5)
+        self.assertEqual(self.queue.claim().id, high)
+        job = self.queue.claim()
+        self.assertEqual((job.id, job.state, job.attempts), (low, RUNNING, 1))
+        self.assertIsNone(self.queue.claim())
+
+    def test_same_course_is_not_queued_twice(self):
+        first = self.queue.add_course(CONFIG, 1)
+        self.assertEqual(self.queue.add_course(CONFIG, 1, priority=3), first)
+        jobs = self.queue.unfinished()
+        self.assertEqual(len(jobs), 1)
+        self.assertEqual(jobs[0].priority, 3)
+
+    def test_priority_is_clamped(self):
+        job_id = self.queue.add_course(CONFIG, 1, priority=100)
+        self.assertEqual(self.queue.unfinished()[0].priority, MAX_PRIORITY)
+        self.queue.set_priority(job_id, -3)
+        self.assertEqual(self.queue.unfinished()[0].priority, MIN_PRIORITY)
+
+    def test_finish_and_release(self):
+        self.queue.add_course(CONFIG, 1)
+        self.queue.add_course(CONFIG, 2)
+        done = self.queue.claim()
+        self.queue.finish(done.id, True)
+        released = self.queue.claim()
+        self.queue.release(released.id)
+        self.assertEqual([(job.id, job.state) for job in self.queue.unfinished()], [(released.id, PENDING)])
+        self.assertEqual(self.queue.claim().attempts, 2)
+
+    def test_state_survives_reopen(self):
+        self.queue.add_course(CONFIG, 1)
+        job = self.queue.claim()
+        self.queue.record_file(job.id, 10, RUNNING, name="a.pdf")
+        self.queue.record_file(job.id, 10, DONE)
+        self.queue.record_file(job.id, 11, FAILED, error="HTTP 404")
+        self.queue.close()
+
+        self.queue = JobQueue(self.path)
+        self.assertEqual(self.queue.file_counts(job.id), {DONE: 1, FAILED: 1})
+        self.assertEqual(self.queue.requeue_interrupted(), 1)
+        self.assertEqual(self.queue.unfinished()[0].state, PENDING)
+
+    def test_requeue_skipped_while_another_instance_runs(self):
+        # 程序启动时先恢复上次的任务，然后开始下载
+        self.assertEqual(self.queue.requeue_interrupted(), 0)
+        self.queue.add_course(CONFIG, 1)
+        self.queue.claim()
+        code = (f"import sys; sys.path.insert(0, {tests.REPO_DIR!r}); from canvas_jobs import JobQueue; "
+                f"print(JobQueue({self.path!r}).requeue_interrupted())")
+        output = subprocess.check_output([sys.executable, "-c", code], universal_newlines=True)
+        self.assertEqual(output.strip(), "0")
+        self.assertEqual(self.queue.unfinished()[0].state, RUNNING)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""同步清单和本地文件索引"""
+
+import os
+import json
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+import tests  # noqa: F401
+from canvas_manifest import Manifest, open_readonly, INDEX_NAME, MANIFEST_NAME, MANIFEST_VERSION
+
+FILE_INFO = {"id": 7, "updated_at": "2024-09-01T00:00:00Z", "size": 5}
+
+
+class ManifestTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.path = os.path.join(self.root, "Lectures", "a.pdf")
+        os.makedirs(os.path.dirname(self.path))
+        with open(self.path, 'wb') as f:
+            f.write(b"hello")
+        self.manifest = Manifest(self.root).load()
+
+    def tearDown(self):
+        self.manifest.close()
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def test_record_and_is_unchanged(self):
+        self.assertFalse(self.manifest.is_unchanged(FILE_INFO, self.path))
+        self.manifest.record(FILE_INFO, self.path, etag="abc")
+        self.assertEqual(self.manifest.get(7)["etag"], "abc")
+        self.assertTrue(self.manifest.is_unchanged(FILE_INFO, self.path))
+        self.assertFalse(self.manifest.is_unchanged(dict(FILE_INFO, updated_at="2024-10-01T00:00:00Z"), self.path))
+        self.assertFalse(self.manifest.is_unchanged(FILE_INFO, self.path + ".moved"))
+
+    def test_writes_are_committed(self):
+        self.manifest.record(FILE_INFO, self.path)
+        self.manifest.local_file(self.path)
+        self.assertFalse(self.manifest._db.in_transaction)
+        # 另一个连接可以立即写入，不会遇到 database is locked
+        other = sqlite3.connect(os.path.join(self.root, INDEX_NAME), timeout=0)
+        try:
+            with other:
+                other.execute("INSERT INTO files VALUES ('8', NULL, 1, NULL, 'b.pdf')")
+        finally:
+            other.close()
+        self.assertEqual(self.manifest.get(8)["path"], "b.pdf")
+
+    def test_refresh_finds_deleted_file(self):
+        self.manifest.record(FILE_INFO, self.path)
+        self.assertEqual(self.manifest.local_file(self.path)[0], 5)
+        os.remove(self.path)
+        self.manifest.refresh()
+        self.assertIsNone(self.manifest.local_file(self.path))
+        self.assertFalse(self.manifest.is_unchanged(FILE_INFO, self.path))
+
+    def test_index_survives_reopen(self):
+        self.manifest.record(FILE_INFO, self.path)
+        self.manifest.close()
+        self.manifest = Manifest(self.root).load()
+        self.assertTrue(self.manifest.is_unchanged(FILE_INFO, self.path))
+
+    def test_file_outside_root(self):
+        outside = tempfile.NamedTemporaryFile(delete=False)
+        outside.close()
+        try:
+            self.assertEqual(self.manifest.local_file(outside.name)[0], 0)
+        finally:
+            os.remove(outside.name)
+        self.assertIsNone(self.manifest.local_file(outside.name))
+
+
+class ManifestImportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def test_imports_json_manifest(self):
+        with open(os.path.join(self.root, MANIFEST_NAME), 'w', encoding='utf-8') as f:
+            json.dump({"version": MANIFEST_VERSION,
+                       "files": {"7": {"updated_at": "2024-09-01T00:00:00Z", "size": 5, "path": "a.pdf"}}}, f)
+        manifest = Manifest(self.root).load()
+        try:
+            self.assertEqual(manifest.get(7)["path"], "a.pdf")
+        finally:
+            manifest.close()
+
+    def test_corrupt_database_rebuilt(self):
+        with open(os.path.join(self.root, INDEX_NAME), 'wb') as f:
+            f.write(b"not a database" * 100)
+        manifest = Manifest(self.root).load()
+        try:
+            self.assertIsNone(manifest.get(7))
+        finally:
+            manifest.close()
+
+    def test_readonly_does_not_create_database(self):
+        self.assertIsNone(open_readonly(os.path.join(self.root, "missing")))
+        path = os.path.join(self.root, "a.pdf")
+        with open(path, 'wb') as f:
+            f.write(b"hello")
+        manifest = open_readonly(self.root)
+        try:
+            self.assertIsNone(manifest.get(7))
+            self.assertEqual(manifest.local_file(path)[0], 5)
+        finally:
+            manifest.close()
+        self.assertFalse(os.path.exists(os.path.join(self.root, INDEX_NAME)))
+
+    def test_readonly_reads_existing_database(self):
+        path = os.path.join(self.root, "a.pdf")
+        with open(path, 'wb') as f:
+            f.write(b"hello")
+        manifest = Manifest(self.root).load()
+        manifest.record(FILE_INFO, path)
+        manifest.close()
+        readonly = open_readonly(self.root)
+        try:
+            self.assertTrue(readonly.is_unchanged(FILE_INFO, path))
+            os.remove(path)
+            readonly.refresh()
+            self.assertFalse(readonly.is_unchanged(FILE_INFO, path))
+        finally:
+            readonly.close()
+        # 只读时重新列出的目录不写回数据库
+        manifest = Manifest(self.root).load()
+        try:
+            self.assertEqual(manifest._db.execute("SELECT size FROM local_files").fetchall(), [(5,)])
+        finally:
+            manifest.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""运行指标、报告和计数器"""
+
+import os
+import csv
+import json
+import socket
+import shutil
+import tempfile
+import unittest
+
+import tests  # noqa: F401
+from canvas_events import make_event, FILE_STARTED, FILE_DONE, ERROR, SUMMARY
+from canvas_metrics import RunMetrics, Counters, start_metrics_server
+
+
+def course_events(course_id=1):
+    """一个课程：文件10下载成功(重试一次)，文件11去重链接，文件12失败"""
+    start = 1000.0
+    return [
+        dict(make_event(FILE_STARTED, course_id=course_id, file_id=10, name="a.pdf", path="a.pdf", queued=0.5),
+             time=start),
+        make_event(ERROR, course_id=course_id, file_id=10, retry=True, message="连接中断"),
+        dict(make_event(FILE_DONE, course_id=course_id, file_id=10, bytes=2 * 1024 * 1024), time=start + 2),
+        make_event(FILE_DONE, course_id=course_id, file_id=11, name="b.pdf", bytes=100, linked=True),
+        make_event(ERROR, course_id=course_id, file_id=12, name="c.pdf", message="404 Not Found"),
+        make_event(SUMMARY, course_id=course_id, course_code="CS101", success=False, elapsed=3.0,
+                   list_time=0.5, files_found=3, files_downloaded=1, files_deduplicated=1,
+                   bytes_downloaded=2 * 1024 * 1024, errors=["c.pdf: 404 Not Found"]),
+    ]
+
+
+class RunMetricsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.metrics = RunMetrics()
+        for event in course_events():
+            self.metrics.record(event, "canvas.example.edu")
+        self.metrics.finish()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_course_and_totals(self):
+        course, = self.metrics.courses
+        self.assertEqual(course["course_code"], "CS101")
+        self.assertFalse(course["success"])
+        self.assertEqual(course["files_failed"], 1)
+        self.assertEqual(course["retries"], 1)
+        self.assertEqual(course["transfer_time"], 2.0)
+        self.assertEqual(course["error"], "c.pdf: 404 Not Found")
+        totals = self.metrics.totals()
+        self.assertEqual(totals["courses"], 1)
+        self.assertEqual(totals["courses_failed"], 1)
+        self.assertEqual(totals["files_downloaded"], 1)
+        self.assertEqual(totals["files_deduplicated"], 1)
+        self.assertEqual(totals["bytes_downloaded"], 2 * 1024 * 1024)
+
+    def test_transfer_samples_only_downloaded(self):
+        self.assertEqual(self.metrics.transfer_samples(), {"canvas.example.edu": [(2 * 1024 * 1024, 2.0)]})
+
+    def test_file_records(self):
+        files = {record["file_id"]: record for record in self.metrics.to_dict()["files"]}
+        self.assertEqual(files[10]["status"], "downloaded")
+        self.assertEqual(files[10]["queue_wait"], 0.5)
+        self.assertEqual(files[10]["mb_per_second"], 1.0)
+        self.assertEqual(files[11]["status"], "linked")
+        self.assertEqual(files[12]["status"], "failed")
+        self.assertEqual(files[12]["error"], "404 Not Found")
+
+    def test_json_report(self):
+        path = os.path.join(self.temp_dir, "report.json")
+        self.metrics.write_report(path)
+        with open(path, encoding='utf-8') as f:
+            report = json.load(f)
+        self.assertEqual(report["totals"]["files_failed"], 1)
+        self.assertEqual(report["hosts"]["canvas.example.edu"]["courses"], 1)
+        self.assertEqual(len(report["files"]), 3)
+
+    def test_csv_report(self):
+        path = os.path.join(self.temp_dir, "report.csv")
+        self.metrics.write_report(path)
+        with open(path, encoding='utf-8-sig', newline='') as f:
+            courses = list(csv.DictReader(f))
+        with open(os.path.join(self.temp_dir, "report.files.csv"), encoding='utf-8-sig', newline='') as f:
+            files = list(csv.DictReader(f))
+        self.assertEqual([course["course_code"] for course in courses], ["CS101"])
+        self.assertEqual(sorted(record["name"] for record in files), ["a.pdf", "b.pdf", "c.pdf"])
+
+    def test_requeued_course_counted_once(self):
+        metrics = RunMetrics()
+        first = course_events()
+        first[-1] = dict(first[-1], requeued=True)
+        for event in first:
+            metrics.record(event, "canvas.example.edu")
+        metrics.record(make_event(SUMMARY, course_id=1, course_code="CS101", success=True, elapsed=1.0,
+                                  files_downloaded=1, bytes_downloaded=1000), "canvas.example.edu")
+        # 另一个站点上ID相同的课程单独记录
+        metrics.record(make_event(SUMMARY, course_id=1, course_code="OTHER", success=True, elapsed=1.0),
+                       "other.example.edu")
+        self.assertEqual([course["course_code"] for course in metrics.courses], ["CS101", "OTHER"])
+        totals = metrics.totals()
+        self.assertEqual(totals["courses"], 2)
+        self.assertEqual(totals["courses_failed"], 0)
+        self.assertEqual(totals["bytes_downloaded"], 1000)
+
+    def test_ignores_other_events(self):
+        metrics = RunMetrics()
+        metrics.record(make_event("course_started", course_id=1))
+        metrics.record(make_event(FILE_STARTED, course_id=1))
+        self.assertEqual(metrics.to_dict()["files"], [])
+
+
+class CountersTest(unittest.TestCase):
+
+    def test_render(self):
+        counters = Counters()
+        metrics = RunMetrics(counters)
+        for event in course_events():
+            metrics.record(event, "canvas.example.edu")
+        text = counters.render()
+        self.assertIn('canvas_downloader_courses_total{host="canvas.example.edu",result="failure"} 1', text)
+        self.assertIn('canvas_downloader_files_total{host="canvas.example.edu",method="downloaded"} 1', text)
+        self.assertIn('canvas_downloader_files_total{host="canvas.example.edu",method="linked"} 1', text)
+        self.assertIn('canvas_downloader_bytes_total{host="canvas.example.edu"} 2097252', text)
+        self.assertIn('canvas_downloader_file_retries_total{host="canvas.example.edu"} 1', text)
+        self.assertIn('canvas_downloader_file_errors_total{host="canvas.example.edu"} 1', text)
+        self.assertIn("# TYPE canvas_downloader_bytes_total counter", text)
+
+    def test_requeued_summary(self):
+        counters = Counters()
+        counters.record(make_event(SUMMARY, course_id=1, success=False, requeued=True), "canvas")
+        counters.record(make_event(SUMMARY, course_id=1, success=True), "canvas")
+        text = counters.render()
+        self.assertIn('canvas_downloader_courses_total{host="canvas",result="requeued"} 1', text)
+        self.assertIn('canvas_downloader_courses_total{host="canvas",result="success"} 1', text)
+        self.assertNotIn('result="failure"', text)
+
+    def test_port_in_use(self):
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            sock.listen(1)
+            with self.assertLogs("canvas-downloader-metrics", "ERROR"):
+                self.assertIsNone(start_metrics_server(Counters(), sock.getsockname()[1]))
+
+    def test_label_escaping(self):
+        counters = Counters()
+        counters.inc("canvas_downloader_bytes_total", 5, host='a"b')
+        self.assertIn('canvas_downloader_bytes_total{host="a\\"b"} 5', counters.render())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""多个课程任务并发下载时的站点限制"""
+
+import threading
+import unittest
+from unittest import mock
+
+import tests  # noqa: F401
+import canvas_downloader
+
+
+class ParallelCoursesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.lock = threading.Lock()
+        self.running = {}
+        self.peak = {}
+        self.b_started = threading.Event()
+        self.blocked = []
+
+    def fake_download(self, config_file, timeout, course_ids=None, failures=None, **options):
+        host = config_file.split("/")[0]
+        with self.lock:
+            self.running[host] = self.running.get(host, 0) + 1
+            self.peak[host] = max(self.peak.get(host, 0), self.running[host])
+        try:
+            if config_file == "a/1":
+                # 站点a的第一个任务等待站点b的任务开始
+                self.blocked.append(not self.b_started.wait(5))
+            elif config_file.startswith("b/"):
+                self.b_started.set()
+            failures[config_file] = course_ids
+        finally:
+            with self.lock:
+                self.running[host] -= 1
+
+    def run_tasks(self, tasks, jobs, per_host):
+        with mock.patch.object(canvas_downloader, "download_course", self.fake_download), \
+                mock.patch.object(canvas_downloader, "get_canvas_host", lambda config: config.split("/")[0]):
+            return canvas_downloader.download_courses_parallel(tasks, 10, jobs, per_host)
+
+    def test_full_host_does_not_block_other_hosts(self):
+        tasks = [("a/1", [1]), ("a/2", [2]), ("b/1", [3])]
+        results = self.run_tasks(tasks, jobs=2, per_host=1)
+        # a/2 在队列中等待站点a的名额，b/1 不受影响
+        self.assertEqual(self.blocked, [False])
+        self.assertEqual(results, [{"a/1": [1]}, {"a/2": [2]}, {"b/1": [3]}])
+        self.assertEqual(self.peak, {"a": 1, "b": 1})
+
+    def test_per_host_and_jobs_limits(self):
+        self.b_started.set()
+        tasks = [("a/%d" % i, [i]) for i in range(6)] + [("b/%d" % i, [i]) for i in range(6)]
+        results = self.run_tasks(tasks, jobs=3, per_host=2)
+        self.assertEqual(results, [{config: ids} for config, ids in tasks])
+        self.assertLessEqual(self.peak["a"], 2)
+        self.assertLessEqual(self.peak["b"], 2)
+
+    def test_error_propagates(self):
+        def failing(*args, **kwargs):
+            raise RuntimeError("boom")
+        with mock.patch.object(canvas_downloader, "download_course", failing), \
+                mock.patch.object(canvas_downloader, "get_canvas_host", lambda config: config):
+            with self.assertRaises(RuntimeError):
+                canvas_downloader.download_courses_parallel([("a", [1]), ("b", [2])], 10, 2, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""同步预览和用时估计"""
+
+import os
+import tempfile
+import unittest
+
+import tests  # noqa: F401
+from fake_canvas import FakeCanvasServer, FakeCanvasConfig
+
+from canvas_engine import CanvasSession, sync_course, normalize_config
+from canvas_manifest import get_manifest, INDEX_NAME
+from canvas_metrics import (RunMetrics, ThroughputHistory, fit_transfer_time, DEFAULT_FILE_SECONDS,
+                            DEFAULT_BYTES_PER_SECOND)
+from canvas_events import make_event, FILE_STARTED, FILE_DONE
+from canvas_plan import plan_sync, plan_courses, schedule_seconds, format_duration, format_plan
+
+
+class FitTransferTimeTest(unittest.TestCase):
+
+    def test_linear_fit(self):
+        # 每个文件0.2秒固定开销，每秒1 MB
+        samples = [(nbytes, 0.2 + nbytes / 1000000) for nbytes in (1000, 500000, 2000000, 8000000)]
+        file_seconds, bytes_per_second = fit_transfer_time(samples)
+        self.assertAlmostEqual(file_seconds, 0.2, places=6)
+        self.assertAlmostEqual(bytes_per_second, 1000000, delta=1)
+
+    def test_similar_small_files_are_overhead(self):
+        self.assertEqual(fit_transfer_time([(1000, 0.1), (1000, 0.3)]), (0.2, None))
+
+    def test_similar_large_files_are_transfer(self):
+        nbytes = 10 * 1024 * 1024
+        file_seconds, bytes_per_second = fit_transfer_time([(nbytes, 2.0), (nbytes, 2.0)])
+        self.assertEqual(file_seconds, 0.0)
+        self.assertEqual(bytes_per_second, nbytes / 2.0)
+
+
+class ThroughputHistoryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.temp.name, "throughput.json")
+
+    def tearDown(self):
+        self.temp.cleanup()
+
+    def metrics(self, samples):
+        metrics = RunMetrics()
+        for file_id, (nbytes, seconds) in enumerate(samples):
+            metrics.record(dict(make_event(FILE_STARTED, course_id=1, file_id=file_id), time=100.0), "canvas")
+            metrics.record(dict(make_event(FILE_DONE, course_id=1, file_id=file_id, bytes=nbytes),
+                                time=100.0 + seconds), "canvas")
+        return metrics
+
+    def test_default_estimate(self):
+        history = ThroughputHistory(self.path).load()
+        seconds, from_history = history.estimate("canvas", 10, DEFAULT_BYTES_PER_SECOND)
+        self.assertEqual(seconds, 10 * DEFAULT_FILE_SECONDS + 1)
+        self.assertFalse(from_history)
+
+    def test_update_save_and_blend(self):
+        history = ThroughputHistory(self.path).load()
+        self.assertTrue(history.update(self.metrics([(1000, 1.0), (1000000, 2.0)])))
+        history.save()
+        history = ThroughputHistory(self.path).load()
+        entry = history.hosts["canvas"]
+        self.assertEqual(entry["runs"], 1)
+        self.assertEqual(entry["bytes_per_second"], 999000)
+        seconds, from_history = history.estimate("canvas", 2, 999000)
+        self.assertTrue(from_history)
+        self.assertAlmostEqual(seconds, 2 * entry["file_seconds"] + 1)
+        # 第二次运行只有小文件，保留原来的速度，固定开销按权重合并
+        history.update(self.metrics([(1000, 0.5), (1000, 0.5)]))
+        self.assertEqual(history.hosts["canvas"]["runs"], 2)
+        self.assertEqual(history.hosts["canvas"]["bytes_per_second"], 999000)
+        self.assertLess(history.hosts["canvas"]["file_seconds"], entry["file_seconds"])
+        self.assertFalse(history.update(RunMetrics()))
+
+    def test_corrupt_history_ignored(self):
+        with open(self.path, 'w', encoding='utf-8') as f:
+            f.write("not json")
+        self.assertEqual(ThroughputHistory(self.path).load().hosts, {})
+
+
+class ScheduleTest(unittest.TestCase):
+
+    def test_schedule_seconds(self):
+        self.assertEqual(schedule_seconds([], 4), 0.0)
+        self.assertEqual(schedule_seconds([5, 3, 2], 1), 10)
+        self.assertEqual(schedule_seconds([5, 3, 2], 2), 5)
+        self.assertEqual(schedule_seconds([4, 4, 4, 4], 3), 8)
+        self.assertEqual(schedule_seconds([5], 0), 5)
+
+    def test_format_duration(self):
+        self.assertEqual(format_duration(42.4), "42秒")
+        self.assertEqual(format_duration(125), "2分05秒")
+        self.assertEqual(format_duration(3 * 3600 + 7 * 60), "3小时07分")
+
+
+class PlanSyncTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = FakeCanvasServer(FakeCanvasConfig(courses=2, files=12, size=2000, page_size=5)).start()
+        cls.session = CanvasSession()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.session.close()
+        cls.server.stop()
+
+    def setUp(self):
+        self.temp = tempfile.TemporaryDirectory()
+        self.download_dir = os.path.join(self.temp.name, "downloads")
+        self.settings = normalize_config({"canvasURL": self.server.base_url, "token": "test-token",
+                                          "courseIDs": [1], "downloadDir": self.download_dir})
+
+    def tearDown(self):
+        if os.path.isdir(self.download_dir):
+            get_manifest(self.download_dir).close()
+        self.temp.cleanup()
+
+    def test_plan_before_first_sync(self):
+        plan = plan_sync(self.session, self.settings, 1)
+        self.assertIsNone(plan.error)
+        self.assertEqual(plan.course_code, "BENCH1")
+        self.assertEqual((plan.files_found, plan.files_new, plan.files_unchanged), (12, 12, 0))
+        self.assertEqual(plan.bytes_to_download, 12 * 2000)
+        self.assertFalse(os.path.exists(self.download_dir))
+
+    def test_plan_after_sync(self):
+        result = sync_course(self.session, self.settings, 1)
+        self.assertTrue(result.success, result.errors)
+        removed = next(os.path.join(root, name) for root, _, names in os.walk(self.download_dir)
+                       for name in names if name.endswith(".bin"))
+        os.remove(removed)
+        index_mtime = os.stat(os.path.join(self.download_dir, INDEX_NAME)).st_mtime_ns
+
+        plan = plan_sync(self.session, self.settings, 1)
+        self.assertIsNone(plan.error)
+        self.assertEqual(plan.files_unchanged, 11)
+        self.assertEqual(plan.files_changed, 1)
+        self.assertEqual(plan.bytes_changed, 2000)
+        # 预览不修改清单，之后的同步仍能发现被删除的文件
+        self.assertEqual(os.stat(os.path.join(self.download_dir, INDEX_NAME)).st_mtime_ns, index_mtime)
+        result = sync_course(self.session, self.settings, 1)
+        self.assertEqual(result.files_downloaded, 1)
+
+    def test_plan_courses_and_format(self):
+        tasks = [(self.settings, 1), (self.settings, 2), (self.settings, 99)]
+        plans = plan_courses(self.session, tasks)
+        self.assertEqual([plan.course_id for plan in plans], [1, 2, 99])
+        self.assertIsNone(plans[1].error)
+        self.assertIn("404", plans[2].error)
+        lines = format_plan(plans, ThroughputHistory(os.path.join(self.temp.name, "history.json")), jobs=2)
+        self.assertTrue(lines[1].startswith("BENCH"))
+        self.assertTrue(any("课程 99 无法预览" in line for line in lines))
+        self.assertTrue(any(line.startswith("共 2 个课程，需要下载 24 个文件") for line in lines))
+
+
+if __name__ == '__main__':
+    unittest.main()
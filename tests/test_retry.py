@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""失败重试和课程重新排队"""
+
+import socket
+import unittest
+from unittest import mock
+
+import tests  # noqa: F401
+import canvas_downloader
+from canvas_engine import CanvasAPIError
+from canvas_partial import IncompleteDownloadError
+from canvas_retry import RetryPolicy, is_transient
+from canvas_events import make_event, SUMMARY
+
+
+class IsTransientTest(unittest.TestCase):
+
+    def test_http_status(self):
+        self.assertTrue(is_transient(CanvasAPIError(503, "Service Unavailable")))
+        self.assertTrue(is_transient(CanvasAPIError(429, "Too Many Requests")))
+        self.assertTrue(is_transient(CanvasAPIError(403, "403 Forbidden (Rate Limit Exceeded)")))
+        self.assertFalse(is_transient(CanvasAPIError(403, "unauthorized")))
+        self.assertFalse(is_transient(CanvasAPIError(404, "not found")))
+        self.assertFalse(is_transient(CanvasAPIError(401, "invalid token")))
+
+    def test_exceptions(self):
+        self.assertTrue(is_transient(ConnectionResetError()))
+        self.assertTrue(is_transient(socket.timeout()))
+        self.assertTrue(is_transient(IncompleteDownloadError("short read")))
+        self.assertFalse(is_transient(ValueError("bad config")))
+        self.assertFalse(is_transient(PermissionError()))
+
+
+class RetryPolicyTest(unittest.TestCase):
+
+    def test_should_retry_counts_attempts(self):
+        policy = RetryPolicy(2)
+        error = ConnectionResetError()
+        self.assertEqual([policy.should_retry(error, attempt) for attempt in range(3)], [True, True, False])
+        self.assertFalse(policy.should_retry(CanvasAPIError(404, "not found"), 0))
+
+    def test_delay_is_jittered_exponential_and_capped(self):
+        policy = RetryPolicy(base_delay=1.0, max_delay=5.0)
+        for attempt, full in ((0, 1.0), (1, 2.0), (2, 4.0), (6, 5.0)):
+            for _ in range(20):
+                delay = policy.delay(attempt)
+                self.assertGreaterEqual(delay, full / 2)
+                self.assertLessEqual(delay, full)
+
+
+class CourseRequeueTest(unittest.TestCase):
+
+    def run_courses(self, outcomes):
+        """outcomes: {课程ID: [每一轮的结果]}，结果为None(成功)、"transient" 或 "permanent" """
+        calls = []
+        self.requeue = []
+
+        def fake_download_course(config_file, timeout, course_ids=None, failures=None, **options):
+            self.requeue.append(options.get("requeue"))
+            for course_id in course_ids or sorted(outcomes):
+                calls.append(course_id)
+                outcome = outcomes[course_id].pop(0)
+                if outcome:
+                    failures[course_id] = outcome == "transient"
+            return not failures
+
+        with mock.patch.object(canvas_downloader, "download_course", fake_download_course), \
+                mock.patch.object(canvas_downloader.time, "sleep"):
+            succeeded = canvas_downloader.download_courses(["a.json"], None, course_retry=RetryPolicy(2))
+        return succeeded, calls
+
+    def test_transient_failure_is_requeued_alone(self):
+        succeeded, calls = self.run_courses({1: [None], 2: ["transient", "transient", None]})
+        self.assertEqual(succeeded, 1)
+        self.assertEqual(calls, [1, 2, 2, 2])
+
+    def test_permanent_failure_is_not_requeued(self):
+        succeeded, calls = self.run_courses({1: ["permanent"], 2: [None]})
+        self.assertEqual(succeeded, 0)
+        self.assertEqual(calls, [1, 2])
+
+    def test_gives_up_after_retries(self):
+        succeeded, calls = self.run_courses({1: ["transient"] * 3})
+        self.assertEqual(succeeded, 0)
+        self.assertEqual(calls, [1, 1, 1])
+        # 只有最后一轮的失败是最终结果
+        self.assertEqual(self.requeue, [True, True, False])
+
+    def test_track_failures_marks_requeued_summary(self):
+        for requeue, retryable, expected in ((True, True, True), (True, False, None), (False, True, None)):
+            events, failures = [], {}
+            on_event = canvas_downloader.track_failures(events.append, failures, requeue)
+            on_event(make_event(SUMMARY, course_id=1, success=False, retryable=retryable))
+            self.assertEqual(failures, {1: retryable})
+            self.assertEqual(events[0].get("requeued"), expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
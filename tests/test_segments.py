@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""大文件分段下载和断点续传"""
+
+import os
+import asyncio
+import tempfile
+import unittest
+
+from tests import expected_content
+from fake_canvas import FakeCanvasServer, FakeCanvasConfig
+
+from canvas_engine import CanvasSession, CanvasClient, download_file
+from canvas_async import AsyncConnectionPool, download_file_async
+from canvas_partial import PartialDownload
+from canvas_segments import SegmentPolicy, split_ranges
+
+SIZE = 1000000
+
+
+class SplitRangesTest(unittest.TestCase):
+
+    def test_even_split(self):
+        self.assertEqual(split_ranges([[0, 100]], 4, min_size=1), [[0, 25], [25, 50], [50, 75], [75, 100]])
+
+    def test_min_size(self):
+        self.assertEqual(split_ranges([[0, 100]], 4, min_size=60), [[0, 100]])
+        self.assertEqual(split_ranges([[0, 100]], 4, min_size=40), [[0, 50], [50, 100]])
+
+    def test_missing_ranges_cover_holes_only(self):
+        pieces = split_ranges([[0, 10], [50, 130]], 3, min_size=1)
+        self.assertEqual(sum(end - start for start, end in pieces), 90)
+        self.assertTrue(all(start >= 50 or end <= 10 for start, end in pieces))
+        self.assertEqual(split_ranges([], 4), [])
+
+    def test_should_split(self):
+        policy = SegmentPolicy(4, threshold=1000)
+        self.assertTrue(policy.should_split(1001))
+        self.assertFalse(policy.should_split(1000))
+        self.assertFalse(policy.should_split(None))
+        self.assertFalse(SegmentPolicy(1, threshold=1000).should_split(10 ** 9))
+
+    def test_from_settings(self):
+        policy = SegmentPolicy.from_settings({"segments": 2, "segment_threshold": 5000000})
+        self.assertEqual((policy.segments, policy.threshold), (2, 5000000))
+
+
+class SegmentedDownloadTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = FakeCanvasServer(FakeCanvasConfig(courses=1, files=1, size=SIZE)).start()
+        cls.session = CanvasSession()
+        client = CanvasClient(cls.session, cls.server.base_url, "test-token")
+        cls.file_info = next(iter(client.list_files(1)))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.session.close()
+        cls.server.stop()
+
+    def setUp(self):
+        self.temp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.temp.name, "course", "big.bin")
+        self.policy = SegmentPolicy(4, threshold=SIZE // 10, min_size=100000)
+
+    def tearDown(self):
+        self.temp.cleanup()
+
+    def download(self):
+        requests = self.server.stats.requests
+        written, _ = download_file(self.session, "test-token", self.file_info, self.path, segments=self.policy)
+        with open(self.path, "rb") as f:
+            self.assertEqual(f.read(), expected_content(SIZE))
+        self.assertFalse(os.path.exists(self.path + ".part"))
+        return written, self.server.stats.requests - requests
+
+    def prepare_partial(self, ranges):
+        """模拟中断的下载：.part 中只有ranges部分是有效数据"""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        content = expected_content(SIZE)
+        with open(self.path + ".part", "wb") as f:
+            f.truncate(SIZE)
+            for start, end in ranges:
+                f.seek(start)
+                f.write(content[start:end])
+        partial = PartialDownload(self.path, self.file_info)
+        partial.ranges = ranges
+        partial.save()
+
+    def test_segmented_download(self):
+        written, requests = self.download()
+        self.assertEqual(written, SIZE)
+        # 第一段请求之外还有至少3个并行的范围请求
+        self.assertGreaterEqual(requests, 4)
+
+    def test_resume_fetches_missing_ranges(self):
+        self.prepare_partial([[0, 250000], [600000, 700000]])
+        written, _ = self.download()
+        self.assertEqual(written, SIZE - 350000)
+
+    def test_complete_journal_finishes_locally(self):
+        self.prepare_partial([[0, SIZE]])
+        written, requests = self.download()
+        self.assertEqual((written, requests), (0, 0))
+
+    def test_single_connection_resume(self):
+        self.policy = SegmentPolicy(1)
+        self.prepare_partial([[0, 400000]])
+        written, _ = self.download()
+        self.assertEqual(written, SIZE - 400000)
+
+
+class AsyncSegmentedDownloadTest(SegmentedDownloadTest):
+    """asyncio引擎的分段下载，与同步引擎的结果相同"""
+
+    def download(self):
+        requests = self.server.stats.requests
+
+        async def run():
+            # 连接数少于分段数，各段排队使用连接
+            pool = AsyncConnectionPool(2)
+            try:
+                return await download_file_async(pool, "test-token", self.file_info, self.path,
+                                                 segments=self.policy)
+            finally:
+                await pool.close()
+
+        loop = asyncio.new_event_loop()
+        try:
+            written, _ = loop.run_until_complete(run())
+        finally:
+            loop.close()
+        with open(self.path, "rb") as f:
+            self.assertEqual(f.read(), expected_content(SIZE))
+        self.assertFalse(os.path.exists(self.path + ".part"))
+        return written, self.server.stats.requests - requests
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""监视模式的课程指纹和轮询调度"""
+
+import os
+import json
+import time
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import tests  # noqa: F401
+from fake_canvas import FakeCanvasServer, FakeCanvasConfig
+
+import canvas_downloader
+from canvas_engine import CanvasSession, normalize_config
+from canvas_watch import CourseWatcher, course_fingerprint
+
+
+class CourseWatcherTest(unittest.TestCase):
+
+    def test_changed_and_forget(self):
+        watcher = CourseWatcher()
+        self.assertTrue(watcher.changed("a", "1:10:t"))
+        self.assertFalse(watcher.changed("a", "1:10:t"))
+        self.assertTrue(watcher.changed("a", "2:11:t"))
+        watcher.forget("a")
+        self.assertTrue(watcher.changed("a", "2:11:t"))
+
+    def test_wait_returns_earliest_course(self):
+        watcher = CourseWatcher()
+        watcher.add("later", delay=0.05)
+        watcher.add("first")
+        watcher.add("second")
+        self.assertEqual([watcher.wait() for _ in range(3)], ["first", "second", "later"])
+
+    def test_pop_due(self):
+        watcher = CourseWatcher()
+        watcher.add("a")
+        watcher.add("b")
+        watcher.add("later", delay=60)
+        self.assertEqual(watcher.wait(), "a")
+        self.assertEqual(watcher.pop_due(), ["b"])
+        self.assertEqual(watcher.pop_due(), [])
+
+    def test_schedule_stays_within_jitter(self):
+        watcher = CourseWatcher(interval=100, jitter=0.2)
+        now = time.monotonic()
+        for i in range(50):
+            watcher.schedule(i)
+        for due, _, _ in watcher._due:
+            self.assertGreaterEqual(due - now, 80)
+            self.assertLessEqual(due - now, 120.5)
+
+
+class FingerprintTest(unittest.TestCase):
+
+    def test_fingerprint_follows_file_count(self):
+        server = FakeCanvasServer(FakeCanvasConfig(courses=1, files=7)).start()
+        session = CanvasSession()
+        self.addCleanup(server.stop)
+        self.addCleanup(session.close)
+        settings = normalize_config({"canvasURL": server.base_url, "token": "t", "courseIDs": [1],
+                                     "downloadDir": "unused"})
+        first = course_fingerprint(session, settings, 1)
+        self.assertTrue(first.startswith("7:"))
+        self.assertEqual(course_fingerprint(session, settings, 1), first)
+
+        files = server.list_files(1)
+        files.append(dict(files[0], id=files[0]["id"] + 100))
+        self.assertTrue(course_fingerprint(session, settings, 1).startswith("8:"))
+
+
+class WatchCoursesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp = tempfile.TemporaryDirectory()
+        self.config_file = os.path.join(self.temp.name, "config.json")
+        with open(self.config_file, "w", encoding="utf-8") as f:
+            json.dump({"canvasURL": "https://canvas.example.edu", "token": "t", "courseIDs": [1, 2, 3],
+                       "downloadDir": os.path.join(self.temp.name, "downloads")}, f)
+        self.watchers = []
+
+    def tearDown(self):
+        self.temp.cleanup()
+
+    def watch(self, download_course, cycles=1, **options):
+        """运行cycles轮监视，返回使用的CourseWatcher"""
+        test = self
+
+        class Watcher(CourseWatcher):
+            def __init__(self, interval):
+                super().__init__(interval)
+                self.cycles = 0
+                test.watchers.append(self)
+
+            def wait(self):
+                if self.cycles == cycles:
+                    raise KeyboardInterrupt
+                self.cycles += 1
+                return super().wait()
+
+        with mock.patch.object(canvas_downloader, "CourseWatcher", Watcher), \
+                mock.patch.object(canvas_downloader, "course_fingerprint", lambda session, settings, course_id: "1:1:t"), \
+                mock.patch.object(canvas_downloader, "download_course", download_course):
+            with self.assertRaises(KeyboardInterrupt):
+                canvas_downloader.watch_courses([self.config_file], 10, 600, None, **options)
+        return self.watchers[0]
+
+    def test_changed_courses_sync_concurrently(self):
+        barrier = threading.Barrier(3, timeout=5)
+        synced = []
+
+        def download_course(config_file, timeout, course_ids=None, failures=None, **options):
+            synced.extend(course_ids)
+            # 三个课程同时在同步时才能通过
+            barrier.wait()
+            if 2 in course_ids:
+                failures[2] = False
+
+        watcher = self.watch(download_course, jobs=3, per_host=3)
+        self.assertEqual(sorted(synced), [1, 2, 3])
+        # 同步失败的课程下一轮重新同步
+        self.assertEqual(sorted(course_id for _, course_id in watcher.fingerprints), [1, 3])
+
+    def test_serial_cycle(self):
+        calls = []
+
+        def download_course(config_file, timeout, course_ids=None, failures=None, **options):
+            calls.append(course_ids)
+
+        watcher = self.watch(download_course)
+        self.assertEqual(calls, [[1], [2], [3]])
+        self.assertEqual(len(watcher.fingerprints), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()